@@ -8,6 +8,8 @@ class BatteryCell(ABC):
     parameters will be updated after Model calculation 
     :func _update_parameter() 
     """
+    # 仿真过程中随时间更新的属性，get_state/set_state 读写这些属性
+    STATE_ATTRS = ('T_bat', 'OCV', 'max_I_charge', 'max_I_discharge', 'Ah_discharge_max', 'SOC_min', 'worktime')
     def __init__(self, dt, T_bat=35, N_cycle=1500, SOH=1):
         
         # ==========================================电池Cell基本属性的初始化
@@ -83,6 +85,20 @@ class BatteryCell(ABC):
         return SOC
         
 
+    def get_state(self):
+        """
+        获取模型的动态状态，用于在另一个模型实例上复现当前状态
+        """
+        return {name: getattr(self, name) for name in self.STATE_ATTRS}
+
+    def set_state(self, state):
+        """
+        设置模型的动态状态
+        :param state: get_state 返回的字典
+        """
+        for name, value in state.items():
+            setattr(self, name, value)
+
     @abstractmethod
     def battery_model(self, *args, **kwargs):
         pass
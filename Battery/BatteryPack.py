@@ -1,9 +1,19 @@
-from utils.math_utils import sqrt, min, max
+import numpy as np
+from utils.math_utils import get_math_backend
 from Battery.BatteryCell import BatteryCell
 
 class BatteryPack(BatteryCell):
-    def __init__(self, dt, T_amb=25):
+    # 在电池Cell的动态状态之外，pack的电流限制也随SOC更新
+    STATE_ATTRS = BatteryCell.STATE_ATTRS + ('I_max_limit', 'I_min_limit')
+
+    def __init__(self, dt, T_amb=25, math_backend='casadi'):
+        """
+        :param dt: 时间步长 (s)
+        :param T_amb: 环境温度 (℃)
+        :param math_backend: 数学后端，MPC的控制模型用 'casadi'，仿真模型可用 'numpy' 加快数值计算
+        """
         super().__init__(dt)
+        self.math = get_math_backend(math_backend)
         self.N_series = 278
         self.N_parallel = 10
         self.N_cell = self.N_series * self.N_parallel
@@ -27,9 +37,9 @@ class BatteryPack(BatteryCell):
         # P_cell <= OCV**2 / (4*R_cell)
         #P_cell = min(P_cell, self.OCV**2 / (4*self.R_cell)-1e-6)
         discriminant = self.OCV ** 2 - 4 * self.R_cell * P_cell
-        safe_discriminant = max(discriminant, 1e-8)
+        safe_discriminant = self.math.max(discriminant, 1e-8)
         # 电流限制
-        I_cell = (self.OCV - sqrt(safe_discriminant)) / (2 * self.R_cell)
+        I_cell = (self.OCV - self.math.sqrt(safe_discriminant)) / (2 * self.R_cell)
         return I_cell * self.N_parallel
 
     def Pack_thermal_generation(self, I_cell, T_bat):
@@ -102,4 +112,7 @@ class BatteryPack(BatteryCell):
     def get_SOH_loss(self, I_pack, T_bat):
         I_cell = I_pack / self.N_parallel
         U_cell = self.OCV - I_cell * self.R_cell
+        if np.ndim(I_cell) or np.ndim(U_cell):
+            # 批量仿真时（numpy后端，状态为数组）一次推理所有实现
+            return self.SOH_predictor.inference_batch(np.abs(I_cell), U_cell, T_bat)
         return self.SOH_predictor.inference(abs(I_cell), U_cell, T_bat)
\ No newline at end of file
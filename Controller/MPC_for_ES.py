@@ -1,8 +1,187 @@
+import os
+import hashlib
+import warnings
+import subprocess
 import numpy as np
 import casadi as ca
+from scipy import sparse
+from scipy.sparse.linalg import spsolve
 from Battery.BatteryPack import BatteryPack as Battery
 from CoolingSystem.CS_for_ES import SimpleCoolingSystem as CoolingSystem
+from Controller.RB_controller import RBController
 import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# 目标函数的默认权重
+DEFAULT_WEIGHTS = {
+    'temp': 1000,          # 温度偏差权重
+    'dcomp': 1e-3,         # 压缩机功率变化率权重
+    'comp': 1e-5,          # 压缩机功率权重
+    'I_pack': 0,           # 电池pack的电流权重
+    'slack': 1e3           # 温度软约束松弛量的L1罚权重（'slack'约束模式）
+}
+
+# 编译生成代码时使用的gcc参数
+CODEGEN_FLAGS = ['-fPIC', '-shared', '-O1']
+
+def transition_function(battery_model, cooling_system):
+    """
+    由电池和冷却系统模型构建单步状态转移的SX函数
+    - 输入 x: [电池温度, 电池pack功率, SOC, 冷却液出口温度]
+    - 输入 u: [压缩机功率, 电池pack电流]
+    - 输入 P_RE: 该步的可再生能源发电功率
+    - 输入 dt: 该步的时间步长 (s)
+    - 输出 x_next: 下一步的 x
+    - 输出 I_limits: 更新后的pack电流 [下限, 上限]
+    - 输出 I_pack_need: 满足功率需求所需的pack电流
+    模型在构建时被临时改写的属性（OCV、电流限制、冷却液温度、步长等）会在返回前恢复。
+    """
+    bm, cs = battery_model, cooling_system
+    x = ca.SX.sym('x', 4)
+    u = ca.SX.sym('u', 2)
+    P_RE = ca.SX.sym('P_RE')
+    h = ca.SX.sym('dt')
+    bm_state, cs_state = dict(bm.__dict__), dict(cs.__dict__)
+    try:
+        bm.dt = cs.dt = h
+        # OCV和电流限制与该步的SOC保持一致
+        bm.update_OCV(x[2])
+        bm.update_I_constrains()
+        cs.T_clnt_out = x[3]
+
+        Q_cool = cs.battery_cooling(x[0], u[0])
+        I_pack_need = bm.Current_Pack2Cell(P_RE + u[0] + 200)
+        temp_next, P_response, SOC_next, _, _ = bm.battery_model(
+            Q_cool=Q_cool,
+            I_pack=u[1],
+            T_bat=x[0],
+            SOC=x[2]
+        )
+        x_next = ca.vertcat(temp_next, P_response, SOC_next, cs.T_clnt_out)
+        I_limits = ca.vertcat(bm.I_min_limit, bm.I_max_limit)
+    finally:
+        bm.__dict__.update(bm_state)
+        cs.__dict__.update(cs_state)
+    return ca.Function('step', [x, u, P_RE, h], [x_next, I_limits, I_pack_need],
+                       ['x', 'u', 'P_RE', 'dt'], ['x_next', 'I_limits', 'I_pack_need'])
+
+def coolant_function(cooling_system):
+    """
+    由冷却系统模型构建冷却液出口温度单步转移的SX函数（与 transition_function 中冷却液温度的转移相同）
+    - 输入 T_clnt: 冷却液出口温度
+    - 输入 T_bat: 电池温度
+    - 输入 P_comp: 压缩机功率
+    - 输入 dt: 该步的时间步长 (s)
+    - 输出 T_clnt_next: 下一步的冷却液出口温度
+    """
+    cs = cooling_system
+    T_clnt, T_bat, P_comp, h = ca.SX.sym('T_clnt'), ca.SX.sym('T_bat'), ca.SX.sym('P_comp'), ca.SX.sym('dt')
+    cs_state = dict(cs.__dict__)
+    try:
+        cs.dt = h
+        cs.T_clnt_out = T_clnt
+        cs.battery_cooling(T_bat, P_comp)
+        T_clnt_next = cs.T_clnt_out
+    finally:
+        cs.__dict__.update(cs_state)
+    return ca.Function('coolant', [T_clnt, T_bat, P_comp, h], [T_clnt_next], ['T_clnt', 'T_bat', 'P_comp', 'dt'],
+                       ['T_clnt_next'])
+
+class SolveWatchdog(ca.Callback):
+    """
+    IPOPT每次迭代时调用的看门狗：记录目标函数最小的可行迭代点，超过截止时间时请求求解器停止
+    """
+
+    def __init__(self, nx, ng, feasibility_tol=1e-4):
+        ca.Callback.__init__(self)
+        self.nx, self.ng = nx, ng
+        self.feasibility_tol = feasibility_tol
+        self.deadline = None
+        self.cancelled = None  # 可选，无参数的函数，返回True时请求求解器停止（并行多起点求解取消过期的起点）
+        self.lbg = self.ubg = None
+        self.best = None
+        self.construct('watchdog', {})
+
+    def arm(self, deadline, lbg, ubg):
+        """开始新的一步：设置截止时间和当前参数下的约束上下界，清空已记录的迭代点"""
+        self.deadline = deadline
+        self.lbg, self.ubg = np.asarray(lbg).flatten(), np.asarray(ubg).flatten()
+        self.best = None
+
+    def get_n_in(self): return ca.nlpsol_n_out()
+    def get_n_out(self): return 1
+    def get_name_in(self, i): return ca.nlpsol_out(i)
+    def get_name_out(self, i): return 'ret'
+
+    def get_sparsity_in(self, i):
+        name = ca.nlpsol_out(i)
+        if name == 'f':
+            return ca.Sparsity.scalar()
+        if name in ('x', 'lam_x'):
+            return ca.Sparsity.dense(self.nx)
+        if name in ('g', 'lam_g'):
+            return ca.Sparsity.dense(self.ng)
+        return ca.Sparsity(0, 0)
+
+    def eval(self, arg):
+        out = dict(zip(ca.nlpsol_out(), arg))
+        if self.lbg is not None:
+            g = out['g'].full().flatten()
+            violation = max(np.max(self.lbg - g, initial=0), np.max(g - self.ubg, initial=0))
+            f = float(out['f'])
+            if violation <= self.feasibility_tol and (self.best is None or f < self.best['f']):
+                self.best = {'x': out['x'].full().flatten(), 'lam_g': out['lam_g'].full().flatten(), 'f': f}
+        # 返回非零值时IPOPT以 User_Requested_Stop 结束
+        stop = (self.deadline is not None and time.time() >= self.deadline) or \
+               (self.cancelled is not None and self.cancelled())
+        return [1 if stop else 0]
+
+# 并行多起点求解：每个工作进程持有一个独立的求解器实例，以及在截止时间或起点过期时停止求解的看门狗
+_worker_solver = None
+_worker_watchdog = None
+_worker_generation = None
+
+def _init_start_worker(solver_spec, generation):
+    """
+    工作进程初始化，构建本进程的求解器
+    :param solver_spec: ('library', 共享库路径, 求解器选项, nx, ng)
+                        或 ('serialized', 序列化的NLP表达式 [x, p, f, g], 求解器选项, nx, ng)
+    :param generation: 共享的整数，主进程在一步结束时递增，之前提交的起点随之过期
+    """
+    global _worker_solver, _worker_watchdog, _worker_generation
+    kind, payload, opts, nx, ng = solver_spec
+    _worker_watchdog = SolveWatchdog(nx, ng)
+    _worker_generation = generation
+    opts = dict(opts, iteration_callback=_worker_watchdog)
+    if kind == 'library':
+        _worker_solver = ca.nlpsol('mpc_nlp', 'ipopt', payload, opts)
+    else:
+        x, p, f, g = ca.StringDeserializer(payload).unpack()
+        _worker_solver = ca.nlpsol('mpc_nlp', 'ipopt', {'x': x, 'p': p, 'f': f, 'g': g}, opts)
+
+def _solve_start(source, x0, lam_g0, p, lbg, ubg, generation, deadline):
+    """
+    在工作进程中从一个初始猜测出发求解NLP
+    :param generation: 提交时的代数，主进程已取得本步结果（代数改变）时在下一次迭代停止
+    :param deadline: 本步的截止时刻，None表示不限
+    """
+    start_time = time.time()
+    _worker_watchdog.deadline = deadline
+    _worker_watchdog.cancelled = lambda: _worker_generation.value != generation
+    res = _worker_solver(x0=x0, lam_g0=lam_g0, p=p, lbg=lbg, ubg=ubg)
+    stats = _worker_solver.stats()
+    return {
+        'stats': {k: v for k, v in stats.items()
+                  if k in ('iter_count', 'return_status', 'success') or k.startswith(('t_proc_', 't_wall_'))},
+        'source': source,
+        'x': res['x'].full().flatten(),
+        'lam_g': res['lam_g'].full().flatten(),
+        'f': float(res['f']),
+        'success': stats['success'],
+        'return_status': stats['return_status'],
+        'time': time.time() - start_time
+    }
 
 class MPCController:
     """
@@ -20,7 +199,12 @@ class MPCController:
     """
     
     def __init__(self, battery_model, cooling_system, P_RE,
-                initial_temp=30, T_opt=25, P_target=142.3*1000, N=24, dt=3600, P_comp_limits=(0, 4000)):
+                initial_temp=30, T_opt=25, P_target=142.3*1000, N=24, dt=3600, P_comp_limits=(0, 4000),
+                warm_start=False, weights=None, codegen=False, codegen_dir='codegen', formulation='unrolled',
+                parallel_starts=0, start_deadline=None, start_policy='first', solver='ipopt', rti_qpsol='qrqp',
+                time_grid=None, move_blocks=None, constraint_mode='penalty', temp_band=(23, 27), threshold_width=50,
+                telemetry=None, step_budget=None, cache=None, admm_rho=None, sensitivity_tol=None,
+                sensitivity_max_steps=10, shooting='multiple'):
         """
         初始化电池温度MPC控制器
         - param battery_model: 电池热模型实例
@@ -30,6 +214,40 @@ class MPCController:
         - param N: 预测时域步数
         - param dt: 离散时间步长(s)
         - param P_comp_limits: 压缩机功率范围 (min, max)
+        - param warm_start: 是否用上一次的最优解（原始+对偶）平移后作为下一次求解的初始值
+        - param weights: 目标函数权重，缺省的项取 DEFAULT_WEIGHTS
+        - param codegen: 是否将NLP生成C代码并编译为共享库求解
+        - param codegen_dir: 生成代码和共享库的缓存目录
+        - param formulation: 时域构建方式，'unrolled' 逐步展开MX表达式；
+                             'mapped' 用单步SX转移函数和map构建（冷却液出口温度作为附加状态）；
+                             'lean' 在'mapped'的基础上消去代数量：pack功率由电流和状态计算，不作为决策变量，
+                             I_pack权重为0时不计算所需电流
+        - param shooting: 'lean'构建方式的打靶形式，'multiple' 各节点的温度、SOC为决策变量（冷却液出口温度递推）；
+                          'single' 只有控制量为决策变量，状态由初始状态依次递推
+        - param parallel_starts: 并行多起点求解的进程数，0表示按顺序重试
+        - param start_deadline: 并行多起点求解的截止时间 (s)，None表示不限
+        - param start_policy: 'first' 取最先收敛的解，'best' 取截止时间内目标函数最小的收敛解
+        - param solver: 'ipopt' 每步求解到收敛；'rti' 实时迭代，每步在平移后的轨迹处线性化并只求解一个QP
+                        （隐含开启热启动，无可用的上一次解或QP失败时回退到IPOPT）
+        - param rti_qpsol: 实时迭代使用的QP求解器，如 'qrqp' 或 'osqp'
+        - param time_grid: 非均匀预测网格，各阶段的长度（dt的整数倍），如 [1]*10 + [5]*6 + [20]*2；
+                           给定时预测时域步数N取其长度，P_RE预测取每个阶段内的平均值
+        - param move_blocks: 控制移动阻塞，各块包含的阶段数（之和为N），块内控制量保持不变
+        - param constraint_mode: 'penalty' 原有的罚函数形式；'slack' 温度范围temp_band作为带松弛变量的
+                                 L1精确罚软约束，冷却系统的开启阈值用sigmoid平滑
+        - param temp_band: 'slack'模式下电池温度的软约束范围 (℃)
+        - param threshold_width: 'slack'模式下压缩机开启阈值的平滑宽度 (W)
+        - param telemetry: 可选的 SolverTelemetry，记录multi_solve中每一次求解尝试
+        - param step_budget: multi_solve每一步的墙钟时间预算 (s)，None表示不限。超出预算或所有尝试失败时，
+                             取本步目标函数最小的可行迭代点，没有可行迭代点时回退到 RBController
+        - param cache: 可选的 SolutionCache，按量化的初始状态和发电功率预测缓存求解结果
+        - param admm_rho: 作为ADMM分布式协调的子问题时的罚参数，目标函数中加入 rho/2*||y - admm_ref||^2，
+                          y为各阶段对站的净输出功率和压缩机功率，admm_ref 由协调器通过 set_admm_ref 给出
+        - param sensitivity_tol: 开启参数灵敏度预测时的KKT残差阈值，None表示不开启。multi_solve先在平移后的
+                                 上一次最优解处（积极集不变）求解线性化的KKT系统，预测当前参数下的解，
+                                 预测点的KKT残差不超过该值时跳过IPOPT（隐含开启热启动）
+        - param sensitivity_max_steps: 连续接受灵敏度预测的最大步数，之后强制完整求解一次。预测只沿当前的局部解
+                                       延拓，不会跳到其他更优的局部解（如'penalty'模式下压缩机开启阈值两侧）
         """
         self.bm = battery_model
         self.cs = cooling_system
@@ -37,21 +255,64 @@ class MPCController:
         self.initial_temp = initial_temp
         self.T_opt = T_opt
         self.P_target = P_target
-        self.N = N
         self.dt = dt
+
+        # 预测网格：各阶段长度及起始时刻（以dt为单位）
+        self.time_grid = np.ones(N, dtype=int) if time_grid is None else np.asarray(time_grid, dtype=int)
+        self.N = N = len(self.time_grid)
+        self.stage_times = np.concatenate([[0], np.cumsum(self.time_grid)])
+        self.horizon = int(self.stage_times[-1])  # 预测时域覆盖的总步数
+        # 移动阻塞：各块的起始阶段及起始时刻
+        self.move_blocks = np.ones(N, dtype=int) if move_blocks is None else np.asarray(move_blocks, dtype=int)
+        if self.move_blocks.sum() != N:
+            raise ValueError(f"move_blocks之和({self.move_blocks.sum()})与预测阶段数({N})不一致")
+        self.block_starts = np.concatenate([[0], np.cumsum(self.move_blocks)[:-1]])
+        self.block_times = self.stage_times[self.block_starts]
         self.P_min, self.P_max = P_comp_limits
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.formulation = formulation
+        self.shooting = shooting if formulation == 'lean' else None
+        self.constraint_mode = constraint_mode
+        self.temp_band = temp_band
+        self.threshold_width = threshold_width
+        self.admm_rho = admm_rho
+
+        # 问题标识（代码生成和解缓存的键）：构建问题时会改写控制模型的状态，故需先计算
+        self.codegen = codegen
+        self.codegen_dir = codegen_dir
+        self._problem_id = self._problem_key()
+        self._nlp_solver = None
+        self._codegen_library = None
+        self._iterate = None
+        self.stats = {}  # 最近一次求解的求解器统计（迭代次数、返回状态、各部分耗时等）
+        self.telemetry = telemetry
+        self.cache = cache
+        self._cache_key = None  # 当前这一步的缓存键
+
+        # 时间预算：IPOPT时间上限 + 每次迭代检查截止时间的看门狗，超时后回退到规则控制器
+        self.step_budget = step_budget
+        self._watchdog = None
+        self.fallback = RBController(battery_model, cooling_system, P_RE[::dt], dt=dt) if step_budget else None
+        # 构建问题会把控制模型的属性改写为符号表达式，规则控制器回退时使用构建前的数值状态
+        self._numeric_model_states = (dict(battery_model.__dict__), dict(cooling_system.__dict__))
+
+        # 并行多起点求解
+        self.parallel_starts = parallel_starts
+        self.start_deadline = start_deadline
+        self.start_policy = start_policy
+        self._pool = None
+        self._start_generation = None  # 与工作进程共享的代数，取得一步的结果后递增以停止仍在运行的起点
 
         # CasADi优化器
         self.opti = ca.Opti()
 
-        # 状态变量：电池温度, SOC
-        self.opt_states = self.opti.variable(N + 1, 3)  # (N+1) x 3
-        self.temp = self.opt_states[:, 0]  # 电池温度
-        self.P_response = self.opt_states[:, 1]  # 电池pack的功率
-        self.SOC = self.opt_states[:, 2]   # 电池pack的SOC
-
-        # 控制变量：压缩机功率
-        self.opt_controls = self.opti.variable(N, 2)  # N x 1
+        # 控制变量：压缩机功率、电池pack电流；开启移动阻塞时决策变量为每块一行，按阶段展开
+        self.opt_moves = self.opti.variable(len(self.move_blocks), 2)
+        if move_blocks is None:
+            self.opt_controls = self.opt_moves  # N x 2
+        else:
+            expand = np.repeat(np.eye(len(self.move_blocks)), self.move_blocks, axis=0)
+            self.opt_controls = ca.mtimes(ca.DM(expand), self.opt_moves)  # N x 2
         self.comp_power = self.opt_controls[:, 0]  # 压缩机功率
         self.I_pack = self.opt_controls[:, 1]  # 电池pack的电流
         
@@ -59,26 +320,341 @@ class MPCController:
         self.initial_state = self.opti.parameter(1, 3) 
         self.initial_comp_power = self.opti.parameter(1, 1)
         self.opt_temp_ref = self.opti.parameter(N + 1, 1)  # 参考温度
+        self.P_preview = self.opti.parameter(N, 1)  # 每个阶段的可再生能源发电功率预测
         self.P_RE = P_RE  # 可再生能源发电功率
+        self.temp_ref = None  # 可选，按基本步长排列的参考温度（如上层规划的设定值），None时为T_opt
+
+        # 状态：电池温度, 电池pack的功率, SOC；'lean'构建方式中为由决策变量（和参数）计算的表达式
+        if formulation == 'lean':
+            self.opt_states, self._state_vars = self._build_lean_states()
+        else:
+            self.opt_states = self.opti.variable(N + 1, 3)  # (N+1) x 3
+            self._state_vars = [self.opt_states[:, k] for k in range(3)]
+        self.temp = self.opt_states[:, 0]  # 电池温度
+        self.P_response = self.opt_states[:, 1]  # 电池pack的功率
+        self.SOC = self.opt_states[:, 2]   # 电池pack的SOC
+
+        # 热启动：上一次的最优解，以及各阶段约束在lam_g中的行号
+        self.solver = solver
+        self.rti_qpsol = rti_qpsol
+        self.sensitivity_tol = sensitivity_tol
+        self.sensitivity_max_steps = sensitivity_max_steps
+        self._sensitivity_steps = 0  # 自上一次完整求解以来连续接受的预测步数
+        self.warm_start = warm_start or solver == 'rti' or sensitivity_tol is not None
+        self._last_solution = None
+        self._stage_rows = []
+        self._shift_vars = [self.opt_states, self.opt_controls]
+        self._extra_times = []  # _shift_vars中附加变量各行对应的时刻（以dt为单位）
 
         # 定义状态、控制和干扰变量
         self._build_optimization_problem()
 
+        # 展开的决策变量（和参数）到状态/控制轨迹的映射，约束上下界（仅与参数有关）
+        self._unpack = ca.Function('unpack', [self.opti.x, self.opti.p], [self.opt_states, self.opt_controls])
+        self._unpack_shift = ca.Function('unpack_shift', [self.opti.x, self.opti.p], self._shift_vars)
+        self._nlp_bounds = ca.Function('bounds', [self.opti.p], [self.opti.lbg, self.opti.ubg])
+        self._constraints = ca.Function('constraints', [self.opti.x, self.opti.p], [self.opti.g])
+        self._objective = ca.Function('objective', [self.opti.x, self.opti.p], [self.opti.f])
+        if self.admm_rho is not None:
+            self._coupling = ca.Function('coupling', [self.opti.x, self.opti.p], [self._coupling_expr])
+        if self.codegen:
+            self._build_codegen_solver()
+        self._rti_solver = self._build_rti_solver() if solver == 'rti' else None
+        self._kkt = self._build_kkt_function() if sensitivity_tol is not None else None
+
     def _build_optimization_problem(self):
         """使用Opti()定义MPC优化问题，包括状态转移约束、目标函数和优化求解器。"""
-        # === 1. 初始条件约束 ===
-        self.opti.subject_to(self.opt_states[0, :] == self.initial_state[0, :])
+        # === 1. 初始条件约束（'lean'构建方式在构建状态时处理） ===
+        if self.formulation != 'lean':
+            self.opti.subject_to(self.opt_states[0, :] == self.initial_state[0, :])
+
+        # === 2. 状态转移约束和目标函数 ===
+        threshold_width = getattr(self.cs, 'threshold_width', None)
+        if self.constraint_mode == 'slack':
+            self.cs.threshold_width = self.threshold_width
+        try:
+            if self.formulation == 'lean':
+                obj = self._build_lean_dynamics()
+            elif self.formulation == 'mapped':
+                obj = self._build_mapped_dynamics()
+            else:
+                obj = self._build_unrolled_dynamics()
+        finally:
+            self.cs.threshold_width = threshold_width
+        if self.constraint_mode == 'slack':
+            obj += self._build_temp_slack()
+        if self.admm_rho is not None:
+            obj += self._build_admm_term()
+        self.opti.minimize(obj)
+
+        # === 3. 约束条件 ===
+        # 压缩机功率限制
+        self._stage_rows.append(self._subject_to(
+            self.opti.bounded(self.P_min, self.opt_moves[:, 0], self.P_max), self.block_times))
+        
+        # SOC范围限制（单重打靶时初始SOC为参数，只约束之后的节点）
+        first = 1 if self.shooting == 'single' else 0
+        self._stage_rows.append(self._subject_to(
+            self.opti.bounded(self.bm.SOC_min, self.SOC[first:], 0.99), self.stage_times[first:]))
+        
+        # 温度限制
+        #self.opti.subject_to(self.opti.bounded(23, self.temp, 27))
 
-        # === 2. 目标函数 ===
+        # === 4. 设定求解器 ===
+        opts_setting = {
+            'ipopt': {
+                'max_iter': 500,
+                'print_level': 0,
+                'acceptable_tol': 1e-4,             # 宽松但合理的容差
+                'acceptable_obj_change_tol': 1e-4,
+                'tol': 1e-6,                        # 严格解的容差
+                'bound_push': 1e-4,                 # 防止变量紧贴约束
+                'bound_frac': 1e-3                 # 防止变量初始就位于约束边界
+            },
+            'print_time': False
+        }
+        if self.formulation == 'lean':
+            # 'lean'的冷却液温度递推使约束雅可比含跨阶段的项，展开为SX后求导比MX快数倍
+            opts_setting['expand'] = True
+        if self.warm_start:
+            # 使用给定的对偶初值，并减小对初值的推离
+            opts_setting['ipopt'].update({
+                'warm_start_init_point': 'yes',
+                'warm_start_bound_push': 1e-6,
+                'warm_start_mult_bound_push': 1e-6
+            })
+        if self.step_budget is not None:
+            # 单次求解不会超过整步的预算
+            opts_setting['ipopt'].update({
+                'max_wall_time': float(self.step_budget),
+                'max_cpu_time': float(self.step_budget)
+            })
+            self._watchdog = SolveWatchdog(self.opti.nx, self.opti.ng)
+        self._solver_opts = opts_setting
+        self.opti.solver('ipopt', self._with_watchdog(opts_setting))
+
+    def _library_opts(self):
+        """从编译的共享库加载求解器时的选项：生成代码时已展开，共享库中的函数不能再展开"""
+        return {k: v for k, v in self._solver_opts.items() if k != 'expand'}
+
+    def _with_watchdog(self, opts):
+        """在求解器选项中加入看门狗回调（回调无法序列化，故不放在 self._solver_opts 中）"""
+        if self._watchdog is None:
+            return opts
+        return dict(opts, iteration_callback=self._watchdog)
+
+    def _build_temp_slack(self):
+        """
+        温度软约束：T_low - s_low <= T <= T_high + s_high，s >= 0，
+        松弛量以L1罚加入目标函数，罚权重足够大时与硬约束的解一致（精确罚），且问题始终可行
+        :return: 松弛量的罚项
+        """
+        T_low, T_high = self.temp_band
+        self.temp_slack = self.opti.variable(self.N, 2)  # [下界松弛, 上界松弛]，对应第1~N个温度节点
+        times = self.stage_times[1:]
+        self._shift_vars.append(self.temp_slack)
+        self._extra_times.append(times)
+        self._stage_rows.append(self._subject_to(T_low - self.temp_slack[:, 0] <= self.temp[1:], times))
+        self._stage_rows.append(self._subject_to(self.temp[1:] <= T_high + self.temp_slack[:, 1], times))
+        self._stage_rows.append(self._subject_to(ca.vec(self.temp_slack) >= 0, times))
+        w = ca.DM(self.time_grid)
+        return self.weights['slack'] * ca.dot(w, self.temp_slack[:, 0] + self.temp_slack[:, 1])
+
+    def _build_admm_term(self):
+        """
+        ADMM增广项：y为各阶段模块对站的净输出功率（pack输出功率减去冷却功耗）和压缩机功率，
+        admm_ref 为协调器给出的共享变量减去缩放的对偶变量
+        :return: rho/2 * ||y - admm_ref||^2，按阶段长度加权
+        """
+        self.admm_ref = self.opti.parameter(self.N, 2)
+        self.opti.set_value(self.admm_ref, np.zeros((self.N, 2)))
+        y = ca.horzcat(self.P_response[1:] - self.comp_power - 200, self.comp_power)
+        self._coupling_expr = y  # 问题构建完成后（opti.p 包含所有参数时）生成 _coupling
+        w = ca.DM(self.time_grid)
+        return self.admm_rho / 2 * ca.dot(w, ca.sum2((y - self.admm_ref)**2))
+
+    def set_admm_ref(self, ref):
+        """设置ADMM增广项的参考值，形状为 (N, 2)"""
+        self.opti.set_value(self.admm_ref, ref)
+
+    def coupling_outputs(self, x):
+        """由展开的决策变量计算各阶段的净输出功率和压缩机功率，形状为 (N, 2)"""
+        return self._coupling(x, self._parameters()).full()
+
+    def _problem_key(self):
+        """
+        代码生成缓存键：时域、步长、权重，以及构建时控制模型的数值状态。
+        参考温度是问题的参数（按节点给出，不再由T_opt常数构建），以 ('temp_ref_param', True) 标记，
+        与参考温度为常数时生成的代码区分；'lean'多重打靶的冷却液温度不再是决策变量，以 ('lean_T_clnt_var', False) 标记
+        """
+        spec = (
+            self.formulation, self.shooting, self.N, self.dt, self.T_opt, ('temp_ref_param', True),
+            ('lean_T_clnt_var', False),
+            self.P_min, self.P_max, sorted(self.weights.items()),
+            self.time_grid.tolist(), self.move_blocks.tolist(),
+            self.constraint_mode, tuple(self.temp_band), self.threshold_width, self.admm_rho,
+            self.bm.T_amb, float(self.bm.OCV), float(self.bm.I_max_limit), float(self.bm.I_min_limit),
+            self.cs.T_amb, float(self.cs.T_clnt_out),
+            ca.__version__
+        )
+        return hashlib.sha1(repr(spec).encode()).hexdigest()[:16]
+
+    def _build_codegen_solver(self):
+        """
+        将Opti问题导出为参数化的nlpsol，为目标函数、约束、雅可比和Hessian生成C代码，
+        用本地gcc编译为共享库。共享库按缓存键保存在codegen_dir中，之后的运行直接加载。
+        """
+        os.makedirs(self.codegen_dir, exist_ok=True)
+        name = f'mpc_nlp_{self._problem_id}'
+        so_file = os.path.join(self.codegen_dir, name + '.so')
+        if not os.path.exists(so_file):
+            solver = ca.nlpsol('mpc_nlp', 'ipopt', self._nlp(), self._solver_opts)
+            cg = ca.CodeGenerator(name + '.c')
+            cg.add(solver.oracle())
+            for fname in solver.get_function():
+                cg.add(solver.get_function(fname))
+            cg.generate(self.codegen_dir + os.sep)
+            # 先编译到临时文件再替换，避免并行运行加载到不完整的共享库
+            tmp_file = so_file + '.tmp'
+            subprocess.run(['gcc', *CODEGEN_FLAGS, os.path.join(self.codegen_dir, name + '.c'), '-o', tmp_file],
+                           check=True)
+            os.replace(tmp_file, so_file)
+        self._codegen_library = so_file
+        self._nlp_solver = ca.nlpsol('mpc_nlp', 'ipopt', so_file, self._with_watchdog(self._library_opts()))
+
+    def _build_rti_solver(self):
+        """
+        实时迭代求解器：sqpmethod只迭代一次，即在初始轨迹处线性化动力学并求解一个稀疏QP，
+        精确Hessian做正则化凸化
+        """
+        if self.rti_qpsol == 'osqp':
+            qpsol_options = {'osqp': {'verbose': False}, 'error_on_fail': False}
+        else:
+            qpsol_options = {'print_iter': False, 'print_header': False, 'error_on_fail': False}
+        opts = {
+            'qpsol': self.rti_qpsol,
+            'qpsol_options': qpsol_options,
+            'max_iter': 1,
+            'convexify_strategy': 'regularize',
+            'print_header': False,
+            'print_iteration': False,
+            'print_status': False,
+            'print_time': False,
+            'error_on_fail': False
+        }
+        return ca.nlpsol('mpc_rti', 'sqpmethod', self._nlp(), opts)
+
+    def _build_kkt_function(self):
+        """
+        参数灵敏度预测所需的KKT系统：拉格朗日函数的梯度和Hessian、约束值及其雅可比，
+        均为 (x, lam_g, p) 的函数，能展开为SX时展开以加快计算
+        """
+        x, p = self.opti.x, self.opti.p
+        lam_g = ca.MX.sym('lam_g', self.opti.ng)
+        L = self.opti.f + ca.dot(lam_g, self.opti.g)
+        H, grad_L = ca.hessian(L, x)
+        kkt = ca.Function('kkt', [x, lam_g, p], [grad_L, self.opti.g, H, ca.jacobian(self.opti.g, x)],
+                          ['x', 'lam_g', 'p'], ['grad_L', 'g', 'H', 'J'])
+        try:
+            return kkt.expand()
+        except Exception:
+            return kkt
+
+    def _nlp(self):
+        """以展开的决策变量和参数表示的NLP"""
+        return {'x': self.opti.x, 'p': self.opti.p, 'f': self.opti.f, 'g': self.opti.g}
+
+    def _solve(self, solver=None, accept_status=()):
+        """
+        以Opti中当前设定的参数和初始值求解一次NLP
+        :param solver: 使用的nlpsol，缺省为代码生成的求解器（未开启时用Opti）
+        :param accept_status: 除成功外可接受的求解器返回状态
+        :return: dict，包含展开的决策变量x、约束乘子lam_g和目标函数值f；求解失败时抛出异常，
+                 失败时的迭代点保存在 self._iterate 中
+        """
+        solver = solver or self._nlp_solver
+        if solver is None:
+            try:
+                sol = self.opti.solve()
+            except Exception:
+                self.stats = self.opti.stats()
+                self._iterate = {
+                    'x': np.array(self.opti.debug.value(self.opti.x)).flatten(),
+                    'lam_g': np.array(self.opti.debug.value(self.opti.lam_g)).flatten(),
+                    'f': float(self.opti.debug.value(self.opti.f))
+                }
+                raise
+            self.stats = self.opti.stats()
+            self._iterate = {
+                'x': np.array(sol.value(self.opti.x)).flatten(),
+                'lam_g': np.array(sol.value(self.opti.lam_g)).flatten(),
+                'f': float(sol.value(self.opti.f))
+            }
+            return self._iterate
+
+        # 代码生成的求解器：从Opti读取参数和初始值
+        initial = self.opti.initial()
+        p = self.opti.value(self.opti.p, self.opti.value_parameters())
+        lbg, ubg = self._nlp_bounds(p)
+        res = solver(
+            x0=self.opti.value(self.opti.x, initial),
+            lam_g0=self.opti.value(self.opti.lam_g, initial),
+            p=p, lbg=lbg, ubg=ubg
+        )
+        self._iterate = {
+            'x': res['x'].full().flatten(),
+            'lam_g': res['lam_g'].full().flatten(),
+            'f': float(res['f'])
+        }
+        self.stats = stats = solver.stats()
+        if not stats['success'] and stats['return_status'] not in accept_status:
+            raise RuntimeError(f"Solver failed: {stats['return_status']}")
+        return self._iterate
+
+    def _record(self, i, attempt, source, wall_time, stats, iterate):
+        """记录一次求解尝试的遥测数据，约束违反量由迭代点和当前参数计算"""
+        if self.telemetry is None:
+            return
+        p = self.opti.value(self.opti.p, self.opti.value_parameters())
+        g = self._constraints(iterate['x'], p)
+        lbg, ubg = self._nlp_bounds(p)
+        violation = float(ca.mmax(ca.fmax(ca.fmax(lbg - g, g - ubg), 0)))
+        self.telemetry.record(i, attempt, source, wall_time, stats, iterate['f'], violation)
+
+    def _parameters(self):
+        """Opti中当前设定的参数值（展开为向量）"""
+        return self.opti.value(self.opti.p, self.opti.value_parameters())
+
+    def problem_size(self):
+        """NLP的规模：决策变量数、约束数和参数数"""
+        return {'nx': self.opti.nx, 'ng': self.opti.ng, 'np': self.opti.np}
+
+    def _trajectories(self, x):
+        """
+        将展开的决策变量（以当前参数）还原为状态轨迹和控制序列
+        :return: (state_trajectory (N+1)x3, control_sequence Nx2)
+        """
+        states, controls = self._unpack(x, self._parameters())
+        return states.full(), controls.full()
+
+    def _build_unrolled_dynamics(self):
+        """
+        逐步调用电池和冷却系统模型，展开整个时域的状态转移约束和目标函数
+        :return: 目标函数
+        """
         obj = 0  # 初始化目标函数
+        dyn_rows = []  # 每个阶段状态转移约束的行号
 
         for i in range(self.N):
+            # 该阶段的步长
+            self.bm.dt = self.cs.dt = self.time_grid[i] * self.dt
+
             # 计算冷却量和冷却功率
             Q_cool = self.cs.battery_cooling(self.temp[i], self.comp_power[i])
             P_cool = self.comp_power[i] + 200
 
             # 计算功率缺口和所需电流
-            P_gap = self.P_RE[i*self.dt] + P_cool
+            P_gap = self.P_preview[i] + P_cool
             I_pack_need = self.bm.Current_Pack2Cell(P_gap)
 
             # 计算下一步电池温度和SOC
@@ -90,27 +666,25 @@ class MPCController:
             )
 
             # 状态转移约束
+            ng = self.opti.ng
             self.opti.subject_to(self.opt_states[i + 1, 0] == temp_next)  # 温度
             self.opti.subject_to(self.opt_states[i + 1, 1] == P_response)  # 电池pack的功率
             self.opti.subject_to(self.opt_states[i + 1, 2] == SOC_next)   # SOC
+            dyn_rows.append(np.arange(ng, self.opti.ng))
 
             # 动态约束
             if i == 0:
-                self.opti.subject_to(self.opti.bounded(self.bm.I_min_limit+1, self.I_pack, self.bm.I_max_limit-1))
+                self._stage_rows.append(self._subject_to(
+                    self.opti.bounded(self.bm.I_min_limit+1, self.I_pack, self.bm.I_max_limit-1),
+                    self.stage_times[:-1]))
 
             # 权重系数
-            omega_temp = 1000     # 温度偏差权重
-            omega_dcomp = 1e-3    # 压缩机功率变化率权重
-            omega_comp = 1e-5    # 压缩机功率权重
-            omega_I_pack = 0  # 电池pack的电流权重
+            omega_temp = self.weights['temp']     # 温度偏差权重
+            omega_dcomp = self.weights['dcomp']    # 压缩机功率变化率权重
+            omega_comp = self.weights['comp']    # 压缩机功率权重
+            omega_I_pack = self.weights['I_pack']  # 电池pack的电流权重
             # 温度优化目标
-            temp_obj = omega_temp * (self.temp[i+1] - self.T_opt)**2
-
-            # 给超过comp_power限制的comp_power非常大的约束
-            omega_comp_limit = 1e12
-            bound_comp_obj1 = omega_comp_limit * ca.fmin(0, self.comp_power[i])**2
-            bound_comp_obj2 = omega_comp_limit * ca.fmax(0, self.comp_power[i]-4000)**2
-
+            temp_obj = omega_temp * (self.temp[i+1] - self.opt_temp_ref[i+1])**2
 
             # 压缩机功率变化率目标
             if i > 0:
@@ -124,80 +698,324 @@ class MPCController:
             # 电池pack的电流目标
             I_pack_obj = omega_I_pack * (self.I_pack[i] - I_pack_need)**2
 
-            # 累加目标函数
-            obj += temp_obj + delta_comp_power_obj + comp_power_obj + I_pack_obj
+            # 累加目标函数，温度和功率项按阶段长度加权
+            obj += self.time_grid[i] * (temp_obj + comp_power_obj + I_pack_obj) + delta_comp_power_obj
 
-        # 设置目标函数
-        self.opti.minimize(obj)
+        self.bm.dt = self.cs.dt = self.dt
+        self._stage_rows.append((np.vstack(dyn_rows), self.stage_times[:-1]))
+        return obj
 
-        # === 3. 约束条件 ===
-        # 压缩机功率限制
-        self.opti.subject_to(self.opti.bounded(self.P_min, self.comp_power, self.P_max))
-        
-        # SOC范围限制
-        self.opti.subject_to(self.opti.bounded(self.bm.SOC_min, self.SOC, 0.99))
-        
-        # 温度限制
-        #self.opti.subject_to(self.opti.bounded(23, self.temp, 27))
+    def _build_mapped_dynamics(self):
+        """
+        用单步状态转移的SX函数和map构建整个时域的状态转移约束和目标函数。
+        与逐步展开相比，每个阶段使用由该阶段SOC更新的电流上下限。
+        :return: 目标函数
+        """
+        # 冷却液出口温度作为附加状态变量
+        self.T_clnt = self.opti.variable(self.N + 1, 1)
+        self._shift_vars.append(self.T_clnt)
+        self._extra_times.append(self.stage_times)
+        T_clnt0 = float(self.cs.T_clnt_out)
+        self.opti.subject_to(self.T_clnt[0] == T_clnt0)
+        self.opti.set_initial(self.T_clnt, T_clnt0)
 
-        # === 4. 设定求解器 ===
-        opts_setting = {
-            'ipopt': {
-                'max_iter': 500,
-                'print_level': 0,
-                'acceptable_tol': 1e-4,             # 宽松但合理的容差
-                'acceptable_obj_change_tol': 1e-4,
-                'tol': 1e-6,                        # 严格解的容差
-                'bound_push': 1e-4,                 # 防止变量紧贴约束
-                'bound_frac': 1e-3                 # 防止变量初始就位于约束边界
-            },
-            'print_time': False
+        step = transition_function(self.bm, self.cs).map(self.N)
+        X = ca.horzcat(self.opt_states, self.T_clnt).T  # 4 x (N+1)
+        h = ca.DM(self.time_grid * self.dt).T  # 1 x N
+        X_next, I_limits, I_pack_need = step(X[:, :-1], self.opt_controls.T, self.P_preview.T, h)
+
+        # 状态转移约束，按阶段排列
+        ng = self.opti.ng
+        self.opti.subject_to(X[:, 1:] == X_next)
+        self._stage_rows.append((np.arange(ng, self.opti.ng).reshape(self.N, -1), self.stage_times[:-1]))
+
+        # 电流限制
+        self._stage_rows.append(self._subject_to(
+            self.opti.bounded(I_limits[0, :].T + 1, self.I_pack, I_limits[1, :].T - 1), self.stage_times[:-1]))
+
+        # 目标函数：温度偏差、压缩机功率变化率、压缩机功率、电池pack电流，除变化率外按阶段长度加权
+        w = ca.DM(self.time_grid)
+        comp_power_prev = ca.vertcat(self.initial_comp_power, self.comp_power[:-1])
+        return (self.weights['temp'] * ca.dot(w, (self.temp[1:] - self.opt_temp_ref[1:])**2)
+                + self.weights['dcomp'] * ca.sumsqr(self.comp_power - comp_power_prev)
+                + self.weights['comp'] * ca.dot(w, self.comp_power**2)
+                + self.weights['I_pack'] * ca.dot(w, (self.I_pack - I_pack_need.T)**2))
+
+    def _build_lean_states(self):
+        """
+        'lean'构建方式的状态：用单步SX转移函数计算各阶段的状态转移，pack功率是转移函数的输出而非决策变量
+        - 多重打靶：各节点的 [温度, SOC] 为决策变量，转移约束在 _build_lean_dynamics 中加入；
+          冷却液出口温度由节点温度和压缩机功率递推（mapaccum），不作为决策变量
+        - 单重打靶：从初始状态依次递推（mapaccum），状态是控制量和参数的表达式
+        发电功率预测只影响所需电流，I_pack权重为0时不传入，P_preview不成为问题的参数
+        :return: ((N+1)x3 的状态表达式 [温度, pack功率, SOC], 各列对应的决策变量，被消去的为None)
+        """
+        threshold_width = getattr(self.cs, 'threshold_width', None)
+        if self.constraint_mode == 'slack':
+            self.cs.threshold_width = self.threshold_width
+        try:
+            step = transition_function(self.bm, self.cs)
+            coolant = coolant_function(self.cs)
+        finally:
+            self.cs.threshold_width = threshold_width
+        T_clnt0 = float(self.cs.T_clnt_out)
+        h = ca.DM(self.time_grid * self.dt).T  # 1 x N
+        U = self.opt_controls.T
+        P = self.P_preview.T if self.weights['I_pack'] else ca.DM.zeros(1, self.N)
+        temp0, P_now, SOC0 = self.initial_state[0, 0], self.initial_state[0, 1], self.initial_state[0, 2]
+
+        if self.shooting == 'single':
+            x0 = ca.vertcat(temp0, P_now, SOC0, T_clnt0)
+            X_next, I_limits, I_pack_need = step.mapaccum('rollout', self.N)(x0, U, P, h)
+            temp = ca.vertcat(temp0, X_next[0, :].T)
+            SOC = ca.vertcat(SOC0, X_next[2, :].T)
+            state_vars = [None, None, None]
+        else:
+            Z = self.opti.variable(self.N + 1, 2)  # [温度, SOC]
+            T_clnt_next = coolant.mapaccum('coolant_rollout', self.N).expand()(T_clnt0, Z[:-1, 0].T, U[0, :], h)
+            self.T_clnt = ca.vertcat(T_clnt0, T_clnt_next.T)
+            # 状态转移不依赖pack功率，其位置填0
+            X = ca.horzcat(Z[:, 0], ca.MX.zeros(self.N + 1, 1), Z[:, 1], self.T_clnt).T
+            X_next, I_limits, I_pack_need = step.map(self.N)(X[:, :-1], U, P, h)
+            self._lean_vars = Z
+            temp, SOC = Z[:, 0], Z[:, 1]
+            state_vars = [temp, None, SOC]
+        self._lean_dynamics = (X_next, I_limits, I_pack_need)
+        P_response = ca.vertcat(P_now, X_next[1, :].T)
+        return ca.horzcat(temp, P_response, SOC), state_vars
+
+    def _build_lean_dynamics(self):
+        """
+        'lean'构建方式的约束和目标函数：多重打靶时的初始条件和状态转移约束、电流限制，
+        目标函数与'mapped'相同，I_pack权重为0时省略所需电流项
+        :return: 目标函数
+        """
+        X_next, I_limits, I_pack_need = self._lean_dynamics
+        if self.shooting != 'single':
+            Z = self._lean_vars
+            self.opti.subject_to(Z[0, :] == ca.horzcat(self.initial_state[0, 0], self.initial_state[0, 2]))
+            # 状态转移约束，按阶段排列
+            ng = self.opti.ng
+            self.opti.subject_to(Z[1:, :].T == ca.vertcat(X_next[0, :], X_next[2, :]))
+            self._stage_rows.append((np.arange(ng, self.opti.ng).reshape(self.N, -1), self.stage_times[:-1]))
+
+        # 电流限制
+        self._stage_rows.append(self._subject_to(
+            self.opti.bounded(I_limits[0, :].T + 1, self.I_pack, I_limits[1, :].T - 1), self.stage_times[:-1]))
+
+        w = ca.DM(self.time_grid)
+        comp_power_prev = ca.vertcat(self.initial_comp_power, self.comp_power[:-1])
+        obj = (self.weights['temp'] * ca.dot(w, (self.temp[1:] - self.opt_temp_ref[1:])**2)
+               + self.weights['dcomp'] * ca.sumsqr(self.comp_power - comp_power_prev)
+               + self.weights['comp'] * ca.dot(w, self.comp_power**2))
+        if self.weights['I_pack']:
+            obj += self.weights['I_pack'] * ca.dot(w, (self.I_pack - I_pack_need.T)**2)
+        return obj
+
+    def _subject_to(self, constraint, times):
+        """
+        添加按阶段排列的约束，并返回其在lam_g中的行号
+        :param constraint: 约束表达式（向量，每个阶段一行）
+        :param times: 各阶段的起始时刻（以dt为单位）
+        :return: (形状为 (阶段数, 每阶段约束数) 的行号矩阵, times)
+        """
+        ng = self.opti.ng
+        self.opti.subject_to(constraint)
+        # 上下界含决策变量时，Opti会将其拆成 [下界约束; 上界约束] 两段
+        return np.arange(ng, self.opti.ng).reshape(-1, len(times)).T, times
+
+    @staticmethod
+    def _shift(values, shift, times):
+        """
+        沿时间轴(第0维)将轨迹前移shift步：每个阶段取上一次解中覆盖其起始时刻+shift的阶段的值，
+        超出时域的部分用最后一个值补齐
+        :param times: 各阶段的起始时刻（以dt为单位）
+        """
+        values = np.asarray(values)
+        times = np.asarray(times)
+        index = np.searchsorted(times, times + shift, side='right') - 1
+        return values[np.clip(index, 0, len(times) - 1)]
+
+    def _preview(self, i, P_RE=None):
+        """
+        当前时刻起每个预测阶段内可再生能源发电功率的平均值
+        :param i: 当前时间步
+        :param P_RE: 可选，代替 self.P_RE 从第i步起的发电功率预测（按基本步长dt，长度至少为horizon）
+        :return: 长度为N的数组
+        """
+        if P_RE is None:
+            P_RE = self.P_RE[i*self.dt : (i + self.horizon)*self.dt : self.dt]
+        P_RE = np.asarray(P_RE[:self.horizon], dtype=float)
+        return np.add.reduceat(P_RE, self.stage_times[:-1]) / self.time_grid
+
+    def _reference(self, i):
+        """
+        当前时刻起各阶段节点的参考温度：取 temp_ref 在节点时刻的值，超出其长度的部分用最后一个值补齐
+        :param i: 当前时间步
+        :return: (N+1)x1 的数组
+        """
+        if self.temp_ref is None:
+            return np.full((self.N + 1, 1), float(self.T_opt))
+        index = np.minimum((i + self.stage_times) * self.dt, len(self.temp_ref) - 1)
+        return np.asarray(self.temp_ref, dtype=float)[index].reshape(-1, 1)
+
+    def _set_state_initial(self, col, values):
+        """
+        按节点设置状态的初始猜测，'lean'构建方式中被消去的状态（pack功率，单重打靶时的全部状态）不需要猜测
+        :param col: 0为电池温度，1为电池pack功率，2为SOC
+        """
+        if self._state_vars[col] is not None:
+            self.opti.set_initial(self._state_vars[col], values)
+
+    def _set_control_initial(self, col, values):
+        """
+        按阶段设置控制变量的初始猜测，开启移动阻塞时取每块第一个阶段的值
+        :param col: 0为压缩机功率，1为电池pack电流
+        :param values: 长度为N的初始猜测
+        """
+        values = np.asarray(values, dtype=float).reshape(-1)
+        self.opti.set_initial(self.opt_moves[:, col], values[self.block_starts])
+
+    def _solution(self, x, source='mpc'):
+        """
+        将展开的决策变量整理为按基本步长dt排列的结果：控制序列在每个阶段内保持不变，
+        状态轨迹在阶段节点之间线性插值。均匀网格时即为各阶段的值。
+        :param source: 结果的来源，'mpc' 求解成功，'iterate' 超出预算时的可行迭代点
+        """
+        states, controls = self._trajectories(x)
+        if np.any(self.time_grid != 1):
+            steps = np.arange(self.horizon + 1)
+            states = np.column_stack([np.interp(steps, self.stage_times, states[:, k])
+                                      for k in range(states.shape[1])])
+            controls = np.repeat(controls, self.time_grid, axis=0)
+        return {
+            'control_sequence': controls,
+            'state_trajectory': states,
+            'source': source
         }
-        self.opti.solver('ipopt', opts_setting)
 
-    def solve(self, i, current_temp, SOC, comp_power):
+    def _store_solution(self, i, result):
+        """记录本次最优解，用于下一次求解的热启动"""
+        if self.warm_start:
+            values = [v.full() for v in self._unpack_shift(result['x'], self._parameters())]
+            self._last_solution = {
+                'step': i,
+                'states': values[0],
+                'controls': values[1],
+                'extras': values[2:],  # 其他按阶段排列的决策变量（如冷却液温度）
+                'lam_g': result['lam_g']
+            }
+
+    def _shifted_guess(self, i):
+        """
+        将上一次的最优解平移到当前时刻
+        :param i: 当前时间步
+        :return: (states, controls, lam_g, extras)，无可用解时返回None
+        """
+        last = self._last_solution
+        if last is None:
+            return None
+        shift = i - last['step']
+        if shift < 0 or shift >= self.horizon:
+            return None
+        states = self._shift(last['states'], shift, self.stage_times)
+        controls = self._shift(last['controls'], shift, self.stage_times[:-1])
+        extras = [self._shift(v, shift, times) for v, times in zip(last['extras'], self._extra_times)]
+        # 对偶变量按阶段平移，非阶段约束（初始条件）沿用原值
+        lam_g = last['lam_g'].copy()
+        for rows, times in self._stage_rows:
+            lam_g[rows] = self._shift(last['lam_g'][rows], shift, times)
+        return states, controls, lam_g, extras
+
+    def solve(self, i, current_temp, SOC, comp_power, preview=None, initial=None):
         """
         求解MPC优化问题，获取最优控制输入序列。
         :param i: 当前时间步
         :param current_temp: 当前电池温度
         :param SOC: 当前SOC
         :param comp_power: 当前压缩机功率
+        :param preview: 可选，代替 P_RE 从第i步起的发电功率预测（按基本步长dt，长度至少为horizon）
+        :param initial: 可选的初始猜测 {'x', 'lam_g'}（如上一次求解的结果），缺省用默认猜测
         :return: 最优控制输入序列
         """
         # 构建参考温度轨迹
-        opt_temp_ref = np.full((self.N + 1, 1), self.T_opt)
+        opt_temp_ref = self._reference(i)
+        P_now = self.P_RE[i*self.dt] if preview is None else preview[0]
 
         # 设置参数
+        P_preview = self._preview(i, preview)
         self.opti.set_value(self.opt_temp_ref, opt_temp_ref)
-        self.opti.set_value(self.initial_state, [float(current_temp), self.P_RE[i*self.dt],float(SOC)])
+        self.opti.set_value(self.initial_state, [float(current_temp), P_now, float(SOC)])
         self.opti.set_value(self.initial_comp_power, float(comp_power))
+        self.opti.set_value(self.P_preview, P_preview)
 
-        # 设置初始猜测
-        self.opti.set_initial(self.opt_states[:, 0], np.full((self.N + 1, 1), current_temp))  # 温度
-        self.opti.set_initial(self.opt_states[:, 1], np.full((self.N + 1, 1), self.P_RE[i*self.dt]))   # 电池pack的功率
-        self.opti.set_initial(self.opt_states[:, 2], np.full((self.N + 1, 1), float(SOC)))   # SOC
-        self.opti.set_initial(self.opt_controls[:, 0], np.full((self.N, 1), 2000))     # 压缩机功率
-        self.opti.set_initial(self.opt_controls[:, 1], np.full((self.N, 1), 0))     # 电池pack的电流
+        # 查找缓存：命中时直接返回，或用缓存的解作为初始猜测
+        entry = self._cache_lookup(current_temp, SOC, comp_power, P_preview, opt_temp_ref)
+        if entry is not None and self.cache.mode == 'answer':
+            return dict(entry['solution'], source='cache')
+        entry = initial or entry
+        if entry is not None:
+            self.opti.set_initial(self.opti.x, entry['x'])
+            if self.warm_start:
+                self.opti.set_initial(self.opti.lam_g, entry['lam_g'])
+        else:
+            # 设置初始猜测
+            self._set_state_initial(0, np.full((self.N + 1, 1), current_temp))  # 温度
+            self._set_state_initial(1, np.full((self.N + 1, 1), P_now))   # 电池pack的功率
+            self._set_state_initial(2, np.full((self.N + 1, 1), float(SOC)))   # SOC
+            self._set_control_initial(0, np.full((self.N, 1), 2000))     # 压缩机功率
+            self._set_control_initial(1, np.full((self.N, 1), 0))     # 电池pack的电流
 
-        sol = self.opti.solve()
-        return {
-            'control_sequence': sol.value(self.opt_controls),
-            'state_trajectory': sol.value(self.opt_states)
-        }
+        result = self._solve()
+        solution = self._solution(result['x'])
+        self._cache_store(result, solution)
+        return solution
+
+    def _cache_lookup(self, current_temp, SOC, comp_power, P_preview, temp_ref):
+        """
+        按当前状态和各阶段的发电功率预测查找解缓存，并记下本步的缓存键
+        :param temp_ref: 各阶段节点的参考温度，设置了 temp_ref 时并入缓存键
+        :return: 缓存条目 {'solution', 'x', 'lam_g', 'f'}，未开启缓存或未命中时返回None
+        """
+        if self.cache is None:
+            return None
+        problem_key = self._problem_id
+        if self.temp_ref is not None:
+            # 参考温度随上层规划变化，量化后并入问题标识
+            ref = np.round(np.asarray(temp_ref) / self.cache.temp_step).astype(np.int64)
+            problem_key = (problem_key, hashlib.sha1(ref.tobytes()).hexdigest()[:16])
+        self._cache_key = self.cache.key(problem_key, float(current_temp), float(SOC), float(comp_power), P_preview)
+        return self.cache.get(self._cache_key)
+
+    def _cache_store(self, result, solution):
+        """将本步求解成功的结果写入解缓存"""
+        if self.cache is not None:
+            self.cache.put(self._cache_key, {'solution': solution, 'x': result['x'], 'lam_g': result['lam_g'],
+                                             'f': result['f']})
+
+    def _cached_guess(self, entry):
+        """
+        将缓存的解整理为与 _shifted_guess 相同格式的初始猜测
+        :return: (states, controls, lam_g, extras)
+        """
+        values = [v.full() for v in self._unpack_shift(entry['x'], self._parameters())]
+        return values[0], values[1], entry['lam_g'], values[2:]
+
+    def _accept(self, i, result):
+        """记录求解成功的结果（热启动、解缓存），返回整理后的结果"""
+        self._store_solution(i, result)
+        solution = self._solution(result['x'])
+        self._cache_store(result, solution)
+        return solution
     
-    def multi_solve(self, i, current_temp, SOC, comp_power):
+    def _heuristic_guesses(self, i, current_temp, comp_power):
         """
-        多重求解
+        基于规则的初始猜测
+        :return: (温度猜测, 电流猜测, 压缩机功率斜坡猜测, 按功率需求缩放的压缩机功率猜测, 需求功率)
         """
-        max_retries = 4
-        self.opti.set_value(self.initial_state, [float(current_temp), self.P_RE[i*self.dt],float(SOC)])
-        self.opti.set_value(self.initial_comp_power, float(comp_power))
-        self.opti.set_initial(self.opt_states[:, 1], np.full((self.N + 1, 1), self.P_RE[i*self.dt]))   # 电池pack的功率
-        self.opti.set_initial(self.opt_states[:, 2], np.full((self.N + 1, 1), float(SOC)))   # SOC
         temp_guess = np.linspace(current_temp, 25, self.N + 1).reshape(-1, 1)
-        # dt=n，隔n个点取一个点
-        P_need = self.P_RE[i*self.dt : i*self.dt + self.N*self.dt]  # 长度为 N
-        P_need = P_need[::self.dt]
+        # 每个预测阶段的平均功率，长度为 N
+        P_need = self._preview(i)
         current_guess = P_need / 80 / 3.7
         if current_temp > 25:
             if comp_power < 500:
@@ -223,40 +1041,403 @@ class MPCController:
         else:
             norm = np.zeros_like(P_RE_need)  # 或者全 0.5
         comp_power_guess2 = norm * (4000)  # 缩放到 [0, 4000]
-        for attempt in range(max_retries):
-            if attempt == 0:
+        return temp_guess, current_guess, comp_power_guess1, comp_power_guess2, P_need
+
+    def multi_solve(self, i, current_temp, SOC, comp_power):
+        """
+        多重求解
+        """
+        start_time = time.time()
+        deadline = None if self.step_budget is None else start_time + self.step_budget
+        P_preview = self._preview(i)
+        temp_ref = self._reference(i)
+        self.opti.set_value(self.opt_temp_ref, temp_ref)
+        self.opti.set_value(self.initial_state, [float(current_temp), self.P_RE[i*self.dt],float(SOC)])
+        self.opti.set_value(self.initial_comp_power, float(comp_power))
+        self.opti.set_value(self.P_preview, P_preview)
+        entry = self._cache_lookup(current_temp, SOC, comp_power, P_preview, temp_ref)
+        if entry is not None and self.cache.mode == 'answer':
+            self._record(i, 0, 'cache', time.time() - start_time,
+                         {'iter_count': 0, 'return_status': 'Cache_Hit', 'success': True}, entry)
+            self._store_solution(i, entry)
+            return dict(entry['solution'], source='cache')
+        cached = self._cached_guess(entry) if entry is not None else None
+        if self._watchdog is not None:
+            self._watchdog.arm(deadline, *self._nlp_bounds(self.opti.value(self.opti.p, self.opti.value_parameters())))
+        self._set_state_initial(1, np.full((self.N + 1, 1), self.P_RE[i*self.dt]))   # 电池pack的功率
+        self._set_state_initial(2, np.full((self.N + 1, 1), float(SOC)))   # SOC
+        shifted = self._shifted_guess(i) if self.warm_start else None
+        if self._rti_solver is not None and shifted is not None:
+            solution = self._rti_solve(i, shifted)
+            if solution is not None:
+                return solution
+        if self._kkt is not None and shifted is not None and self._sensitivity_steps < self.sensitivity_max_steps:
+            solution = self._sensitivity_solve(i, shifted)
+            if solution is not None:
+                self._sensitivity_steps += 1
+                return solution
+        self._sensitivity_steps = 0
+        if self.parallel_starts:
+            solution = self._parallel_multi_solve(i, current_temp, SOC, comp_power, shifted, deadline, cached)
+            return solution if solution is not None else self._on_failure(i, current_temp, SOC, comp_power)
+        temp_guess, current_guess, comp_power_guess1, comp_power_guess2, P_need = \
+            self._heuristic_guesses(i, current_temp, comp_power)
+
+        # 初始猜测的来源：开启热启动且上一次解可用时，先尝试平移后的上一次最优解；缓存命中时最先尝试缓存的解
+        sources = ['ramp', 'debug', 'scaled', 'debug']
+        if shifted is not None:
+            sources.insert(0, 'shift')
+        if cached is not None:
+            sources.insert(0, 'cache')
+        guesses = {'shift': shifted, 'cache': cached}
+        last_iterate = None  # 上一次失败尝试的最后迭代点 (状态轨迹, 控制轨迹)，'debug' 从这里重新开始
+        for attempt, source in enumerate(sources):
+            start_time = time.time()
+            if deadline is not None and start_time >= deadline:
+                print(f"Step budget {self.step_budget} s exceeded after {attempt} attempt(s)")
+                break
+            lam_g_guess = np.zeros(self.opti.ng)
+            if source in guesses:
+                x_shift, u_shift, lam_g_guess, extras_shift = guesses[source]
+                for var, value in zip(self._shift_vars[2:], extras_shift):
+                    self.opti.set_initial(var, value)
+                self._set_state_initial(1, x_shift[:, 1])   # 电池pack的功率
+                self._set_state_initial(2, x_shift[:, 2])   # SOC
+                temp_guess = x_shift[:, 0]
+                comp_power_guess = u_shift[:, 0]
+                current_guess = u_shift[:, 1]
+            elif source == 'ramp':
                 comp_power_guess = comp_power_guess1
-            elif attempt == 1:
+            elif source == 'debug':
+                if last_iterate is None:
+                    continue
+                x, u = last_iterate
                 comp_power_guess = np.clip(comp_power_guess, 0, 4000)
-                print(f'{x}, length: {len(x)}')
                 temp_guess = x[:,0]
                 current_guess = u[:,1]
-            elif attempt == 2: # 随机生成
+            elif source == 'scaled': # 随机生成
                 comp_power_guess = comp_power_guess2
-            elif attempt == 3:
-                comp_power_guess = np.clip(comp_power_guess, 0, 4000)
-                temp_guess = x[:,0]
-                current_guess = u[:,1]
+            if source == 'ramp' and attempt > 0:
+                # 平移解或缓存的解失败后恢复默认的功率和SOC猜测
+                self._set_state_initial(1, np.full((self.N + 1, 1), self.P_RE[i*self.dt]))
+                self._set_state_initial(2, np.full((self.N + 1, 1), float(SOC)))
+                temp_guess = np.linspace(current_temp, 25, self.N + 1).reshape(-1, 1)
+                current_guess = P_need / 80 / 3.7
             try:
-                self.opti.set_initial(self.opt_states[:, 0], temp_guess)  # 温度
-                self.opti.set_initial(self.opt_controls[:, 0], comp_power_guess)     # 压缩机功率
-                self.opti.set_initial(self.opt_controls[:, 1], current_guess)     # 电池pack的电流
-                start_time = time.time()
-                sol = self.opti.solve()
+                self._set_state_initial(0, temp_guess)  # 温度
+                self._set_control_initial(0, comp_power_guess)     # 压缩机功率
+                self._set_control_initial(1, current_guess)     # 电池pack的电流
+                if self.warm_start:
+                    self.opti.set_initial(self.opti.lam_g, lam_g_guess)     # 约束乘子
+                result = self._solve()
                 end_time = time.time()
-                print(f"Attempt {attempt + 1} time: {(end_time - start_time)*1000} ms")
-                return {
-                    'control_sequence': sol.value(self.opt_controls),
-                    'state_trajectory': sol.value(self.opt_states)
-                }
+                print(f"Attempt {attempt + 1} ({source}) time: {(end_time - start_time)*1000} ms")
+                self._record(i, attempt, source, end_time - start_time, self.stats, result)
+                return self._accept(i, result)
+            except Exception as e:
+                print(f"Attempt {attempt + 1} ({source}) failed: {e}")
+                self._record(i, attempt, source, time.time() - start_time, self.stats, self._iterate)
+                last_iterate = self._trajectories(self._iterate['x'])
+
+        return self._on_failure(i, current_temp, SOC, comp_power)
+
+    def _on_failure(self, i, current_temp, SOC, comp_power):
+        """
+        本步所有尝试失败或超出时间预算：取看门狗记录的目标函数最小的可行迭代点，否则回退到规则控制器。
+        未设置时间预算时返回None，由调用方处理。
+        """
+        if self.step_budget is None:
+            return None
+        best = self._watchdog.best
+        if best is not None:
+            print(f"Step {i}: using best feasible iterate (f={best['f']:.4g})")
+            self._store_solution(i, best)
+            return self._solution(best['x'], source='iterate')
+        print(f"Step {i}: no feasible iterate, falling back to rule-based controller")
+        if self.warm_start and self._iterate is not None:
+            # 下一步从本步被中断的迭代点继续（平移后热启动），求解的进展跨步累积，
+            # 避免每一步都从头求解、再次超出预算而持续回退
+            self._store_solution(i, self._iterate)
+        return self._fallback_solution(i, current_temp, SOC, comp_power)
+
+    def _fallback_solution(self, i, current_temp, SOC, comp_power):
+        """
+        由 RBController 给出当前一步的控制量，并在预测时域内保持不变，得到与multi_solve相同格式的结果
+        （为不增加超时后的延迟，不在时域内滚动规则控制器）；状态轨迹只包含当前状态和下一步预测。
+        计算时控制模型取构建问题前的数值状态，并按当前温度和SOC更新开路电压和电流限制，被改写的属性在返回前恢复。
+        """
+        bm_state, cs_state = dict(self.bm.__dict__), dict(self.cs.__dict__)
+        try:
+            self.bm.__dict__.update(self._numeric_model_states[0])
+            self.cs.__dict__.update(self._numeric_model_states[1])
+            self.bm.update_module_parameters(I_cell=1e-8, T_bat=float(current_temp), SOC=float(SOC))
+            self.fallback.current_comp_power = float(comp_power)
+            comp, I_pack, temp_next, SOC_next = self.fallback.control(i, float(current_temp), float(SOC),
+                                                                      float(comp_power))
+            P_next = float(self.bm.Power_response(I_pack / self.bm.N_parallel))
+        finally:
+            self.bm.__dict__.update(bm_state)
+            self.cs.__dict__.update(cs_state)
+        return {
+            'control_sequence': np.tile([float(comp), float(I_pack)], (self.horizon, 1)),
+            'state_trajectory': np.array([[float(current_temp), self.P_RE[i*self.dt], float(SOC)],
+                                          [float(temp_next), P_next, float(SOC_next)]]),
+            'source': 'fallback'
+        }
+
+    def _rti_solve(self, i, shifted):
+        """
+        实时迭代：以平移后的上一次解为线性化点，只求解一个QP
+        :return: 与multi_solve相同的结果字典，QP求解失败时返回None
+        """
+        self._set_shifted_initial(shifted)
+        start_time = time.time()
+        try:
+            # 只迭代一次，达到最大迭代次数即为正常结束
+            result = self._solve(self._rti_solver, accept_status=('Maximum_Iterations_Exceeded',))
+            end_time = time.time()
+        except Exception as e:
+            print(f"RTI step failed: {e}")
+            self._record(i, 0, 'rti', time.time() - start_time, self.stats, self._iterate)
+            return None
+        print(f"RTI step time: {(end_time - start_time)*1000} ms")
+        # 达到最大迭代次数是实时迭代的正常结束，记为成功
+        self._record(i, 0, 'rti', end_time - start_time, dict(self.stats, success=True), result)
+        self._store_solution(i, result)
+        return self._solution(result['x'], source='rti')
+
+    def _set_shifted_initial(self, shifted):
+        """将平移后的上一次解（原始+对偶）设为Opti的初始值"""
+        x_shift, u_shift, lam_g_shift, extras_shift = shifted
+        for var, value in zip(self._shift_vars[2:], extras_shift):
+            self.opti.set_initial(var, value)
+        for col in range(3):
+            self._set_state_initial(col, x_shift[:, col])
+        self._set_control_initial(0, u_shift[:, 0])
+        self._set_control_initial(1, u_shift[:, 1])
+        self.opti.set_initial(self.opti.lam_g, lam_g_shift)
+
+    def _sensitivity_solve(self, i, shifted):
+        """
+        参数灵敏度预测（切向预测）：在平移后的上一次最优解处线性化内点法的KKT系统（保持互补乘积不变），
+        以当前参数求解一次牛顿步：
+            [H + J_I' Σ J_I   J_E'] [dx    ]     [grad_L   ]
+            [J_E              0   ] [dlam_E] = - [g_E - b_E]
+        其中 Σ = |lam_I| / s_I 为不等式约束的乘子与到积极一侧边界距离之比，dlam_I = Σ J_I dx。
+        上一次解即为当前时刻的最优解（参数不变）时，该步即为一阶的参数灵敏度 -K^-1 (dKKT/dp) dp。
+        预测点的KKT残差（平稳性、约束违反量）不超过 sensitivity_tol 且不等式约束的乘子符号不变时接受
+        :return: 与multi_solve相同的结果字典，未接受时返回None
+        """
+        start_time = time.time()
+        self._set_shifted_initial(shifted)
+        initial = self.opti.initial()
+        x0 = np.array(self.opti.value(self.opti.x, initial)).reshape(-1)
+        lam_g0 = np.array(self.opti.value(self.opti.lam_g, initial)).reshape(-1)
+        p = self.opti.value(self.opti.p, self.opti.value_parameters())
+        lbg, ubg = [np.array(v).reshape(-1) for v in self._nlp_bounds(p)]
+
+        grad_L, g, H, J = self._kkt(x0, lam_g0, p)
+        g = np.array(g).reshape(-1)
+        J = J.sparse()
+        # 不等式约束按乘子符号确定积极的一侧（乘子为正时为上界），到该侧边界的距离截断为正
+        equality = lbg == ubg
+        upper = lam_g0 > 0
+        slack = np.where(upper, ubg - g, g - lbg)[~equality]
+        sigma = np.abs(lam_g0[~equality]) / np.maximum(slack, 1e-8)
+        J_E, J_I = J[equality], J[~equality]
+        K = sparse.bmat([[H.sparse() + J_I.T @ sparse.diags(sigma) @ J_I, J_E.T], [J_E, None]], format='csc')
+        rhs = -np.concatenate([np.array(grad_L).reshape(-1), g[equality] - lbg[equality]])
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', sparse.linalg.MatrixRankWarning)
+            try:
+                step = spsolve(K, rhs)
             except Exception as e:
-                print(f"Attempt {attempt + 1} failed: {e}")
-                x = self.opti.debug.value(self.opt_states)
-                u = self.opti.debug.value(self.opt_controls)
-                if attempt == 0:
-                    print(f'需求功率：{P_need}')
-                
-        return None
+                print(f"Sensitivity step failed: {e}")
+                return None
+        if not np.all(np.isfinite(step)):
+            return None
+        dx = step[:len(x0)]
+        x = x0 + dx
+        lam_g = lam_g0.copy()
+        lam_g[equality] += step[len(x0):]
+        lam_g[~equality] += sigma * (J_I @ dx)
+
+        # 预测点的KKT残差
+        grad_L, g, _, _ = self._kkt(x, lam_g, p)
+        g = np.array(g).reshape(-1)
+        stationarity = float(np.max(np.abs(np.array(grad_L))))
+        violation = float(np.max(np.maximum(np.maximum(lbg - g, g - ubg), 0)))
+        sign_change = np.any((lam_g0 != 0) & (np.sign(lam_g) != np.sign(lam_g0)) & ~equality)
+        residual = np.inf if sign_change else max(stationarity, violation)
+        end_time = time.time()
+        result = {'x': x, 'lam_g': lam_g, 'f': float(self._objective(x, p))}
+        stats = {'iter_count': 0, 'return_status': 'Sensitivity_Step', 'success': residual <= self.sensitivity_tol}
+        self._record(i, 0, 'sensitivity', end_time - start_time, stats, result)
+        if residual > self.sensitivity_tol:
+            print(f"Sensitivity step rejected: KKT residual {residual:.3g} "
+                  f"(stationarity {stationarity:.3g}, violation {violation:.3g}, sign change {bool(sign_change)})")
+            return None
+        print(f"Sensitivity step time: {(end_time - start_time)*1000} ms, KKT residual {residual:.3g}")
+        self.stats = stats
+        return dict(self._accept(i, result), source='sensitivity')
+
+    def _start_pool(self):
+        """创建并行多起点求解的进程池，每个工作进程构建一次自己的求解器"""
+        if self._pool is None:
+            if self._codegen_library is not None:
+                payload = ('library', self._codegen_library)
+                solver_opts = self._library_opts()
+            else:
+                # 看门狗回调无法序列化，工作进程由NLP表达式构建带回调的求解器
+                nlp = self._nlp()
+                serializer = ca.StringSerializer()
+                serializer.pack([nlp['x'], nlp['p'], nlp['f'], nlp['g']])
+                payload = ('serialized', serializer.encode())
+                solver_opts = self._solver_opts
+            solver_spec = payload + (solver_opts, self.opti.nx, self.opti.ng)
+            self._start_generation = multiprocessing.Value('i', 0)
+            self._pool = ProcessPoolExecutor(self.parallel_starts, initializer=_init_start_worker,
+                                             initargs=(solver_spec, self._start_generation))
+        return self._pool
+
+    def _parallel_multi_solve(self, i, current_temp, SOC, comp_power, shifted, step_deadline=None, cached=None):
+        """
+        并行多起点求解：各初始猜测相互独立，同时提交到进程池求解。
+        依赖上一次失败迭代点的'debug'猜测无法并行，改用保持当前状态和压缩机功率的'hold'猜测。
+        :param shifted: 平移后的上一次最优解，无可用解时为None
+        :param step_deadline: 本步时间预算的截止时刻，与start_deadline取较早者
+        :param cached: 解缓存命中时缓存的解（格式同shifted），否则为None
+        """
+        temp_guess, current_guess, comp_power_ramp, comp_power_scaled, _ = \
+            self._heuristic_guesses(i, current_temp, comp_power)
+        P_guess = np.full((self.N + 1, 1), self.P_RE[i*self.dt])
+        SOC_guess = np.full((self.N + 1, 1), float(SOC))
+        lam_g_zero = np.zeros(self.opti.ng)
+        # 每个起点：(温度, 功率, SOC, 压缩机功率, 电流, 约束乘子, 附加变量)，附加变量为None时沿用当前初始值
+        starts = {
+            'ramp': (temp_guess, P_guess, SOC_guess, comp_power_ramp, current_guess, lam_g_zero, None),
+            'scaled': (temp_guess, P_guess, SOC_guess, comp_power_scaled, current_guess, lam_g_zero, None),
+            'hold': (np.full((self.N + 1, 1), float(current_temp)), P_guess, SOC_guess,
+                     np.full((self.N, 1), float(comp_power)), current_guess, lam_g_zero, None)
+        }
+        for source, guess in (('shift', shifted), ('cache', cached)):
+            if guess is not None:
+                x_guess, u_guess, lam_g_guess, extras_guess = guess
+                starts = {source: (x_guess[:, 0], x_guess[:, 1], x_guess[:, 2], u_guess[:, 0], u_guess[:, 1],
+                                   lam_g_guess, extras_guess), **starts}
+
+        # 'first' 取最先收敛的解；'best' 在截止时间内等待所有起点，取目标函数最小的收敛解。
+        # 截止时间同时传给工作进程，超时或本步已取得结果后仍在运行的起点在下一次迭代停止，不占用下一步的进程
+        deadlines = [d for d in (step_deadline,
+                                 None if self.start_deadline is None else time.time() + self.start_deadline)
+                     if d is not None]
+        deadline = min(deadlines) if deadlines else None
+
+        # 参数和约束上下界对所有起点相同
+        p = self.opti.value(self.opti.p, self.opti.value_parameters())
+        lbg, ubg = (b.full().flatten() for b in self._nlp_bounds(p))
+        pool = self._start_pool()
+        generation = self._start_generation.value
+        futures = []
+        for source, (temp, P, soc, comp, current, lam_g, extras) in starts.items():
+            for var, value in zip(self._shift_vars[2:], extras or []):
+                self.opti.set_initial(var, value)
+            self._set_state_initial(0, temp)
+            self._set_state_initial(1, P)
+            self._set_state_initial(2, soc)
+            self._set_control_initial(0, comp)
+            self._set_control_initial(1, current)
+            self.opti.set_initial(self.opti.lam_g, lam_g)
+            x0 = self.opti.value(self.opti.x, self.opti.initial())
+            futures.append(pool.submit(_solve_start, source, x0, lam_g, p, lbg, ubg, generation, deadline))
+
+        best = None
+        attempt = 0
+        pending = set(futures)
+        while pending:
+            timeout = None if deadline is None else max(deadline - time.time(), 0)
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                print(f"Parallel starts reached deadline, {len(pending)} start(s) unfinished")
+                break
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Start failed: {e}")
+                    continue
+                print(f"Start {result['source']} time: {result['time']*1000} ms, status: {result['return_status']}")
+                self._record(i, attempt, result['source'], result['time'], result['stats'], result)
+                attempt += 1
+                self._iterate = result
+                if result['success'] and (best is None or result['f'] < best['f']):
+                    best = result
+            if best is not None and self.start_policy == 'first':
+                break
+        for future in pending:
+            future.cancel()
+        with self._start_generation.get_lock():
+            self._start_generation.value += 1
+
+        if best is None:
+            return None
+        self._iterate = best
+        return self._accept(i, best)
+
+    def reset(self):
+        """
+        清除上一次仿真的求解状态（热启动用的解和迭代点、灵敏度预测计数、参考温度、求解遥测），
+        使同一个控制器可以用于新的闭环仿真而不必重新构建问题；解缓存保留
+        """
+        self._last_solution = None
+        self._iterate = None
+        self._sensitivity_steps = 0
+        self.temp_ref = None
+        self.stats = {}
+        if self.telemetry is not None:
+            self.telemetry.records = []
+        if self.fallback is not None:
+            self.fallback.current_comp_power = 0.0
+
+    def get_state(self):
+        """
+        获取闭环仿真中随求解更新的状态（热启动用的解和迭代点、灵敏度预测计数、参考温度、求解遥测、解缓存），
+        用于检查点；问题本身不保存，恢复时按相同参数重新构建
+        """
+        return {
+            'last_solution': self._last_solution,
+            'iterate': self._iterate,
+            'sensitivity_steps': self._sensitivity_steps,
+            'temp_ref': self.temp_ref,
+            'stats': self.stats,
+            'telemetry': None if self.telemetry is None else self.telemetry.records,
+            'cache': self.cache,
+            'problem_id': self._problem_id
+        }
+
+    def set_state(self, state):
+        """
+        恢复 get_state 保存的状态
+        :param state: get_state 返回的字典，须来自相同参数构建的控制器
+        """
+        if state['problem_id'] != self._problem_id:
+            raise ValueError("检查点中的MPC状态来自不同的问题（时域、权重或模型参数不同）")
+        self._last_solution = state['last_solution']
+        self._iterate = state['iterate']
+        self._sensitivity_steps = state['sensitivity_steps']
+        self.temp_ref = state['temp_ref']
+        self.stats = state['stats']
+        if self.telemetry is not None and state['telemetry'] is not None:
+            self.telemetry.records = state['telemetry']
+        if state['cache'] is not None:
+            self.cache = state['cache']
+
+    def close(self):
+        """关闭并行多起点求解的进程池"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+            self._start_generation = None
 
 
 # === 使用示例 ===
@@ -39,6 +39,23 @@ class RBController:
         # 记录当前压缩机状态
         self.current_comp_power = 0.0
 
+    def batch_rule(self, temps, comp_powers):
+        """
+        对多个实现同时应用控制规则（与 control 中的规则相同），用于蒙特卡洛仿真
+        
+        参数:
+            temps: 各实现的电池温度，形状为 (R,)
+            comp_powers: 各实现当前的压缩机功率，形状为 (R,)
+            
+        返回:
+            各实现新的压缩机功率
+        """
+        temps = np.asarray(temps, dtype=float)
+        comp_powers = np.broadcast_to(np.asarray(comp_powers, dtype=float), temps.shape)
+        return np.where(temps > self.T_high, np.minimum(self.P_comp_on, comp_powers + self.delta_P),
+                        np.where(temps < self.T_low, np.maximum(self.P_comp_off, comp_powers - self.delta_P),
+                                 comp_powers))
+
     def control(self, i, current_temp, SOC, comp_power):
         """
         根据当前温度决定压缩机功率
@@ -0,0 +1,178 @@
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from Battery.BatteryPack import BatteryPack as Battery
+from CoolingSystem.CS_for_ES import SimpleCoolingSystem as CoolingSystem
+from Controller.MPC_for_ES import MPCController
+
+# 每个工作进程构建一次自己的模块MPC控制器（各模块参数相同，状态和参考值随任务传入）
+_worker_mpc = None
+
+def _init_admm_worker(model_args, P_module, mpc_kwargs):
+    """
+    工作进程初始化，按与main.py相同的方式构建控制模型和模块的MPC控制器
+    :param model_args: dict，包含 dt、T_amb、init_temp、init_soc
+    :param P_module: 每个模块平均分担的目标功率序列
+    :param mpc_kwargs: MPCController 的其他参数（须包含 admm_rho）
+    """
+    global _worker_mpc
+    bm = Battery(model_args['dt'], model_args['T_amb'])
+    cs = CoolingSystem(model_args['dt'], T_amb=model_args['T_amb'])
+    bm.update_parameters(I_cell=1e-8, T_bat=model_args['init_temp'], SOC=model_args['init_soc'])
+    _worker_mpc = MPCController(bm, cs, P_module, dt=model_args['dt'], **mpc_kwargs)
+
+def _solve_module(task):
+    """
+    在工作进程中求解一个模块的ADMM子问题
+    :param task: (i, temp, SOC, comp_power, ref, initial)
+    :return: dict，'y' 各阶段的净输出功率和压缩机功率，'initial' 下一次的初始猜测，'solution'，'time'；
+             求解失败时 'solution' 为None，'y' 取失败时的迭代点
+    """
+    i, temp, SOC, comp_power, ref, initial = task
+    start_time = time.time()
+    _worker_mpc.set_admm_ref(ref)
+    try:
+        solution = _worker_mpc.solve(i, temp, SOC, comp_power, initial=initial)
+    except Exception:
+        solution = None
+    x = _worker_mpc._iterate
+    return {
+        'y': _worker_mpc.coupling_outputs(x['x']),
+        'initial': {'x': x['x'], 'lam_g': x['lam_g']},
+        'solution': solution,
+        'time': time.time() - start_time
+    }
+
+class ADMMCoordinator:
+    """
+    多模块的分布式ADMM协调：每个模块在工作进程中求解自己的小规模 MPCController，
+    协调器通过共享变量的投影和对偶变量更新满足站级耦合约束：
+    - 各阶段所有模块的净输出功率之和等于站级目标功率
+    - 可选：各阶段所有模块的压缩机功率之和不超过预算
+    每次迭代的耗时和原始/对偶残差记录在 history 中
+    """
+
+    def __init__(self, modules, P_RE, model_args, mpc_kwargs=None, workers=0, rho=1e-3, max_iter=30, tol=1.0,
+                 comp_budget=None):
+        """
+        初始化ADMM协调器
+        :param modules: 模块数K
+        :param P_RE: 站级目标功率序列（所有模块合计）
+        :param model_args: dict，包含 dt、T_amb、init_temp、init_soc
+        :param mpc_kwargs: 模块 MPCController 的其他参数（N、formulation等）
+        :param workers: 工作进程数，0表示在当前进程中依次求解
+        :param rho: ADMM罚参数
+        :param max_iter: 每个时间步的最大迭代次数
+        :param tol: 收敛阈值 (W)，原始残差和对偶残差的均方根均不超过该值时停止
+        :param comp_budget: 所有模块压缩机功率之和的上限 (W)，None表示不限
+        """
+        self.K = modules
+        self.P_RE = np.asarray(P_RE, dtype=float)
+        self.dt = model_args['dt']
+        self.rho = rho
+        self.max_iter = max_iter
+        self.tol = tol
+        self.comp_budget = comp_budget
+        self.history = []  # 每次迭代: (时间步, 迭代序号, 耗时, 原始残差, 对偶残差, 最大功率偏差)
+
+        mpc_kwargs = dict(mpc_kwargs or {}, admm_rho=rho)
+        initargs = (model_args, self.P_RE / modules, mpc_kwargs)
+        if workers:
+            self._pool = ProcessPoolExecutor(workers, initializer=_init_admm_worker, initargs=initargs)
+        else:
+            self._pool = None
+            _init_admm_worker(*initargs)
+        N = mpc_kwargs.get('N', 24)
+        self.N = len(mpc_kwargs['time_grid']) if mpc_kwargs.get('time_grid') is not None else N
+        self.u = np.zeros((modules, self.N, 2))  # 缩放的对偶变量
+        self.z = None  # 共享变量
+        self._step = None  # 上一次求解的时间步
+        self._initial = [None] * modules
+
+    def _station_preview(self, i):
+        """当前时刻起每一步的站级目标功率，超出数据长度的部分用最后一个值补齐"""
+        P_RE = self.P_RE[i*self.dt : (i + self.N)*self.dt : self.dt]
+        return np.pad(P_RE, (0, self.N - len(P_RE)), mode='edge')
+
+    def _project(self, v, P_station):
+        """
+        将 v = y + u 投影到耦合约束集合上：净输出功率之和等于站级目标功率，压缩机功率之和不超过预算
+        :param v: 形状为 (K, N, 2)
+        """
+        z = v.copy()
+        z[:, :, 0] -= (v[:, :, 0].sum(axis=0) - P_station) / self.K
+        if self.comp_budget is not None:
+            excess = np.maximum(v[:, :, 1].sum(axis=0) - self.comp_budget, 0)
+            z[:, :, 1] -= excess / self.K
+        return z
+
+    def _map(self, tasks):
+        if self._pool is None:
+            return [_solve_module(task) for task in tasks]
+        return list(self._pool.map(_solve_module, tasks))
+
+    def solve(self, i, temps, SOCs, comp_powers):
+        """
+        ADMM迭代求解第i步
+        :param temps: 各模块的电池温度，长度K
+        :param SOCs: 各模块的SOC
+        :param comp_powers: 各模块当前的压缩机功率
+        :return: 各模块的求解结果（与 MPCController.solve 相同），求解失败的模块为None
+        """
+        P_station = self._station_preview(i)
+        if self.z is None:
+            # 初始时平均分配站级功率，压缩机功率保持当前值
+            z = np.zeros((self.K, self.N, 2))
+            z[:, :, 0] = P_station / self.K
+            z[:, :, 1] = np.asarray(comp_powers, dtype=float).reshape(-1, 1)
+        else:
+            # 上一时间步的共享变量和对偶变量平移到当前时刻，超出时域的部分用最后一个阶段补齐
+            index = np.minimum(np.arange(self.N) + i - self._step, self.N - 1)
+            z = self._project(self.z[:, index], P_station)
+            self.u = self.u[:, index]
+        scale = np.sqrt(z.size)
+        for iteration in range(self.max_iter):
+            start_time = time.time()
+            tasks = [(i, float(temps[k]), float(SOCs[k]), float(comp_powers[k]), z[k] - self.u[k], self._initial[k])
+                     for k in range(self.K)]
+            results = self._map(tasks)
+            y = np.stack([r['y'] for r in results])
+            self._initial = [r['initial'] for r in results]
+
+            z_prev = z
+            z = self._project(y + self.u, P_station)
+            self.u += y - z
+            primal = np.linalg.norm(y - z) / scale
+            dual = np.linalg.norm(z - z_prev) / scale
+            violation = np.max(np.abs(y[:, :, 0].sum(axis=0) - P_station))
+            elapsed = time.time() - start_time
+            self.history.append((i, iteration, elapsed, primal, dual, violation))
+            print(f"ADMM step {i} iter {iteration}: {elapsed*1000:.1f} ms "
+                  f"(module max {max(r['time'] for r in results)*1000:.1f} ms), "
+                  f"primal {primal:.3g} W, dual {dual:.3g} W, power mismatch {violation:.3g} W")
+            if primal <= self.tol and dual <= self.tol:
+                break
+        self.z, self._step = z, i
+        return [r['solution'] for r in results]
+
+    def summary(self):
+        """每个时间步的迭代次数、每次迭代的耗时和最终残差"""
+        if not self.history:
+            return {}
+        history = np.array(self.history)
+        steps, index = np.unique(history[:, 0], return_index=True)
+        last = np.append(index[1:], len(history)) - 1
+        return {
+            'steps': len(steps),
+            'iterations_mean': np.mean(np.diff(np.append(index, len(history)))),
+            'iteration_time_mean_ms': np.mean(history[:, 2]) * 1000,
+            'primal_final_mean': np.mean(history[last, 3]),
+            'dual_final_mean': np.mean(history[last, 4]),
+            'mismatch_final_max': np.max(history[last, 5])
+        }
+
+    def close(self):
+        """关闭工作进程池"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
@@ -0,0 +1,86 @@
+import numpy as np
+
+class EventTrigger:
+    """
+    事件触发的MPC重新求解调度
+
+    保存最近一次求解的预测状态轨迹和当时的发电功率预测，之后每次检查时比较：
+    - 实测温度、SOC与预测轨迹的偏差
+    - 当前发电功率预测与求解时预测的偏差（相对于求解时预测的平均绝对值）
+    - 上一次解剩余的有效时域
+    任一项超过阈值时重新求解，否则继续使用上一次解的后续控制量
+    """
+
+    def __init__(self, temp_tol=0.1, SOC_tol=0.005, preview_tol=0.05, min_horizon=10):
+        """
+        初始化事件触发器
+        :param temp_tol: 温度偏差阈值 (℃)
+        :param SOC_tol: SOC偏差阈值
+        :param preview_tol: 发电功率预测的相对偏差阈值
+        :param min_horizon: 上一次解剩余的最少有效步数，少于该值时重新求解
+        """
+        self.temp_tol = temp_tol
+        self.SOC_tol = SOC_tol
+        self.preview_tol = preview_tol
+        self.min_horizon = min_horizon
+
+        self.solution = None  # 最近一次求解的结果
+        self.step = None      # 最近一次求解的时间步
+        self.preview = None   # 最近一次求解时的发电功率预测
+        self.counts = {'solved': 0, 'skipped': 0, 'initial': 0, 'temp': 0, 'SOC': 0, 'preview': 0, 'horizon': 0}
+
+    def update(self, i, solution, preview):
+        """
+        记录一次求解的结果
+        :param i: 求解的时间步
+        :param solution: multi_solve 的结果，求解失败时为None
+        :param preview: 求解时从第i步起的发电功率预测（按基本步长）
+        """
+        self.solution = solution
+        self.step = i
+        self.preview = np.array(preview, dtype=float)
+
+    def offset(self, i):
+        """第i步在上一次解中的位置"""
+        return i - self.step
+
+    def check(self, i, current_temp, SOC, preview, n_steps):
+        """
+        判断第i步是否需要重新求解
+        :param preview: 当前从第i步起的发电功率预测（按基本步长）
+        :param n_steps: 本次将要施加的控制步数
+        :return: 触发原因，不需要重新求解时返回None
+        """
+        reason = self._reason(i, current_temp, SOC, preview, n_steps)
+        if reason is None:
+            self.counts['skipped'] += 1
+        else:
+            self.counts['solved'] += 1
+            self.counts[reason] += 1
+        return reason
+
+    def _reason(self, i, current_temp, SOC, preview, n_steps):
+        if self.solution is None:
+            return 'initial'
+        k = self.offset(i)
+        controls = self.solution['control_sequence']
+        states = self.solution['state_trajectory']
+        # 规则控制器回退等结果只有很短的状态轨迹，无法据此跳过求解
+        if len(controls) - k < max(self.min_horizon, n_steps) or k >= len(states):
+            return 'horizon'
+        if abs(current_temp - states[k, 0]) > self.temp_tol:
+            return 'temp'
+        if abs(SOC - states[k, 2]) > self.SOC_tol:
+            return 'SOC'
+        # 比较求解时和当前对同一段时间的发电功率预测
+        stored = self.preview[k:]
+        current = np.asarray(preview, dtype=float)[:len(stored)]
+        scale = max(np.mean(np.abs(stored)), 1e-9)
+        if np.max(np.abs(current - stored[:len(current)])) / scale > self.preview_tol:
+            return 'preview'
+        return None
+
+    def summary(self):
+        """求解和跳过的次数，以及各触发原因的次数"""
+        total = self.counts['solved'] + self.counts['skipped']
+        return dict(self.counts, skip_rate=self.counts['skipped'] / total if total else 0.0)
@@ -0,0 +1,293 @@
+import time
+import bisect
+import itertools
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from Battery.BatteryPack import BatteryPack as Battery
+from CoolingSystem.CS_for_ES import SimpleCoolingSystem as CoolingSystem
+from Controller.MPC_for_ES import MPCController
+
+# 查表的输入维度，依次为表格的各个轴
+TABLE_AXES = ('temp', 'SOC', 'comp_power', 'P_mean', 'P_trend')
+
+def preview_features(preview):
+    """
+    发电功率预测的摘要特征
+    :param preview: 预测时域内的发电功率（按基本步长dt）
+    :return: (平均值, 后半段平均值 - 前半段平均值)
+    """
+    preview = np.asarray(preview, dtype=float)
+    half = len(preview) // 2
+    return preview.mean(), preview[half:].mean() - preview[:half].mean()
+
+def synthetic_preview(P_mean, P_trend, horizon):
+    """
+    由摘要特征还原一条线性的发电功率预测，其平均值和前后半段之差与给定特征一致
+    """
+    return P_mean + P_trend * np.linspace(-1, 1, horizon)
+
+def default_grid(P_RE, horizon, n_P_mean=5, n_P_trend=3):
+    """
+    默认的扫描网格：状态和压缩机功率取固定范围，发电功率特征取P_RE所有预测窗口特征的1%~99%分位数
+    :param P_RE: 可再生能源发电功率序列
+    :param horizon: 预测时域覆盖的步数
+    :return: dict，TABLE_AXES中每个轴对应的网格点
+    """
+    P_RE = np.asarray(P_RE, dtype=float)
+    csum = np.concatenate([[0], np.cumsum(P_RE)])
+    half = horizon // 2
+    starts = np.arange(len(P_RE) - horizon + 1)
+    first = (csum[starts + half] - csum[starts]) / half
+    second = (csum[starts + horizon] - csum[starts + half]) / (horizon - half)
+    mean = (csum[starts + horizon] - csum[starts]) / horizon
+    return {
+        'temp': np.linspace(20, 32, 7),
+        'SOC': np.linspace(0.1, 0.9, 5),
+        'comp_power': np.linspace(0, 4000, 5),
+        'P_mean': np.linspace(*np.percentile(mean, [1, 99]), n_P_mean),
+        'P_trend': np.linspace(*np.percentile(second - first, [1, 99]), n_P_trend)
+    }
+
+# 离线扫描：每个工作进程构建一次自己的模型和MPC控制器
+_worker_mpc = None
+
+def _init_sweep_worker(model_args, mpc_kwargs):
+    """
+    工作进程初始化，按与main.py相同的方式构建控制模型和MPC控制器
+    :param model_args: dict，包含 dt、T_amb、init_temp、init_soc
+    :param mpc_kwargs: MPCController 的其他参数
+    """
+    global _worker_mpc
+    bm = Battery(model_args['dt'], model_args['T_amb'])
+    cs = CoolingSystem(model_args['dt'], T_amb=model_args['T_amb'])
+    bm.update_parameters(I_cell=1e-8, T_bat=model_args['init_temp'], SOC=model_args['init_soc'])
+    _worker_mpc = MPCController(bm, cs, np.zeros(0), dt=model_args['dt'], **mpc_kwargs)
+
+def _solve_point(point):
+    """在工作进程中求解一个网格点，返回第一步的最优压缩机功率，求解失败时返回nan"""
+    temp, SOC, comp_power, P_mean, P_trend = point
+    preview = synthetic_preview(P_mean, P_trend, _worker_mpc.horizon)
+    try:
+        solution = _worker_mpc.solve(0, temp, SOC, comp_power, preview=preview)
+    except Exception:
+        return np.nan
+    return float(solution['control_sequence'][0, 0])
+
+def build_policy_table(P_RE, out_file, model_args, mpc_kwargs=None, grid=None, workers=1):
+    """
+    在网格上离线扫描 MPCController.solve，将第一步的最优压缩机功率保存为npz查找表
+    :param P_RE: 可再生能源发电功率序列（用于确定发电功率特征的网格范围）
+    :param out_file: 输出的npz文件
+    :param model_args: dict，包含 dt、T_amb、init_temp、init_soc
+    :param mpc_kwargs: MPCController 的其他参数（N、formulation、time_grid等）
+    :param grid: dict，各轴的网格点，缺省取 default_grid
+    :param workers: 并行求解的进程数
+    :return: 查找表的 dict
+    """
+    mpc_kwargs = dict(mpc_kwargs or {})
+    # 预测时域覆盖的步数，与MPCController的计算方式一致
+    time_grid = mpc_kwargs.get('time_grid')
+    horizon = int(np.sum(time_grid)) if time_grid is not None else mpc_kwargs.get('N', 24)
+    grid = grid or default_grid(P_RE, horizon)
+    axes = [np.asarray(grid[name], dtype=float) for name in TABLE_AXES]
+    points = list(itertools.product(*axes))
+    print(f"Sweeping {len(points)} grid points with {workers} worker(s)")
+
+    start_time = time.time()
+    with ProcessPoolExecutor(workers, initializer=_init_sweep_worker,
+                             initargs=(model_args, mpc_kwargs)) as pool:
+        values = np.array(list(pool.map(_solve_point, points, chunksize=max(1, len(points) // (workers * 16)))))
+    values = values.reshape([len(a) for a in axes])
+    failed = np.isnan(values)
+    print(f"Sweep time: {time.time() - start_time:.1f} s, failed points: {failed.sum()}/{failed.size}")
+
+    # 求解失败的网格点取最近的成功网格点的值（按归一化坐标的距离）
+    if failed.any() and not failed.all():
+        coords = np.stack(np.meshgrid(*[np.linspace(0, 1, len(a)) for a in axes], indexing='ij'), axis=-1)
+        ok = coords[~failed]
+        for index in zip(*np.nonzero(failed)):
+            nearest = np.argmin(np.sum((ok - coords[index])**2, axis=1))
+            values[index] = values[~failed][nearest]
+
+    table = {name: axis for name, axis in zip(TABLE_AXES, axes)}
+    table.update(values=values, failed=failed, horizon=horizon, dt=model_args['dt'])
+    np.savez(out_file, **table)
+    print(f"Policy table saved to: {out_file}")
+    return table
+
+class ExplicitMPCController:
+    """
+    显式MPC控制器：在离线扫描得到的查找表上多线性插值，得到压缩机功率
+
+    控制接口与 RBController 相同，插值只需数组运算，单次调用在微秒量级
+    """
+
+    def __init__(self, battery_model, cooling_system, P_RE, table_file, dt=1, P_comp_limits=(0, 4000)):
+        """
+        初始化显式MPC控制器
+
+        参数:
+            battery_model: 电池热模型实例
+            cooling_system: 冷却系统模型实例
+            P_RE: 可再生能源发电功率序列
+            table_file: build_policy_table 生成的npz查找表
+            dt: 时间步长(s)
+            P_comp_limits: 压缩机功率范围 (min, max)
+        """
+        self.bm = battery_model
+        self.cs = cooling_system
+        self.P_RE = np.asarray(P_RE, dtype=float)
+        self.dt = dt
+        self.P_min, self.P_max = P_comp_limits
+
+        table = np.load(table_file)
+        self.axes = [table[name] for name in TABLE_AXES]
+        self.values = table['values']
+        self.horizon = int(table['horizon'])
+        # 超立方体的2^d个顶点相对于下界网格点的偏移
+        self._corners = np.array(list(itertools.product([0, 1], repeat=len(self.axes))))
+        self._axis_lists = [axis.tolist() for axis in self.axes]  # 标量查找用bisect比numpy快
+
+        # 各预测窗口的发电功率特征，用累积和预先计算
+        self._csum = np.concatenate([[0], np.cumsum(self.P_RE)])
+
+    def features(self, i):
+        """第i步起预测窗口的发电功率特征 (平均值, 后半段平均值 - 前半段平均值)"""
+        start = i * self.dt
+        half = self.horizon // 2
+        csum = self._csum
+        end = min(start + self.horizon, len(self.P_RE))
+        if end - start < self.horizon:
+            # 数据末尾的窗口不完整，直接计算
+            return preview_features(self.P_RE[start:end])
+        first = (csum[start + half] - csum[start]) / half
+        second = (csum[end] - csum[start + half]) / (self.horizon - half)
+        return (csum[end] - csum[start]) / self.horizon, second - first
+
+    def policy(self, point):
+        """
+        在查找表上做多线性插值，超出网格的坐标截断到网格边界
+        :param point: 按 TABLE_AXES 排列的输入
+        :return: 压缩机功率
+        """
+        lower, frac = [], []
+        for axis, x in zip(self._axis_lists, point):
+            j = min(max(bisect.bisect_right(axis, x) - 1, 0), len(axis) - 2)
+            lower.append(j)
+            frac.append(min(max((x - axis[j]) / (axis[j + 1] - axis[j]), 0.0), 1.0))
+        frac = np.array(frac)
+        index = np.array(lower) + self._corners
+        weights = np.prod(np.where(self._corners, frac, 1 - frac), axis=1)
+        return float(weights @ self.values[tuple(index.T)])
+
+    def control(self, i, current_temp, SOC, comp_power):
+        """
+        查表得到压缩机功率并计算下一步状态
+
+        参数:
+            i: 当前时间步
+            current_temp: 当前电池温度
+            SOC: 当前SOC
+            comp_power: 当前压缩机功率
+
+        返回:
+            (压缩机功率, 电池pack电流, 下一步温度, 下一步SOC)
+        """
+        P_mean, P_trend = self.features(i)
+        new_comp_power = self.policy((current_temp, SOC, comp_power, P_mean, P_trend))
+        new_comp_power = min(max(new_comp_power, self.P_min), self.P_max)
+
+        # 计算冷却量和冷却功率
+        Q_cool = float(self.cs.battery_cooling(current_temp, new_comp_power))
+        P_cool = new_comp_power + 200  # 压缩机功率加上基础功率
+
+        # 计算功率缺口和所需电流
+        P_gap = self.P_RE[i * self.dt] + P_cool
+        I_pack = self.bm.Current_Pack2Cell(P_gap)
+        I_pack = min(I_pack, self.bm.I_max_limit)
+        I_pack = max(I_pack, self.bm.I_min_limit)
+
+        # 计算下一步状态
+        temp_next, _, SOC_next, _, _ = self.bm.battery_model(
+            Q_cool=Q_cool,
+            I_pack=I_pack,
+            T_bat=current_temp,
+            SOC=SOC
+        )
+
+        return new_comp_power, I_pack, temp_next, SOC_next
+
+def evaluate_policy(controller, mpc, n_samples=100, seed=0):
+    """
+    对比查表结果与在线MPC的第一步最优压缩机功率
+    :param controller: ExplicitMPCController
+    :param mpc: 与构建查找表时配置相同的 MPCController
+    :param n_samples: 随机采样的状态数，状态在网格范围内均匀采样，时刻在P_RE上均匀采样
+    :return: dict，插值误差统计和两者的单次耗时
+    """
+    rng = np.random.default_rng(seed)
+    temp_axis, SOC_axis, comp_axis = controller.axes[:3]
+    last_step = (len(controller.P_RE) - mpc.horizon * mpc.dt) // mpc.dt
+    errors, table_times, online_times = [], [], []
+    for _ in range(n_samples):
+        i = int(rng.integers(0, last_step))
+        temp = rng.uniform(temp_axis[0], temp_axis[-1])
+        SOC = rng.uniform(SOC_axis[0], SOC_axis[-1])
+        comp_power = rng.uniform(comp_axis[0], comp_axis[-1])
+
+        start_time = time.perf_counter()
+        P_mean, P_trend = controller.features(i)
+        table_comp = controller.policy((temp, SOC, comp_power, P_mean, P_trend))
+        table_times.append(time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        try:
+            solution = mpc.solve(i, temp, SOC, comp_power)
+        except Exception:
+            continue
+        online_times.append(time.perf_counter() - start_time)
+        errors.append(table_comp - solution['control_sequence'][0, 0])
+
+    errors = np.abs(errors)
+    report = {
+        'samples': len(errors),
+        'mae': float(np.mean(errors)),
+        'rmse': float(np.sqrt(np.mean(errors**2))),
+        'p95': float(np.percentile(errors, 95)),
+        'max': float(np.max(errors)),
+        'table_time_us': float(np.mean(table_times) * 1e6),
+        'online_time_ms': float(np.mean(online_times) * 1e3)
+    }
+    print(f"Interpolation error over {report['samples']} samples: MAE {report['mae']:.1f} W, "
+          f"RMSE {report['rmse']:.1f} W, P95 {report['p95']:.1f} W, max {report['max']:.1f} W")
+    print(f"Table lookup: {report['table_time_us']:.1f} us, online MPC: {report['online_time_ms']:.1f} ms")
+    return report
+
+# === 使用示例 ===
+if __name__ == "__main__":
+    from EnergyStorageSystem.Ningbo import POWER as TARGET
+
+    parser = argparse.ArgumentParser(description='显式MPC查找表的离线构建和误差评估')
+    parser.add_argument('--table', type=str, default='results/explicit_mpc.npz', help='查找表文件')
+    parser.add_argument('--N', type=int, default=100, help='MPC预测时域')
+    parser.add_argument('--formulation', type=str, default='mapped', choices=['unrolled', 'mapped'],
+                        help='MPC时域构建方式')
+    parser.add_argument('--workers', type=int, default=4, help='离线扫描的进程数')
+    parser.add_argument('--n_samples', type=int, default=100, help='误差评估的采样数')
+    parser.add_argument('--skip_build', action='store_true', help='直接使用已有的查找表')
+    args = parser.parse_args()
+
+    model_args = {'dt': 1, 'T_amb': 35.0, 'init_temp': 25.0, 'init_soc': 0.6}
+    mpc_kwargs = {'N': args.N, 'formulation': args.formulation}
+    if not args.skip_build:
+        build_policy_table(TARGET, args.table, model_args, mpc_kwargs, workers=args.workers)
+
+    bm = Battery(model_args['dt'], model_args['T_amb'])
+    cs = CoolingSystem(model_args['dt'], T_amb=model_args['T_amb'])
+    bm.update_parameters(I_cell=1e-8, T_bat=model_args['init_temp'], SOC=model_args['init_soc'])
+    mpc = MPCController(bm, cs, TARGET, dt=model_args['dt'], **mpc_kwargs)
+    controller = ExplicitMPCController(Battery(model_args['dt'], model_args['T_amb']),
+                                       CoolingSystem(model_args['dt'], T_amb=model_args['T_amb']),
+                                       TARGET, args.table, dt=model_args['dt'])
+    evaluate_policy(controller, mpc, n_samples=args.n_samples)
@@ -0,0 +1,182 @@
+import time
+import numpy as np
+import casadi as ca
+from Controller.MPC_for_ES import DEFAULT_WEIGHTS, transition_function
+
+def coarse_transition_function(battery_model, cooling_system, substeps):
+    """
+    上层规划使用的粗粒度状态转移函数：一个阶段内压缩机功率保持不变，
+    用substeps个子步积分单步转移函数，每个子步的pack电流取满足功率需求的电流（按当前SOC的电流上下限截断），
+    与仿真中电流跟随功率缺口的方式一致
+    - 输入 x: [电池温度, 电池pack功率, SOC, 冷却液出口温度]
+    - 输入 u: 压缩机功率
+    - 输入 P_RE: 该阶段的平均发电功率
+    - 输入 dt: 阶段长度 (s)
+    - 输出 x_next: 阶段结束时的 x
+    """
+    step = transition_function(battery_model, cooling_system)
+    x = ca.SX.sym('x', 4)
+    u = ca.SX.sym('u')
+    P_RE = ca.SX.sym('P_RE')
+    h = ca.SX.sym('dt')
+    x_next = x
+    for _ in range(substeps):
+        _, I_limits, I_pack_need = step(x_next, ca.vertcat(u, 0), P_RE, h / substeps)
+        I_pack = ca.fmin(ca.fmax(I_pack_need, I_limits[0]), I_limits[1])
+        x_next = step(x_next, ca.vertcat(u, I_pack), P_RE, h / substeps)[0]
+    return ca.Function('coarse_step', [x, u, P_RE, h], [x_next], ['x', 'u', 'P_RE', 'dt'], ['x_next'])
+
+class UpperPlanner:
+    """
+    上层规划：以分钟级阶段在数小时的时域上规划压缩机功率，得到电池温度和SOC的设定轨迹。
+    pack电流由功率需求决定，SOC不是控制量，其设定轨迹为按规划运行时的预测值。
+    """
+
+    def __init__(self, battery_model, cooling_system, P_RE, stage=600, N=36, substeps=10, T_opt=25,
+                 P_comp_limits=(0, 4000), weights=None, threshold_width=50):
+        """
+        初始化上层规划
+        :param battery_model: 电池模型（构建时使用其当前的数值状态）
+        :param cooling_system: 冷却系统模型
+        :param P_RE: 可再生能源发电功率序列（1秒分辨率）
+        :param stage: 每个阶段的长度 (s)
+        :param N: 阶段数，规划时域为 N*stage 秒
+        :param substeps: 每个阶段内积分的子步数
+        :param T_opt: 目标电池温度
+        :param P_comp_limits: 压缩机功率范围 (min, max)
+        :param weights: 目标函数权重，缺省的项取 DEFAULT_WEIGHTS
+        :param threshold_width: 压缩机开启阈值的平滑宽度 (W)，粗粒度阶段上阶跃阈值没有梯度
+        """
+        self.P_RE = np.asarray(P_RE, dtype=float)
+        self.stage = stage
+        self.N = N
+        self.T_opt = T_opt
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.P_min, self.P_max = P_comp_limits
+        self.solve_times = []  # 每次规划的耗时 (s)
+
+        threshold = cooling_system.threshold_width
+        cooling_system.threshold_width = threshold_width
+        try:
+            step = coarse_transition_function(battery_model, cooling_system, substeps).map(N)
+        finally:
+            cooling_system.threshold_width = threshold
+
+        self.opti = ca.Opti()
+        self.states = self.opti.variable(N + 1, 4)  # [温度, pack功率, SOC, 冷却液出口温度]
+        self.comp_power = self.opti.variable(N, 1)
+        self.initial_state = self.opti.parameter(1, 4)
+        self.initial_comp_power = self.opti.parameter(1, 1)
+        self.P_preview = self.opti.parameter(N, 1)
+
+        X = self.states.T
+        self.opti.subject_to(self.states[0, :] == self.initial_state)
+        self.opti.subject_to(X[:, 1:] == step(X[:, :-1], self.comp_power.T, self.P_preview.T, stage))
+        self.opti.subject_to(self.opti.bounded(self.P_min, self.comp_power, self.P_max))
+
+        # 与下层相同的目标函数项，温度和压缩机功率按阶段长度（秒）加权
+        temp = self.states[1:, 0]
+        comp_power_prev = ca.vertcat(self.initial_comp_power, self.comp_power[:-1])
+        self.opti.minimize(stage * self.weights['temp'] * ca.sumsqr(temp - T_opt)
+                           + stage * self.weights['comp'] * ca.sumsqr(self.comp_power)
+                           + self.weights['dcomp'] * ca.sumsqr(self.comp_power - comp_power_prev))
+        self.opti.solver('ipopt', {'ipopt': {'max_iter': 500, 'print_level': 0, 'tol': 1e-6}, 'print_time': False})
+        self._last = None  # 上一次的规划，用于热启动
+
+    def _preview(self, t):
+        """从第t秒起每个阶段内发电功率的平均值，超出数据长度的部分用最后一个值补齐"""
+        P_RE = self.P_RE[t : t + self.N * self.stage]
+        P_RE = np.pad(P_RE, (0, self.N * self.stage - len(P_RE)), mode='edge')
+        return P_RE.reshape(self.N, self.stage).mean(axis=1)
+
+    def plan(self, t, current_temp, SOC, comp_power, T_clnt):
+        """
+        从第t秒的状态规划
+        :param t: 当前时刻 (s)
+        :param T_clnt: 当前冷却液出口温度
+        :return: dict，'times' 各阶段节点的时刻 (s)，'temp'、'SOC' 节点处的设定值，'comp_power' 各阶段的压缩机功率
+        """
+        start_time = time.time()
+        P_preview = self._preview(t)
+        self.opti.set_value(self.initial_state, [float(current_temp), P_preview[0], float(SOC), float(T_clnt)])
+        self.opti.set_value(self.initial_comp_power, float(comp_power))
+        self.opti.set_value(self.P_preview, P_preview)
+        if self._last is None:
+            self.opti.set_initial(self.states[:, 0], float(current_temp))
+            self.opti.set_initial(self.states[:, 1], P_preview[0])
+            self.opti.set_initial(self.states[:, 2], float(SOC))
+            self.opti.set_initial(self.states[:, 3], float(T_clnt))
+            self.opti.set_initial(self.comp_power, float(comp_power))
+        else:
+            # 上一次的规划平移到当前时刻
+            shift = int(round((t - self._last['times'][0]) / self.stage))
+            index = np.minimum(np.arange(self.N + 1) + shift, self.N)
+            self.opti.set_initial(self.states, self._last['states'][index])
+            self.opti.set_initial(self.comp_power, self._last['comp_power'][np.minimum(index[:-1], self.N - 1)])
+        sol = self.opti.solve()
+        states = np.array(sol.value(self.states))
+        plan = {
+            'times': t + self.stage * np.arange(self.N + 1),
+            'temp': states[:, 0],
+            'SOC': states[:, 2],
+            'comp_power': np.array(sol.value(self.comp_power)).reshape(-1),
+            'states': states
+        }
+        self._last = plan
+        self.solve_times.append(time.time() - start_time)
+        return plan
+
+class HierarchicalMPC:
+    """
+    多速率分层MPC：上层每隔replan_interval秒在小时级时域上规划温度和SOC的设定轨迹，
+    下层的秒级MPC（MPCController）以上层的温度设定轨迹作为参考温度跟踪
+    """
+
+    def __init__(self, mpc, planner, replan_interval=900):
+        """
+        :param mpc: 下层的 MPCController
+        :param planner: 上层的 UpperPlanner
+        :param replan_interval: 上层重新规划的间隔 (s)
+        """
+        self.mpc = mpc
+        self.planner = planner
+        self.replan_interval = replan_interval
+        self.plan = None
+        self.failures = 0
+        self._next_plan = 0
+        # 下层的参考温度（1秒分辨率），规划未覆盖的部分为T_opt
+        self.mpc.temp_ref = np.full(len(planner.P_RE), float(mpc.T_opt))
+
+    def update(self, i, current_temp, SOC, comp_power, T_clnt):
+        """
+        到达重新规划的时刻时求解上层规划，并将温度设定轨迹插值为下层的参考温度
+        :param i: 下层的当前时间步
+        :param T_clnt: 当前冷却液出口温度
+        :return: 本次的规划，未重新规划或规划失败时返回None
+        """
+        t = i * self.mpc.dt
+        if t < self._next_plan:
+            return None
+        self._next_plan = t + self.replan_interval
+        try:
+            plan = self.planner.plan(t, current_temp, SOC, comp_power, T_clnt)
+        except Exception as e:
+            # 规划失败时保持原有的参考温度
+            self.failures += 1
+            print(f"Upper planning at {t} s failed: {e}")
+            return None
+        end = min(plan['times'][-1], len(self.mpc.temp_ref) - 1)
+        seconds = np.arange(t, end + 1)
+        self.mpc.temp_ref[t:end + 1] = np.interp(seconds, plan['times'], plan['temp'])
+        self.plan = plan
+        return plan
+
+    def summary(self):
+        """上层规划次数、失败次数和耗时"""
+        solve_times = np.array(self.planner.solve_times) * 1000
+        return {
+            'plans': len(solve_times),
+            'failures': self.failures,
+            'plan_time_mean_ms': solve_times.mean() if len(solve_times) else 0.0,
+            'plan_time_max_ms': solve_times.max() if len(solve_times) else 0.0
+        }
@@ -0,0 +1,151 @@
+import time
+import numpy as np
+import casadi as ca
+from Controller.MPC_for_ES import DEFAULT_WEIGHTS, transition_function
+
+# 多模块问题的默认权重：单模块的权重，加上各模块电流偏离平均分配电流的权重
+MODULE_WEIGHTS = dict(DEFAULT_WEIGHTS, I_share=1.0)
+
+class MultiModuleMPCController:
+    """
+    多模块储能站的MPC控制器：K个电池pack（各自的冷却系统）构成一个结构化的NLP
+
+    - 每个模块的状态: [电池温度, 电池pack功率, SOC, 冷却液出口温度]，控制量: [压缩机功率, 电池pack电流]
+    - 所有模块、所有阶段的状态转移由单步SX函数 map 为一次向量化调用
+    - 模块之间的耦合：各阶段所有模块的输出功率之和等于站级目标功率加上所有模块的冷却功耗，
+      可选的压缩机总功率预算
+    模块之间只通过每个阶段的耦合约束相连，NLP的规模和求解耗时随K近似线性增长。
+    """
+
+    def __init__(self, battery_model, cooling_system, P_RE, modules, T_opt=25, N=24, dt=1,
+                 P_comp_limits=(0, 4000), comp_budget=None, weights=None, P_BTM_base=200):
+        """
+        初始化多模块MPC控制器
+        :param battery_model: 单个模块的电池模型（各模块参数相同）
+        :param cooling_system: 单个模块的冷却系统模型
+        :param P_RE: 站级目标功率序列（所有模块合计）
+        :param modules: 模块数K
+        :param T_opt: 目标电池温度
+        :param N: 预测时域步数
+        :param dt: 离散时间步长 (s)
+        :param P_comp_limits: 每个模块压缩机功率范围 (min, max)
+        :param comp_budget: 所有模块压缩机功率之和的上限 (W)，None表示不限
+        :param weights: 目标函数权重，缺省的项取 MODULE_WEIGHTS。模块温度相近时电流的分配几乎不影响目标函数，
+                        'I_share' 项使问题良态
+        :param P_BTM_base: 每个模块热管理系统的基础功耗 (W)
+        """
+        self.P_RE = P_RE
+        self.K = K = modules
+        self.N = N
+        self.dt = dt
+        self.horizon = N
+        self.T_opt = T_opt
+        self.P_min, self.P_max = P_comp_limits
+        self.comp_budget = comp_budget
+        self.weights = dict(MODULE_WEIGHTS, **(weights or {}))
+        self.T_clnt0 = float(cooling_system.T_clnt_out)
+        self.stats = {}
+        self._last_x = None
+
+        self._step = transition_function(battery_model, cooling_system)
+        step = self._step.map(N * K)
+
+        self.opti = ca.Opti()
+        # 状态按阶段排列：第j个节点第k个模块为第 j*K+k 列，耦合约束只涉及相邻的列，KKT矩阵近似带状
+        self.opt_states = self.opti.variable(4, (N + 1) * K)
+        # 控制按阶段排列：第j个阶段第k个模块为第 j*K+k 列
+        self.opt_controls = self.opti.variable(2, N * K)
+        self.initial_state = self.opti.parameter(4, K)
+        self.initial_comp_power = self.opti.parameter(1, K)
+        self.P_preview = self.opti.parameter(N, 1)
+
+        X, U = self.opt_states, self.opt_controls
+        X_cur, X_next = X[:, :N * K], X[:, K:]
+        h = ca.DM.ones(1, N * K) * dt
+        P_module = ca.repmat(self.P_preview.T / K, K, 1).reshape((1, N * K))
+        X_model, I_limits, I_share = step(X_cur, U, P_module, h)
+
+        # 初始条件和状态转移
+        self.opti.subject_to(X[:, :K] == self.initial_state)
+        self.opti.subject_to(X_next == X_model)
+
+        # 每个模块的电流、压缩机功率和SOC限制
+        self.opti.subject_to(self.opti.bounded(I_limits[0, :] + 1, U[1, :], I_limits[1, :] - 1))
+        self.opti.subject_to(self.opti.bounded(self.P_min, U[0, :], self.P_max))
+        self.opti.subject_to(self.opti.bounded(battery_model.SOC_min, X_next[2, :], 0.99))
+
+        # 站级耦合：每个阶段所有模块的输出功率之和满足目标功率和冷却功耗
+        comp = ca.reshape(U[0, :], K, N).T  # N x K
+        P_response = ca.reshape(X_next[1, :], K, N).T
+        self.opti.subject_to(ca.sum2(P_response) == self.P_preview + ca.sum2(comp) + P_BTM_base * K)
+        if comp_budget is not None:
+            self.opti.subject_to(ca.sum2(comp) <= comp_budget)
+
+        # 目标函数：各模块的温度偏差、压缩机功率和功率变化率之和
+        comp_prev = ca.vertcat(self.initial_comp_power, comp[:-1, :])
+        temp = ca.reshape(X_next[0, :], K, N).T
+        self.opti.minimize(self.weights['temp'] * ca.sumsqr(temp - T_opt)
+                           + self.weights['comp'] * ca.sumsqr(comp)
+                           + self.weights['dcomp'] * ca.sumsqr(comp - comp_prev)
+                           + self.weights['I_share'] * ca.sumsqr(U[1, :] - I_share))
+
+        self.opti.solver('ipopt', {
+            'ipopt': {'max_iter': 500, 'print_level': 0, 'acceptable_tol': 1e-4, 'tol': 1e-6,
+                      'bound_push': 1e-4, 'bound_frac': 1e-3,
+                      # 较小的主元阈值减少MUMPS的延迟主元，保持按模块消元的稀疏结构（否则分解耗时随K超线性增长）
+                      'mumps_pivtol': 1e-8},
+            'print_time': False
+        })
+
+    def _preview(self, i):
+        """当前时刻起每一步的站级目标功率，超出数据长度的部分用最后一个值补齐"""
+        P_RE = np.asarray(self.P_RE[i*self.dt : (i + self.N)*self.dt : self.dt], dtype=float)
+        return np.pad(P_RE, (0, self.N - len(P_RE)), mode='edge')
+
+    def solve(self, i, temps, SOCs, comp_powers, T_clnts=None):
+        """
+        求解多模块MPC
+        :param i: 当前时间步
+        :param temps: 各模块的电池温度，长度K
+        :param SOCs: 各模块的SOC
+        :param comp_powers: 各模块当前的压缩机功率
+        :param T_clnts: 各模块的冷却液出口温度，缺省为构建时的值
+        :return: dict，'control_sequence' 形状为 (N, K, 2)，'state_trajectory' 形状为 (N+1, K, 3)
+        """
+        K, N = self.K, self.N
+        temps = np.broadcast_to(np.asarray(temps, dtype=float), (K,))
+        SOCs = np.broadcast_to(np.asarray(SOCs, dtype=float), (K,))
+        comp_powers = np.broadcast_to(np.asarray(comp_powers, dtype=float), (K,))
+        T_clnts = np.full(K, self.T_clnt0) if T_clnts is None else np.broadcast_to(T_clnts, (K,))
+        P_preview = self._preview(i)
+        P_module = P_preview[0] / K
+
+        self.opti.set_value(self.initial_state, np.vstack([temps, np.full(K, P_module), SOCs, T_clnts]))
+        self.opti.set_value(self.initial_comp_power, comp_powers.reshape(1, -1))
+        self.opti.set_value(self.P_preview, P_preview)
+
+        if self._last_x is not None:
+            # 上一次的解（原始变量）作为初始猜测
+            self.opti.set_initial(self.opti.x, self._last_x)
+        else:
+            self.opti.set_initial(self.opt_states, np.vstack([
+                np.tile(temps, N + 1), np.full((N + 1) * K, P_module), np.tile(SOCs, N + 1),
+                np.tile(T_clnts, N + 1)]))
+            self.opti.set_initial(self.opt_controls[0, :], np.tile(comp_powers, N).reshape(1, -1))
+            # 电流初值取平均分配站级功率时每个模块所需的电流
+            x0 = np.vstack([temps, np.full(K, P_module), SOCs, T_clnts])
+            _, _, I_pack_need = self._step.map(K)(x0, np.vstack([comp_powers, np.zeros(K)]), P_module, self.dt)
+            self.opti.set_initial(self.opt_controls[1, :], np.tile(I_pack_need.full().reshape(-1), N).reshape(1, -1))
+
+        start_time = time.time()
+        sol = self.opti.solve()
+        self.stats = dict(self.opti.stats(), wall_time=time.time() - start_time)
+        self._last_x = np.array(sol.value(self.opti.x)).flatten()
+
+        states = np.array(sol.value(self.opt_states)).reshape(4, N + 1, K)
+        controls = np.array(sol.value(self.opt_controls)).reshape(2, N, K)
+        return {
+            'control_sequence': controls.transpose(1, 2, 0),
+            'state_trajectory': states[:3].transpose(1, 2, 0),
+            'source': 'mpc'
+        }
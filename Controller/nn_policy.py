@@ -0,0 +1,288 @@
+import os
+import time
+import argparse
+import numpy as np
+from Battery.BatteryPack import BatteryPack as Battery
+from CoolingSystem.CS_for_ES import SimpleCoolingSystem as CoolingSystem
+from Controller.MPC_for_ES import MPCController
+
+# 策略网络输入中的状态量，之后为发电功率预测的各段平均值
+STATE_INPUTS = ('temp', 'SOC', 'comp_power')
+
+def preview_segments(preview, n_preview):
+    """
+    将发电功率预测按时间均分为n_preview段，取每段的平均值
+    :param preview: 预测时域内的发电功率（按基本步长dt）
+    :return: 长度为n_preview的数组
+    """
+    preview = np.asarray(preview, dtype=float)
+    return np.array([segment.mean() for segment in np.array_split(preview, n_preview)])
+
+def load_closed_loop(files, horizon, n_preview):
+    """
+    读取main.py保存的闭环仿真数据（data.csv），整理为策略网络的训练样本。
+    第k行为第k步施加的压缩机功率和施加后的状态，故第k步的输入取第k-1行的温度、SOC和压缩机功率
+    :param files: data.csv文件列表
+    :param horizon: 发电功率预测覆盖的步数
+    :param n_preview: 预测的分段数
+    :return: (X, y)，X的各列为 STATE_INPUTS 和预测的各段平均值，y为压缩机功率
+    """
+    X, y = [], []
+    for file in files:
+        # 各列依次为 Time(s),Control_Sequence,Temperature(℃),SOH_Loss,Target_Power,SOC
+        data = np.loadtxt(file, delimiter=',', skiprows=1, ndmin=2)
+        if data.shape[1] < 6:
+            raise ValueError(f"{file} 中没有SOC列，请使用新版main.py重新仿真生成")
+        comp_power, temp, P_RE, SOC = data[:, 1], data[:, 2], data[:, 4], data[:, 5]
+        # 数据末尾的预测窗口用最后一个值补齐
+        P_RE = np.concatenate([P_RE, np.full(horizon, P_RE[-1])])
+        for k in range(1, len(data)):
+            X.append([temp[k - 1], SOC[k - 1], comp_power[k - 1],
+                      *preview_segments(P_RE[k:k + horizon], n_preview)])
+            y.append(comp_power[k])
+    return np.array(X), np.array(y)
+
+def train_policy(X, y, out_file, layers_num=3, hidden_dim=32, epochs=200, batch_size=256, lr=1e-3,
+                 val_ratio=0.1, seed=0, P_comp_limits=(0, 4000), horizon=24, n_preview=4, dt=1):
+    """
+    用 SOH/Model 中的MLP拟合闭环数据中MPC的压缩机功率，训练完成后将网络权重导出为npz，
+    在线控制只需NumPy，不依赖PyTorch
+    :param X: load_closed_loop 得到的输入
+    :param y: 压缩机功率
+    :param out_file: 输出的npz文件
+    :param layers_num: MLP的线性层数
+    :param hidden_dim: 隐藏层宽度
+    :param val_ratio: 验证集比例，保存验证误差最小的一轮
+    :param P_comp_limits: 压缩机功率范围，输出按其上限归一化
+    :param horizon: 发电功率预测覆盖的步数（与数据整理时一致）
+    :param n_preview: 预测的分段数
+    :return: dict，导出的权重和归一化参数
+    """
+    import torch
+    from SOH.Model.Model import MLP, count_parameters
+    from SOH.utils.util import AverageMeter, eval_metrix
+
+    torch.manual_seed(seed)
+    rng = np.random.default_rng(seed)
+    index = rng.permutation(len(X))
+    n_val = max(1, int(len(X) * val_ratio))
+    val_index, train_index = index[:n_val], index[n_val:]
+
+    # 输入标准化，输出按压缩机功率上限归一化
+    x_mean, x_std = X[train_index].mean(axis=0), X[train_index].std(axis=0) + 1e-6
+    y_scale = float(P_comp_limits[1])
+    X_t = torch.tensor((X - x_mean) / x_std, dtype=torch.float32)
+    y_t = torch.tensor(y / y_scale, dtype=torch.float32).reshape(-1, 1)
+
+    model = MLP(input_dim=X.shape[1], output_dim=1, layers_num=layers_num, hidden_dim=hidden_dim, droupout=0)
+    print(f"Policy parameters: {count_parameters(model)}, training samples: {len(train_index)}")
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    loss_func = torch.nn.MSELoss()
+    best_loss, best_state = np.inf, None
+    for epoch in range(epochs):
+        model.train()
+        loss_meter = AverageMeter()
+        for batch in np.array_split(rng.permutation(train_index), max(1, len(train_index) // batch_size)):
+            optimizer.zero_grad()
+            loss = loss_func(model(X_t[batch]), y_t[batch])
+            loss.backward()
+            optimizer.step()
+            loss_meter.update(loss.item(), len(batch))
+        model.eval()
+        with torch.no_grad():
+            val_loss = loss_func(model(X_t[val_index]), y_t[val_index]).item()
+        if val_loss < best_loss:
+            best_loss = val_loss
+            best_state = {k: v.clone() for k, v in model.state_dict().items()}
+        if (epoch + 1) % 20 == 0:
+            print(f"Epoch {epoch + 1}: train loss {loss_meter.avg:.3e}, val loss {val_loss:.3e}")
+    model.load_state_dict(best_state)
+    model.eval()
+    with torch.no_grad():
+        pred = model(X_t[val_index]).numpy().reshape(-1) * y_scale
+    MAE, _, _, RMSE = eval_metrix(y[val_index], pred)
+    print(f"Validation MAE {MAE:.1f} W, RMSE {RMSE:.1f} W")
+
+    # 导出各线性层的权重（MLP中除最后一层外每个线性层后接Sin激活）
+    linears = [layer for layer in model.net if isinstance(layer, torch.nn.Linear)]
+    policy = {f'W{k}': layer.weight.detach().numpy() for k, layer in enumerate(linears)}
+    policy.update({f'b{k}': layer.bias.detach().numpy() for k, layer in enumerate(linears)})
+    policy.update(n_layers=len(linears), x_mean=x_mean, x_std=x_std, y_scale=y_scale,
+                  x_min=X.min(axis=0), x_max=X.max(axis=0), horizon=horizon, n_preview=n_preview, dt=dt)
+    os.makedirs(os.path.dirname(out_file) or '.', exist_ok=True)
+    np.savez(out_file, **policy)
+    print(f"Policy saved to: {out_file}")
+    return policy
+
+class NNPolicyController:
+    """
+    由MPC闭环数据蒸馏的神经网络策略控制器：NumPy实现MLP的前向计算，输出投影到压缩机功率范围内
+
+    控制接口与 RBController 相同，单次调用在微秒量级
+    """
+
+    def __init__(self, battery_model, cooling_system, P_RE, policy_file, dt=1, P_comp_limits=(0, 4000)):
+        """
+        初始化神经网络策略控制器
+
+        参数:
+            battery_model: 电池热模型实例
+            cooling_system: 冷却系统模型实例
+            P_RE: 可再生能源发电功率序列
+            policy_file: train_policy 导出的npz文件
+            dt: 时间步长(s)
+            P_comp_limits: 压缩机功率范围 (min, max)，网络输出的安全投影
+        """
+        self.bm = battery_model
+        self.cs = cooling_system
+        self.P_RE = np.asarray(P_RE, dtype=float)
+        self.dt = dt
+        self.P_min, self.P_max = P_comp_limits
+
+        policy = np.load(policy_file)
+        n_layers = int(policy['n_layers'])
+        self.weights = [(policy[f'W{k}'], policy[f'b{k}']) for k in range(n_layers)]
+        self.x_mean, self.x_std = policy['x_mean'], policy['x_std']
+        self.x_min, self.x_max = policy['x_min'], policy['x_max']
+        self.y_scale = float(policy['y_scale'])
+        self.horizon = int(policy['horizon'])
+        self.n_preview = int(policy['n_preview'])
+
+        # 各预测窗口的分段平均值，用累积和计算
+        self._csum = np.concatenate([[0], np.cumsum(self.P_RE)])
+        self._bounds = np.array([len(s) for s in np.array_split(np.arange(self.horizon), self.n_preview)]).cumsum()
+
+    def features(self, i):
+        """第i步起预测窗口内发电功率的各段平均值"""
+        start = i * self.dt
+        if start + self.horizon > len(self.P_RE):
+            # 数据末尾的窗口不完整，用最后一个值补齐
+            preview = self.P_RE[start:]
+            preview = np.concatenate([preview, np.full(self.horizon - len(preview), self.P_RE[-1])])
+            return preview_segments(preview, self.n_preview)
+        sums = self._csum[start + np.concatenate([[0], self._bounds])]
+        return np.diff(sums) / np.diff(np.concatenate([[0], self._bounds]))
+
+    def policy(self, x):
+        """
+        MLP的前向计算
+        :param x: 按 STATE_INPUTS 和预测分段排列的输入
+        :return: 压缩机功率（未投影）
+        """
+        h = (np.asarray(x, dtype=float) - self.x_mean) / self.x_std
+        for W, b in self.weights[:-1]:
+            h = np.sin(W @ h + b)
+        W, b = self.weights[-1]
+        return float((W @ h + b)[0] * self.y_scale)
+
+    def control(self, i, current_temp, SOC, comp_power):
+        """
+        由策略网络得到压缩机功率并计算下一步状态
+
+        参数:
+            i: 当前时间步
+            current_temp: 当前电池温度
+            SOC: 当前SOC
+            comp_power: 当前压缩机功率
+
+        返回:
+            (压缩机功率, 电池pack电流, 下一步温度, 下一步SOC)
+        """
+        x = np.concatenate([[current_temp, SOC, comp_power], self.features(i)])
+        # 安全投影：网络输出截断到压缩机功率范围内
+        new_comp_power = min(max(self.policy(x), self.P_min), self.P_max)
+
+        # 计算冷却量和冷却功率
+        Q_cool = float(self.cs.battery_cooling(current_temp, new_comp_power))
+        P_cool = new_comp_power + 200  # 压缩机功率加上基础功率
+
+        # 计算功率缺口和所需电流
+        P_gap = self.P_RE[i * self.dt] + P_cool
+        I_pack = self.bm.Current_Pack2Cell(P_gap)
+        I_pack = min(I_pack, self.bm.I_max_limit)
+        I_pack = max(I_pack, self.bm.I_min_limit)
+
+        # 计算下一步状态
+        temp_next, _, SOC_next, _, _ = self.bm.battery_model(
+            Q_cool=Q_cool,
+            I_pack=I_pack,
+            T_bat=current_temp,
+            SOC=SOC
+        )
+
+        return new_comp_power, I_pack, temp_next, SOC_next
+
+def evaluate_policy(controller, mpc, n_samples=100, seed=0):
+    """
+    对比策略网络与在线MPC的第一步最优压缩机功率
+    :param controller: NNPolicyController
+    :param mpc: 预测时域与训练数据一致的 MPCController
+    :param n_samples: 随机采样的状态数，状态在训练数据的范围内均匀采样，时刻在P_RE上均匀采样
+    :return: dict，误差统计和两者的单次耗时
+    """
+    rng = np.random.default_rng(seed)
+    last_step = (len(controller.P_RE) - mpc.horizon * mpc.dt) // mpc.dt
+    errors, policy_times, online_times = [], [], []
+    for _ in range(n_samples):
+        i = int(rng.integers(0, last_step))
+        temp, SOC, comp_power = rng.uniform(controller.x_min[:3], controller.x_max[:3])
+
+        start_time = time.perf_counter()
+        x = np.concatenate([[temp, SOC, comp_power], controller.features(i)])
+        policy_comp = min(max(controller.policy(x), controller.P_min), controller.P_max)
+        policy_times.append(time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        try:
+            solution = mpc.solve(i, temp, SOC, comp_power)
+        except Exception:
+            continue
+        online_times.append(time.perf_counter() - start_time)
+        errors.append(policy_comp - solution['control_sequence'][0, 0])
+
+    errors = np.abs(errors)
+    report = {
+        'samples': len(errors),
+        'mae': float(np.mean(errors)),
+        'rmse': float(np.sqrt(np.mean(errors**2))),
+        'p95': float(np.percentile(errors, 95)),
+        'max': float(np.max(errors)),
+        'policy_time_us': float(np.mean(policy_times) * 1e6),
+        'online_time_ms': float(np.mean(online_times) * 1e3)
+    }
+    print(f"Policy error over {report['samples']} samples: MAE {report['mae']:.1f} W, "
+          f"RMSE {report['rmse']:.1f} W, P95 {report['p95']:.1f} W, max {report['max']:.1f} W")
+    print(f"Policy forward pass: {report['policy_time_us']:.1f} us, online MPC: {report['online_time_ms']:.1f} ms")
+    return report
+
+# === 使用示例 ===
+if __name__ == "__main__":
+    from EnergyStorageSystem.Ningbo import POWER as TARGET
+
+    parser = argparse.ArgumentParser(description='由MPC闭环数据训练神经网络策略并评估')
+    parser.add_argument('--data', type=str, nargs='+', help='main.py保存的闭环数据 data.csv（可多个）')
+    parser.add_argument('--policy', type=str, default='results/nn_policy.npz', help='策略网络文件')
+    parser.add_argument('--N', type=int, default=24, help='发电功率预测覆盖的步数（与MPC预测时域一致）')
+    parser.add_argument('--n_preview', type=int, default=4, help='发电功率预测的分段数')
+    parser.add_argument('--layers', type=int, default=3, help='MLP的线性层数')
+    parser.add_argument('--hidden', type=int, default=32, help='隐藏层宽度')
+    parser.add_argument('--epochs', type=int, default=200, help='训练轮数')
+    parser.add_argument('--lr', type=float, default=1e-3, help='学习率')
+    parser.add_argument('--n_samples', type=int, default=100, help='误差评估的采样数')
+    parser.add_argument('--skip_train', action='store_true', help='直接使用已有的策略网络')
+    args = parser.parse_args()
+
+    model_args = {'dt': 1, 'T_amb': 35.0, 'init_temp': 25.0, 'init_soc': 0.6}
+    if not args.skip_train:
+        X, y = load_closed_loop(args.data, args.N, args.n_preview)
+        train_policy(X, y, args.policy, layers_num=args.layers, hidden_dim=args.hidden, epochs=args.epochs,
+                     lr=args.lr, horizon=args.N, n_preview=args.n_preview, dt=model_args['dt'])
+
+    bm = Battery(model_args['dt'], model_args['T_amb'])
+    cs = CoolingSystem(model_args['dt'], T_amb=model_args['T_amb'])
+    bm.update_parameters(I_cell=1e-8, T_bat=model_args['init_temp'], SOC=model_args['init_soc'])
+    mpc = MPCController(bm, cs, TARGET, N=args.N, dt=model_args['dt'])
+    controller = NNPolicyController(Battery(model_args['dt'], model_args['T_amb']),
+                                    CoolingSystem(model_args['dt'], T_amb=model_args['T_amb']),
+                                    TARGET, args.policy, dt=model_args['dt'])
+    evaluate_policy(controller, mpc, n_samples=args.n_samples)
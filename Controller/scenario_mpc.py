@@ -0,0 +1,208 @@
+import time
+import numpy as np
+import casadi as ca
+from scipy.ndimage import gaussian_filter1d
+from Controller.MPC_for_ES import DEFAULT_WEIGHTS, transition_function
+
+def sample_scenarios(preview, scenarios, noise_std, sigma=60, rng=None):
+    """
+    按 Ningbo.py / TargetPower.py 的噪声过程采样发电功率预测的扰动场景：
+    高斯白噪声经 gaussian_filter1d 平滑后叠加到预测上，并截断为非负功率
+    :param preview: 名义预测，从当前时刻起每一步的发电功率，第0个值为当前的测量值
+    :param scenarios: 场景数S
+    :param noise_std: 平滑前白噪声的标准差 (W)
+    :param sigma: 平滑的高斯核宽度（步数）
+    :param rng: numpy的随机数生成器
+    :return: 形状为 (S, len(preview)) 的数组
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    preview = np.asarray(preview, dtype=float)
+    # 在更长的序列上平滑后取中间一段，使时域内噪声的统计特性与整段序列加噪时相同
+    pad = 4 * int(np.ceil(sigma))
+    noise = rng.normal(0, noise_std, size=(scenarios, len(preview) + 2 * pad))
+    noise = gaussian_filter1d(noise, sigma=sigma, axis=1)[:, pad:pad + len(preview)]
+    # 当前时刻的功率已测得，各场景只在之后的时刻偏离名义预测
+    return np.clip(preview + noise - noise[:, :1], 0, None)
+
+def recourse_transition_function(battery_model, cooling_system):
+    """
+    场景中使用的单步状态转移函数：pack电流取满足功率需求的电流（按当前SOC的电流上下限截断），
+    与仿真中电流跟随功率缺口的方式一致
+    - 输入 x: [电池温度, 电池pack功率, SOC, 冷却液出口温度]
+    - 输入 u: 压缩机功率
+    - 输入 P_RE: 该步的发电功率
+    - 输入 dt: 该步的时间步长 (s)
+    - 输出 x_next: 下一步的 x
+    - 输出 I_pack: 该步的pack电流
+    """
+    step = transition_function(battery_model, cooling_system)
+    x = ca.SX.sym('x', 4)
+    u = ca.SX.sym('u')
+    P_RE = ca.SX.sym('P_RE')
+    h = ca.SX.sym('dt')
+    _, I_limits, I_pack_need = step(x, ca.vertcat(u, 0), P_RE, h)
+    I_pack = ca.fmin(ca.fmax(I_pack_need, I_limits[0]), I_limits[1])
+    x_next = step(x, ca.vertcat(u, I_pack), P_RE, h)[0]
+    return ca.Function('recourse_step', [x, u, P_RE, h], [x_next, I_pack], ['x', 'u', 'P_RE', 'dt'],
+                       ['x_next', 'I_pack'])
+
+class ScenarioMPCController:
+    """
+    基于场景的鲁棒MPC：对发电功率预测采样S个扰动场景，每个场景有自己的状态轨迹和后续的压缩机功率，
+    第一步的压缩机功率在所有场景间共享（非预期性约束），即实际施加的控制须对所有场景都合适。
+
+    - 每个场景的状态: [电池温度, 电池pack功率, SOC, 冷却液出口温度]，pack电流跟随该场景的功率需求
+      （按电流上下限截断），与仿真中的方式一致，发电功率的扰动由此影响电池产热
+    - 所有场景、所有阶段的状态转移由单步SX函数 map 为一次向量化调用，场景之间只通过第一步的控制相连
+    - 目标函数为各场景的温度偏差、压缩机功率和温度范围松弛量（L1精确罚）的平均值
+
+    注意：在当前的数据和模型下场景MPC不减少温度越限（benchmark.py scenario 中与名义MPC相同）。发电功率的扰动
+    只通过电池产热影响温度，而它相对于压缩机和BTMS基础功率很小、电池热容很大，预测时域内各场景的温度轨迹
+    几乎重合，温度范围的松弛量和权重不起作用，共享的第一步与名义MPC相同。
+    """
+
+    def __init__(self, battery_model, cooling_system, P_RE, scenarios=8, noise_std=None, noise_sigma=60,
+                 T_opt=25, N=24, dt=1, P_comp_limits=(0, 4000), temp_band=(23, 27), weights=None,
+                 threshold_width=50, seed=None):
+        """
+        初始化场景MPC控制器
+        :param battery_model: 电池模型
+        :param cooling_system: 冷却系统模型
+        :param P_RE: 可再生能源发电功率的名义预测序列
+        :param scenarios: 场景数S
+        :param noise_std: 平滑前白噪声的标准差 (W)，缺省与 Ningbo.py 相同，取名义预测的最大值
+        :param noise_sigma: 噪声平滑的高斯核宽度 (s)
+        :param T_opt: 目标电池温度
+        :param N: 预测时域步数
+        :param dt: 离散时间步长 (s)
+        :param P_comp_limits: 压缩机功率范围 (min, max)
+        :param temp_band: 电池温度的软约束范围 (℃)
+        :param weights: 目标函数权重，缺省的项取 DEFAULT_WEIGHTS
+        :param threshold_width: 压缩机开启阈值的平滑宽度 (W)
+        :param seed: 场景采样的随机种子
+        """
+        self.P_RE = P_RE
+        self.S = S = scenarios
+        self.N = N
+        self.dt = dt
+        self.horizon = N
+        self.T_opt = T_opt
+        self.P_min, self.P_max = P_comp_limits
+        self.temp_band = temp_band
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.noise_std = float(np.max(np.abs(P_RE))) if noise_std is None else noise_std
+        self.noise_sigma = noise_sigma / dt
+        self.rng = np.random.default_rng(seed)
+        self.T_clnt0 = float(cooling_system.T_clnt_out)
+        self.stats = {}
+        self._last_x = None
+
+        threshold = cooling_system.threshold_width
+        cooling_system.threshold_width = threshold_width
+        try:
+            step = recourse_transition_function(battery_model, cooling_system).map(N * S)
+        finally:
+            cooling_system.threshold_width = threshold
+
+        self.opti = ca.Opti()
+        # 状态按阶段排列：第j个节点第s个场景为第 j*S+s 列
+        self.opt_states = self.opti.variable(4, (N + 1) * S)
+        # 第一步的压缩机功率所有场景共用，之后各场景各自决定（按阶段排列）
+        self.first_move = self.opti.variable(1, 1)
+        self.recourse = self.opti.variable(1, (N - 1) * S)
+        self.comp_power = ca.horzcat(ca.repmat(self.first_move, 1, S), self.recourse)  # 1 x NS
+        self.temp_slack = self.opti.variable(2, N * S)  # [下界松弛, 上界松弛]
+        self.initial_state = self.opti.parameter(4, 1)
+        self.initial_comp_power = self.opti.parameter(1, 1)
+        self.opt_temp_ref = self.opti.parameter(N, 1)
+        self.P_scenarios = self.opti.parameter(N, S)
+
+        X = self.opt_states
+        X_next = X[:, S:]
+        h = ca.DM.ones(1, N * S) * dt
+        P = ca.reshape(self.P_scenarios.T, 1, N * S)
+        self.opti.subject_to(X[:, :S] == ca.repmat(self.initial_state, 1, S))
+        X_model, self.I_pack = step(X[:, :N * S], self.comp_power, P, h)
+        self.opti.subject_to(X_next == X_model)
+        self.opti.subject_to(self.opti.bounded(self.P_min, self.first_move, self.P_max))
+        self.opti.subject_to(self.opti.bounded(self.P_min, self.recourse, self.P_max))
+        self.opti.subject_to(self.opti.bounded(battery_model.SOC_min, X_next[2, :], 0.99))
+
+        # 温度软约束
+        T_low, T_high = temp_band
+        temp = X_next[0, :]
+        self.opti.subject_to(T_low - self.temp_slack[0, :] <= temp)
+        self.opti.subject_to(temp <= T_high + self.temp_slack[1, :])
+        self.opti.subject_to(ca.vec(self.temp_slack) >= 0)
+
+        # 目标函数：各场景的平均值
+        comp = ca.reshape(self.comp_power, S, N).T  # N x S
+        comp_prev = ca.vertcat(ca.repmat(self.initial_comp_power, 1, S), comp[:-1, :])
+        temp_ref = ca.reshape(ca.repmat(self.opt_temp_ref.T, S, 1), 1, N * S)
+        self.opti.minimize((self.weights['temp'] * ca.sumsqr(temp - temp_ref)
+                            + self.weights['comp'] * ca.sumsqr(comp)
+                            + self.weights['dcomp'] * ca.sumsqr(comp - comp_prev)
+                            + self.weights['slack'] * ca.sum2(ca.sum1(self.temp_slack))) / S)
+
+        self.opti.solver('ipopt', {
+            'ipopt': {'max_iter': 500, 'print_level': 0, 'acceptable_tol': 1e-4, 'tol': 1e-6,
+                      'bound_push': 1e-4, 'bound_frac': 1e-3,
+                      # 与多模块MPC相同，保持按场景消元的稀疏结构
+                      'mumps_pivtol': 1e-8},
+            'print_time': False
+        })
+
+    def _preview(self, i, P_RE=None):
+        """当前时刻起每一步的名义发电功率预测，超出数据长度的部分用最后一个值补齐"""
+        if P_RE is None:
+            P_RE = self.P_RE[i*self.dt : (i + self.N)*self.dt : self.dt]
+        P_RE = np.asarray(P_RE[:self.N], dtype=float)
+        return np.pad(P_RE, (0, self.N - len(P_RE)), mode='edge')
+
+    def solve(self, i, current_temp, SOC, comp_power, preview=None, T_clnt=None):
+        """
+        求解场景MPC
+        :param i: 当前时间步
+        :param current_temp: 当前电池温度
+        :param SOC: 当前SOC
+        :param comp_power: 当前压缩机功率
+        :param preview: 可选，代替 P_RE 从第i步起的名义发电功率预测（按基本步长dt）
+        :param T_clnt: 当前冷却液出口温度，缺省为构建时的值
+        :return: dict，'control_sequence' [压缩机功率, pack电流] (N, 2) 和 'state_trajectory' (N+1, 3)
+                 为各场景的平均值（第一步的压缩机功率各场景相同），'scenarios' 为各场景的发电功率 (S, N)，
+                 'scenario_states' 为各场景的状态轨迹 (N+1, S, 3)
+        """
+        N, S = self.N, self.S
+        T_clnt = self.T_clnt0 if T_clnt is None else float(T_clnt)
+        P_nominal = self._preview(i, preview)
+        P_scenarios = sample_scenarios(P_nominal, S, self.noise_std, self.noise_sigma, self.rng)
+
+        x0 = [float(current_temp), P_nominal[0], float(SOC), T_clnt]
+        self.opti.set_value(self.initial_state, x0)
+        self.opti.set_value(self.initial_comp_power, float(comp_power))
+        self.opti.set_value(self.opt_temp_ref, np.full(N, float(self.T_opt)))
+        self.opti.set_value(self.P_scenarios, P_scenarios.T)
+
+        if self._last_x is not None:
+            # 上一次的解（原始变量）作为初始猜测
+            self.opti.set_initial(self.opti.x, self._last_x)
+        else:
+            self.opti.set_initial(self.opt_states, np.tile(np.reshape(x0, (4, 1)), (N + 1) * S))
+            self.opti.set_initial(self.first_move, float(comp_power))
+            self.opti.set_initial(self.recourse, float(comp_power))
+
+        start_time = time.time()
+        sol = self.opti.solve()
+        self.stats = dict(self.opti.stats(), wall_time=time.time() - start_time)
+        self._last_x = np.array(sol.value(self.opti.x)).flatten()
+
+        states = np.array(sol.value(self.opt_states)).reshape(4, N + 1, S)
+        comp = np.array(sol.value(self.comp_power)).reshape(N, S)
+        I_pack = np.array(sol.value(self.I_pack)).reshape(N, S)
+        return {
+            'control_sequence': np.column_stack([comp.mean(axis=1), I_pack.mean(axis=1)]),
+            'state_trajectory': states[:3].mean(axis=2).T,
+            'scenarios': P_scenarios,
+            'scenario_states': states[:3].transpose(1, 2, 0),
+            'source': 'mpc'
+        }
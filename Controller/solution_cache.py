@@ -0,0 +1,91 @@
+import os
+import pickle
+import hashlib
+import numpy as np
+from collections import OrderedDict
+
+class SolutionCache:
+    """
+    MPC求解结果的缓存
+
+    以量化后的初始状态（温度、SOC、压缩机功率）和量化后的发电功率预测窗口的哈希为键，
+    LRU淘汰，可保存到磁盘供之后的运行复用。命中时按mode直接作为结果返回，或作为热启动的初始值。
+    """
+
+    def __init__(self, mode='answer', capacity=4096, path=None,
+                 temp_step=0.05, SOC_step=0.005, comp_step=50, preview_step=10):
+        """
+        初始化缓存
+        :param mode: 'answer' 命中时直接返回缓存的解；'warm_start' 命中时用缓存的解作为初始值求解
+        :param capacity: 最多保存的条目数，超出时淘汰最久未使用的条目
+        :param path: 持久化文件，存在时在初始化时加载，save() 时写入
+        :param temp_step: 温度的量化步长 (℃)
+        :param SOC_step: SOC的量化步长
+        :param comp_step: 压缩机功率的量化步长 (W)
+        :param preview_step: 发电功率预测的量化步长 (W)
+        """
+        self.mode = mode
+        self.capacity = capacity
+        self.path = path
+        self.temp_step = temp_step
+        self.SOC_step = SOC_step
+        self.comp_step = comp_step
+        self.preview_step = preview_step
+        self.entries = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+        if path is not None and os.path.exists(path):
+            with open(path, 'rb') as f:
+                self.entries = pickle.load(f)
+
+    def key(self, problem_key, current_temp, SOC, comp_power, preview):
+        """
+        缓存键
+        :param problem_key: MPC问题的标识（时域、权重、模型参数等），不同问题的解互不复用
+        :param preview: 每个预测阶段的发电功率
+        """
+        preview = np.round(np.asarray(preview, dtype=float) / self.preview_step).astype(np.int64)
+        return (problem_key,
+                int(round(current_temp / self.temp_step)),
+                int(round(SOC / self.SOC_step)),
+                int(round(comp_power / self.comp_step)),
+                hashlib.sha1(preview.tobytes()).hexdigest()[:16])
+
+    def get(self, key):
+        """查找缓存，命中时将条目移到最近使用的位置；未命中返回None"""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def save(self, path=None):
+        """保存到磁盘，先写临时文件再替换"""
+        path = path or self.path
+        if path is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_file = path + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(self.entries, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, path)
+
+    def stats(self):
+        """命中、未命中、淘汰次数和命中率"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self.entries),
+            'hit_rate': self.hits / total if total else 0.0
+        }
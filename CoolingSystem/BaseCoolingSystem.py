@@ -4,6 +4,9 @@ class CoolingSystem(ABC):
     """
     冷却系统抽象类
     """
+    # 仿真过程中随时间更新的属性，get_state/set_state 读写这些属性
+    STATE_ATTRS = ('T_clnt_in', 'T_clnt_out')
+
     def __init__(self, dt, T_amb):
         """
         Battery
@@ -30,6 +33,20 @@ class CoolingSystem(ABC):
         self.n_pump = 0 # Pump speed (rpm)
         self.dt = dt # 采样时间 dt (s), example dt = 0.1
     
+    def get_state(self):
+        """
+        获取冷却系统的动态状态，用于在另一个模型实例上复现当前状态
+        """
+        return {name: getattr(self, name) for name in self.STATE_ATTRS}
+
+    def set_state(self, state):
+        """
+        设置冷却系统的动态状态
+        :param state: get_state 返回的字典
+        """
+        for name, value in state.items():
+            setattr(self, name, value)
+
     @abstractmethod
     def battery_cooling(self, *args, **kwargs):
         """
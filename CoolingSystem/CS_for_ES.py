@@ -1,20 +1,22 @@
 from scipy.interpolate import RegularGridInterpolator
 import numpy as np
 from utils.parameter import m_clnt_vector, T_air_vector, lamda1_table, lamda2_table, lamda3_table, lamda4_table, lamda5_table, lamda6_table
-from utils.math_utils import exp, if_else, max, min
+from utils.math_utils import get_math_backend
 from CoolingSystem.BaseCoolingSystem import CoolingSystem
 import casadi as ca
 class SimpleCoolingSystem(CoolingSystem):
     """
     一个简单的液体冷却系统，假设传热方式为对流换热
     """
-    def __init__(self, dt, T_amb):
+    def __init__(self, dt, T_amb, math_backend='casadi'):
         """
         初始化冷却系统
         :param dt: 采样时间
         :param T_amb: 环境温度
+        :param math_backend: 数学后端，MPC的控制模型用 'casadi'，仿真模型可用 'numpy' 加快数值计算
         """
         super().__init__(dt, T_amb)
+        self.math = get_math_backend(math_backend)
 
         # 保存插值函数的字典
         self.interp_funcs = {}
@@ -43,6 +45,9 @@ class SimpleCoolingSystem(CoolingSystem):
         self.massflow_clnt = 0.144
         self.massflow_air = 1.2
 
+        # 压缩机开启/关闭阈值(500W/4500W)的平滑宽度(W)，None为硬阈值
+        self.threshold_width = None
+
         self._initial_lambda()
 
     def _initial_lambda(self):
@@ -74,14 +79,20 @@ class SimpleCoolingSystem(CoolingSystem):
         # P_comp为总功率
         # 计算 Q_cooling
         
-        Q_cooling = if_else(P_comp < 500, 0, self.lambda1 * P_comp +
+        Q_cooling_on = (self.lambda1 * P_comp +
             self.lambda2 * P_comp**2 +
             self.lambda3 * self.T_clnt_out +
             self.lambda4 * self.T_amb * massflow_air +
             self.lambda5 * self.T_clnt_out * self.massflow_clnt +
             self.lambda6
         )
-        Q_cooling = if_else(P_comp > 4500, 0, Q_cooling)
+        if self.threshold_width is None:
+            Q_cooling = self.math.if_else(P_comp < 500, 0, Q_cooling_on)
+            Q_cooling = self.math.if_else(P_comp > 4500, 0, Q_cooling)
+        else:
+            # 用sigmoid代替阈值处的跳变，使冷却量对压缩机功率连续可导
+            w = self.threshold_width
+            Q_cooling = self.math.sigmoid((P_comp - 500) / w) * self.math.sigmoid((4500 - P_comp) / w) * Q_cooling_on
         
 
         """Q_cooling = (self.lambda1 * P_comp + self.lambda2 * P_comp**2 + self.lambda3 * self.T_clnt_out + self.lambda4 * self.T_amb * massflow_air + self.lambda5 * self.T_clnt_out * self.massflow_clnt + self.lambda6 )*self.dt*0.2
@@ -100,7 +111,7 @@ class SimpleCoolingSystem(CoolingSystem):
 
         self.T_clnt_in = self.T_clnt_out - Q_cooling / (self.massflow_clnt * self.capacity_clnt)  # 更新冷却剂入口温度
         
-        self.T_clnt_out = (self.T_clnt_in - T_bat) * exp(-(self.h_bat * self.A_bat) / (self.massflow_clnt * self.capacity_clnt)) + T_bat # 冷却剂出口温度 (℃)
+        self.T_clnt_out = (self.T_clnt_in - T_bat) * self.math.exp(-(self.h_bat * self.A_bat) / (self.massflow_clnt * self.capacity_clnt)) + T_bat # 冷却剂出口温度 (℃)
 
         Q_bat_cooling = self.massflow_clnt * self.capacity_clnt * (self.T_clnt_out - self.T_clnt_in) * self.dt
         return Q_bat_cooling
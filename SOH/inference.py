@@ -46,6 +46,27 @@ class SOH_predictor:
         self.charge_time += self.relative_time
         return predictions
 
+    def inference_batch(self, I_cell, U_cell, T_bat):
+        """
+        对一批样本（如蒙特卡洛仿真的多个实现）同时推理，每个样本的处理与 inference 相同
+        :return: 形状为 (R,) 的预测值
+        """
+        I_cell, U_cell, T_bat = np.broadcast_arrays(*[np.asarray(v, dtype=float).ravel() for v in (I_cell, U_cell, T_bat)])
+        R = len(I_cell)
+        data = np.column_stack([np.full(R, self.relative_time), np.full(R, self.charge_time), np.full(R, self.cycle_num),
+                                I_cell, U_cell, T_bat])
+        # 与 inference 相同，每个样本在自身的6个特征内归一化
+        min_val = data.min(axis=1, keepdims=True)
+        max_val = data.max(axis=1, keepdims=True)
+        normalized_data = (data - min_val) / ((max_val - min_val) + 1e-6)
+        tensor_data = torch.tensor(normalized_data, dtype=torch.float32).to(self.device).unsqueeze(1)  # (R, 1, 6)
+
+        self.model.eval()
+        with torch.no_grad():
+            predictions = self.model(tensor_data)
+        self.charge_time += self.relative_time
+        return predictions.cpu().numpy().reshape(R, -1)[:, 0]
+
 if __name__ == "__main__":
     soh_predictor = SOH_predictor(dt=20, relative_time=0, charge_time=0, cycle_num=300)
     data1 = [3,3.7,25]
@@ -0,0 +1,303 @@
+import time
+import argparse
+import numpy as np
+from Battery.BatteryPack import BatteryPack as Battery
+from CoolingSystem.CS_for_ES import SimpleCoolingSystem
+from Controller.MPC_for_ES import MPCController
+from Controller.multi_module_mpc import MultiModuleMPCController
+from Controller.admm_coordinator import ADMMCoordinator
+from Controller.scenario_mpc import ScenarioMPCController
+from scipy.ndimage import gaussian_filter1d
+from EnergyStorageSystem.Ningbo import POWER as TARGET
+
+def get_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='MPC求解性能基准测试')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    # 约束形式对比：罚函数 vs 松弛变量+L1精确罚
+    constraint = subparsers.add_parser('constraint', help='对比不同约束形式的迭代次数和失败率')
+    constraint.add_argument('--modes', type=str, default='penalty,slack', help='参与对比的约束形式，逗号分隔')
+    constraint.add_argument('--N', type=int, default=100, help='MPC预测时域')
+    constraint.add_argument('--formulation', type=str, default='unrolled', choices=['unrolled', 'mapped', 'lean'],
+                            help='MPC时域构建方式')
+    constraint.add_argument('--shooting', type=str, default='multiple', choices=['multiple', 'single'],
+                            help='lean构建方式下的打靶方式')
+    constraint.add_argument('--total_steps', type=int, default=600, help='闭环仿真步数（秒）')
+    constraint.add_argument('--n_control', type=int, default=5, help='每次应用的控制步数')
+    constraint.add_argument('--threshold_width', type=float, default=50, help='压缩机开启阈值的平滑宽度（W）')
+
+    # 多模块：一个耦合的NLP vs 每个模块单独求解
+    modules = subparsers.add_parser('modules', help='多模块MPC的求解耗时随模块数的变化')
+    modules.add_argument('--modules', type=str, default='5,10,20', help='模块数，逗号分隔')
+    modules.add_argument('--N', type=int, default=30, help='MPC预测时域')
+    modules.add_argument('--total_steps', type=int, default=60, help='闭环仿真步数（秒）')
+    modules.add_argument('--n_control', type=int, default=5, help='每次应用的控制步数')
+    modules.add_argument('--temp_spread', type=float, default=2.0, help='各模块初始温度的分布范围（℃）')
+    modules.add_argument('--method', type=str, default='coupled', choices=['coupled', 'admm'],
+                         help='一个耦合的NLP，或各模块MPC在进程池中求解、由ADMM协调站级约束')
+    modules.add_argument('--workers', type=int, default=0, help='ADMM的工作进程数，0为在当前进程中依次求解')
+    modules.add_argument('--rho', type=float, default=1e-3, help='ADMM罚参数')
+    modules.add_argument('--admm_iter', type=int, default=30, help='每个时间步ADMM的最大迭代次数')
+    modules.add_argument('--admm_tol', type=float, default=1.0, help='ADMM残差的收敛阈值（W）')
+
+    # 发电功率预测有误差时：名义MPC vs 场景MPC
+    scenario = subparsers.add_parser('scenario', help='发电功率预测有扰动时场景MPC的温度越限率和求解耗时')
+    scenario.add_argument('--scenarios', type=str, default='1,4,8,16', help='场景数，逗号分隔')
+    scenario.add_argument('--N', type=int, default=24, help='MPC预测时域')
+    scenario.add_argument('--total_steps', type=int, default=600, help='闭环仿真步数（秒）')
+    scenario.add_argument('--n_control', type=int, default=5, help='每次应用的控制步数')
+    scenario.add_argument('--noise_scale', type=float, default=1.0,
+                          help='平滑前白噪声的标准差与发电功率最大值之比（Ningbo.py中为1）')
+    scenario.add_argument('--noise_sigma', type=float, default=60, help='噪声平滑的高斯核宽度（秒）')
+    scenario.add_argument('--seed', type=int, default=0, help='实际发电功率扰动和场景采样的随机种子')
+
+    # 所有子命令共用的系统参数
+    # 仿真模型的数学后端：每秒仿真步数
+    plant = subparsers.add_parser('plant', help='对比仿真模型在不同数学后端下每秒的仿真步数')
+    plant.add_argument('--backends', type=str, default='casadi,numpy', help='参与对比的数学后端，逗号分隔')
+    plant.add_argument('--total_steps', type=int, default=5000, help='仿真步数（秒）')
+    plant.add_argument('--repeats', type=int, default=3, help='重复次数，取最快的一次')
+
+    for sub in [constraint, modules, scenario, plant]:
+        sub.add_argument('--dt', type=int, default=1, help='时间步长（秒）')
+        sub.add_argument('--init_temp', type=float, default=28.0, help='电池初始温度（℃）')
+        sub.add_argument('--init_soc', type=float, default=0.6, help='电池初始SOC')
+        sub.add_argument('--T_amb', type=float, default=35.0, help='环境温度（℃）')
+    return parser.parse_args()
+
+def build_models(args, sim_backend='numpy'):
+    """按main.py的方式构建控制模型和仿真模型"""
+    bm_for_control = Battery(args.dt, args.T_amb)
+    bm_for_simulation = Battery(args.dt, args.T_amb, math_backend=sim_backend)
+    for bm in [bm_for_control, bm_for_simulation]:
+        bm.update_parameters(I_cell=1e-8, T_bat=args.init_temp, SOC=args.init_soc)
+    return (bm_for_control, SimpleCoolingSystem(args.dt, T_amb=args.T_amb),
+            bm_for_simulation, SimpleCoolingSystem(args.dt, T_amb=args.T_amb, math_backend=sim_backend))
+
+def simulate_step(i, args, bm, cs, current_temp, comp_power, SOC, P_RE=TARGET):
+    """用仿真模型推进一步（不加温度扰动），返回 (下一步温度, 下一步SOC)"""
+    Q_cool = cs.battery_cooling(current_temp, comp_power)
+    P_gap = P_RE[int(i*args.dt)] + comp_power + 200
+    I_pack = np.clip(bm.Current_Pack2Cell(P_gap), bm.I_min_limit, bm.I_max_limit)
+    temp_next, _, SOC_next, _, _ = bm.battery_model(Q_cool=Q_cool, I_pack=I_pack, T_bat=current_temp, SOC=SOC)
+    return float(temp_next), float(SOC_next)
+
+def run_closed_loop(args, mpc, bm, cs, P_true=None):
+    """
+    闭环仿真，每次只用冷启动的单次求解（不重试），以反映问题本身的收敛性
+    :param P_true: 可选，实际的发电功率序列。给定时仿真按实际功率推进，控制器得到的预测为
+                   TARGET 加上当前时刻的预测误差（误差保持不变）
+    :return: dict，每次求解的迭代次数、是否成功、耗时，以及温度轨迹
+    """
+    current_temp, current_SOC, comp_power = args.init_temp, args.init_soc, 0.0
+    iters, success, times, temps = [], [], [], []
+    P_RE = TARGET if P_true is None else P_true
+    for i in range(0, args.total_steps - mpc.horizon + 1, args.n_control):
+        preview = None
+        if P_true is not None:
+            forecast = TARGET[i*args.dt : (i + mpc.horizon)*args.dt : args.dt]
+            preview = forecast + P_true[i*args.dt] - TARGET[i*args.dt]
+        start_time = time.time()
+        try:
+            solution = mpc.solve(i, current_temp, current_SOC, comp_power, preview=preview)
+        except Exception:
+            solution = None
+        times.append(time.time() - start_time)
+        iters.append(mpc.stats.get('iter_count', 0))
+        success.append(solution is not None)
+        for j in range(args.n_control):
+            # 求解失败时保持上一次的压缩机功率
+            if solution is not None:
+                comp_power = float(solution['control_sequence'][j][0])
+            current_temp, current_SOC = simulate_step(i + j, args, bm, cs, current_temp, comp_power, current_SOC,
+                                                      P_RE)
+            temps.append(current_temp)
+    return {'iters': np.array(iters), 'success': np.array(success, dtype=bool), 'times': np.array(times),
+            'temps': np.array(temps)}
+
+def benchmark_constraint(args):
+    """对比各约束形式的迭代次数、失败率和求解耗时"""
+    results = {}
+    for mode in args.modes.split(','):
+        bm_for_control, cs_for_control, bm_for_simulation, cs_for_simulation = build_models(args)
+        mpc = MPCController(bm_for_control, cs_for_control, TARGET, N=args.N, dt=args.dt,
+                            formulation=args.formulation, shooting=args.shooting, constraint_mode=mode,
+                            threshold_width=args.threshold_width)
+        results[mode] = run_closed_loop(args, mpc, bm_for_simulation, cs_for_simulation)
+
+    print(f"{'mode':<10}{'solves':>8}{'failed':>8}{'fail rate':>11}{'iters mean':>12}{'iters p95':>11}"
+          f"{'time mean':>12}{'T out of 23-27':>16}")
+    for mode, r in results.items():
+        ok = r['success']
+        if len(ok) == 0:
+            print(f"{mode:<10}{0:>8}  no solves (total_steps < N + 1)")
+            continue
+        iters = r['iters'][ok] if ok.any() else r['iters']
+        out_of_band = np.mean((r['temps'] < 23) | (r['temps'] > 27))
+        print(f"{mode:<10}{len(ok):>8}{np.sum(~ok):>8}{np.mean(~ok):>11.1%}{np.mean(iters):>12.1f}"
+              f"{np.percentile(iters, 95):>11.1f}{np.mean(r['times'])*1000:>10.1f}ms{out_of_band:>16.1%}")
+    return results
+
+def build_module_controller(args, K):
+    """
+    构建K个模块的控制器，返回 (controller, solve)，
+    solve(i, temps, SOCs, comp_powers, T_clnts) 返回形状为 (N, K, 2) 的控制序列和迭代次数，失败时控制序列为None
+    """
+    if args.method == 'admm':
+        model_args = {'dt': args.dt, 'T_amb': args.T_amb, 'init_temp': args.init_temp, 'init_soc': args.init_soc}
+        coordinator = ADMMCoordinator(K, TARGET * K, model_args, {'N': args.N, 'formulation': 'mapped',
+                                                                  'warm_start': True},
+                                      workers=args.workers, rho=args.rho, max_iter=args.admm_iter, tol=args.admm_tol)
+
+        def solve(i, temps, SOCs, comp_powers, T_clnts):
+            n_history = len(coordinator.history)
+            solutions = coordinator.solve(i, temps, SOCs, comp_powers)
+            iters = len(coordinator.history) - n_history
+            if any(solution is None for solution in solutions):
+                return None, iters
+            return np.stack([solution['control_sequence'] for solution in solutions], axis=1), iters
+        return coordinator, solve
+
+    bm_for_control, cs_for_control, _, _ = build_models(args)
+    mpc = MultiModuleMPCController(bm_for_control, cs_for_control, TARGET * K, K, N=args.N, dt=args.dt)
+
+    def solve(i, temps, SOCs, comp_powers, T_clnts):
+        try:
+            solution = mpc.solve(i, temps, SOCs, comp_powers, T_clnts=T_clnts)
+        except Exception:
+            return None, mpc.opti.stats().get('iter_count', 0)
+        return solution['control_sequence'], mpc.stats.get('iter_count', 0)
+    return mpc, solve
+
+def benchmark_modules(args):
+    """
+    多模块闭环仿真：K个模块由一个耦合的NLP或ADMM协调的模块MPC控制（站级功率 = 每个模块的目标功率 x K），
+    与逐个模块单独求解（原有的每个模块一次仿真）的总耗时对比
+    """
+    print(f"{'K':>5}{'solves':>8}{'failed':>8}{'iters mean':>12}{args.method:>12}{'per module':>12}{'separate':>12}"
+          f"{'T spread':>10}")
+    results = {}
+    for K in [int(k) for k in args.modules.split(',')]:
+        controller, solve = build_module_controller(args, K)
+        sims = [build_models(args)[2:] for _ in range(K)]
+        temps = args.init_temp + np.linspace(-args.temp_spread / 2, args.temp_spread / 2, K)
+        SOCs = np.full(K, args.init_soc)
+        comp_powers = np.zeros(K)
+        iters, success, times = [], [], []
+        for i in range(0, args.total_steps, args.n_control):
+            start_time = time.time()
+            controls, n_iter = solve(i, temps, SOCs, comp_powers, np.array([float(cs.T_clnt_out) for _, cs in sims]))
+            times.append(time.time() - start_time)
+            iters.append(n_iter)
+            success.append(controls is not None)
+            for j in range(args.n_control):
+                for k, (bm, cs) in enumerate(sims):
+                    if controls is not None:
+                        comp_powers[k] = controls[j, k, 0]
+                        I_pack = controls[j, k, 1]
+                    else:
+                        I_pack = bm.Current_Pack2Cell(TARGET[int((i + j)*args.dt)] + comp_powers[k] + 200)
+                    Q_cool = cs.battery_cooling(temps[k], comp_powers[k])
+                    I_pack = np.clip(I_pack, bm.I_min_limit, bm.I_max_limit)
+                    temp_next, _, SOC_next, _, _ = bm.battery_model(Q_cool=Q_cool, I_pack=I_pack, T_bat=temps[k],
+                                                                    SOC=SOCs[k])
+                    temps[k], SOCs[k] = float(temp_next), float(SOC_next)
+        if args.method == 'admm':
+            summary = controller.summary()
+            controller.close()
+            print(f"ADMM: {summary['iterations_mean']:.1f} iterations/step, "
+                  f"{summary['iteration_time_mean_ms']:.1f} ms/iteration, "
+                  f"final primal {summary['primal_final_mean']:.3g} W, dual {summary['dual_final_mean']:.3g} W, "
+                  f"max power mismatch {summary['mismatch_final_max']:.3g} W")
+
+        # 原有方式：每个模块单独求解一次单模块MPC（同一进程内依次求解，即单核上K个进程的总耗时）
+        bm_for_control, cs_for_control, _, _ = build_models(args)
+        single = MPCController(bm_for_control, cs_for_control, TARGET, N=args.N, dt=args.dt, formulation='mapped')
+        start_time = time.time()
+        for k in range(K):
+            single.solve(0, args.init_temp + (k / max(K - 1, 1) - 0.5) * args.temp_spread, args.init_soc, 0.0)
+        separate = time.time() - start_time
+
+        ok = np.array(success)
+        results[K] = {'iters': np.array(iters), 'success': ok, 'times': np.array(times), 'separate': separate}
+        print(f"{K:>5}{len(ok):>8}{np.sum(~ok):>8}{np.mean(iters):>12.1f}{np.mean(times)*1000:>10.1f}ms"
+              f"{np.mean(times)/K*1000:>10.1f}ms{separate*1000:>10.1f}ms{np.ptp(temps):>10.2f}")
+    return results
+
+def benchmark_scenario(args):
+    """
+    实际发电功率 = TARGET + 与 Ningbo.py 相同过程的平滑噪声，控制器只知道 TARGET 形式的预测：
+    对比名义MPC（预测视为准确）和不同场景数的场景MPC的温度越限率和求解耗时。
+    'T spread' 为场景MPC在初始状态下一次求解中，预测时域末端各场景电池温度的极差：发电功率（Ningbo.py中
+    以MW为单位）的扰动相对于压缩机和BTMS基础功率很小，电池热容又大，时域内各场景的温度几乎相同（极差远小于0.01℃），
+    共享的第一步无需对冲，因此在这组数据上场景MPC的越限率与名义MPC相同
+    """
+    rng = np.random.default_rng(args.seed)
+    noise_std = args.noise_scale * np.max(np.abs(TARGET))
+    noise = gaussian_filter1d(rng.normal(0, noise_std, size=len(TARGET)), sigma=args.noise_sigma / args.dt)
+    P_true = np.clip(TARGET + noise, 0, None)
+
+    results = {}
+    bm_for_control, cs_for_control, bm_for_simulation, cs_for_simulation = build_models(args)
+    mpc = MPCController(bm_for_control, cs_for_control, TARGET, N=args.N, dt=args.dt, formulation='mapped')
+    results['nominal'] = run_closed_loop(args, mpc, bm_for_simulation, cs_for_simulation, P_true)
+    for S in [int(s) for s in args.scenarios.split(',')]:
+        bm_for_control, cs_for_control, bm_for_simulation, cs_for_simulation = build_models(args)
+        mpc = ScenarioMPCController(bm_for_control, cs_for_control, TARGET, scenarios=S, noise_std=noise_std,
+                                    noise_sigma=args.noise_sigma, N=args.N, dt=args.dt, seed=args.seed + 1)
+        results[f'S={S}'] = run_closed_loop(args, mpc, bm_for_simulation, cs_for_simulation, P_true)
+        states = mpc.solve(0, args.init_temp, args.init_soc, 0.0)['scenario_states']
+        results[f'S={S}']['spread'] = np.ptp(states[-1, :, 0])
+
+    print(f"{'controller':<12}{'solves':>8}{'failed':>8}{'iters mean':>12}{'time mean':>12}{'time p95':>12}"
+          f"{'T out of 23-27':>16}{'T max':>8}{'T spread':>10}")
+    for name, r in results.items():
+        ok = r['success']
+        if len(ok) == 0:
+            print(f"{name:<12}{0:>8}  no solves (total_steps < N + 1)")
+            continue
+        out_of_band = np.mean((r['temps'] < 23) | (r['temps'] > 27))
+        print(f"{name:<12}{len(ok):>8}{np.sum(~ok):>8}{np.mean(r['iters']):>12.1f}{np.mean(r['times'])*1000:>10.1f}ms"
+              f"{np.percentile(r['times'], 95)*1000:>10.1f}ms{out_of_band:>16.1%}{np.max(r['temps']):>8.2f}"
+              + (f"{r['spread']:>10.1e}" if 'spread' in r else f"{'-':>10}"))
+    return results
+
+def benchmark_plant(args):
+    """
+    对比仿真模型在各数学后端下的速度：按固定的压缩机功率序列推进仿真模型（与main.py的update_state相同的调用），
+    报告每秒仿真步数，并检查各后端的温度轨迹是否一致
+    """
+    # 压缩机功率在关闭和几个工作点之间切换，覆盖冷却量的阈值分支
+    comp_powers = np.tile(np.repeat([0.0, 1500.0, 3000.0, 600.0], 30), args.total_steps // 120 + 1)[:args.total_steps]
+    results = {}
+    for backend in args.backends.split(','):
+        best = np.inf
+        for _ in range(args.repeats):
+            _, _, bm, cs = build_models(args, sim_backend=backend)
+            current_temp, current_SOC = args.init_temp, args.init_soc
+            temps = []
+            start_time = time.time()
+            for i, comp_power in enumerate(comp_powers):
+                current_temp, current_SOC = simulate_step(i, args, bm, cs, current_temp, comp_power, current_SOC)
+                temps.append(current_temp)
+            best = min(best, time.time() - start_time)
+        results[backend] = {'steps_per_s': args.total_steps / best, 'temps': np.array(temps)}
+
+    reference = next(iter(results.values()))['temps']
+    print(f"{'backend':<10}{'steps/s':>12}{'us/step':>10}{'max |dT| vs ' + args.backends.split(',')[0]:>22}")
+    for backend, r in results.items():
+        print(f"{backend:<10}{r['steps_per_s']:>12.0f}{1e6 / r['steps_per_s']:>10.1f}"
+              f"{np.max(np.abs(r['temps'] - reference)):>22.2e}")
+    return results
+
+if __name__ == "__main__":
+    args = get_args()
+    if args.command == 'constraint':
+        benchmark_constraint(args)
+    elif args.command == 'modules':
+        benchmark_modules(args)
+    elif args.command == 'scenario':
+        benchmark_scenario(args)
+    elif args.command == 'plant':
+        benchmark_plant(args)
@@ -2,17 +2,28 @@ import numpy as np
 import matplotlib.pyplot as plt
 import logging
 import os
+import time
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from Battery.BatteryPack import BatteryPack as Battery
 from CoolingSystem.CS_for_ES import SimpleCoolingSystem
 from Controller.MPC_for_ES import MPCController
+from Controller.event_trigger import EventTrigger
+from Controller.solution_cache import SolutionCache
+from Controller.hierarchical_mpc import UpperPlanner, HierarchicalMPC
 from EnergyStorageSystem.Ningbo import POWER as TARGET
 from utils import plot_results
+from utils.telemetry import SolverTelemetry
+from utils.trace import TraceWriter
+from utils.checkpoint import capture_state, restore_state, save_checkpoint, load_checkpoint, remove_checkpoint
 from SOH.inference import SOH_predictor
 
-def get_args():
-    """解析命令行参数"""
+def get_args(argv=None):
+    """
+    解析命令行参数
+    :param argv: 参数列表，缺省为命令行参数（参数扫描时由 sweep.py 给出）
+    """
     parser = argparse.ArgumentParser(description='电池热管理系统MPC控制仿真')
     
     # 仿真参数
@@ -21,6 +32,54 @@ def get_args():
     parser.add_argument('--n_control', type=int, default=5, help='每次应用的控制步数')
     parser.add_argument('--total_steps', type=int, default=3690, help='总仿真步数（秒）')
     parser.add_argument('--max_retries', type=int, default=5, help='最大重试次数')
+    parser.add_argument('--warm_start', action='store_true', help='用上一次的最优解平移后热启动MPC求解')
+    parser.add_argument('--codegen', action='store_true', help='将MPC问题生成C代码并编译后求解')
+    parser.add_argument('--codegen_dir', type=str, default='codegen', help='生成代码和共享库的缓存目录')
+    parser.add_argument('--sim_backend', type=str, default='numpy', choices=['numpy', 'casadi'],
+                        help='仿真模型（及流水线的预测模型）的数学后端，控制模型始终使用casadi')
+    parser.add_argument('--formulation', type=str, default='unrolled', choices=['unrolled', 'mapped', 'lean'],
+                        help='MPC时域构建方式：逐步展开、单步SX函数+map，或消去pack功率等代数状态的精简构建')
+    parser.add_argument('--shooting', type=str, default='multiple', choices=['multiple', 'single'],
+                        help='lean构建方式下的打靶方式：多重打靶（状态为决策变量）或单重打靶（状态由控制量递推）')
+    parser.add_argument('--parallel_starts', type=int, default=0, help='并行多起点求解的进程数，0为顺序重试')
+    parser.add_argument('--start_deadline', type=float, default=None, help='并行多起点求解的截止时间（秒）')
+    parser.add_argument('--start_policy', type=str, default='first', choices=['first', 'best'],
+                        help='并行多起点求解取最先收敛的解或截止时间内最优的解')
+    parser.add_argument('--solver', type=str, default='ipopt', choices=['ipopt', 'rti'],
+                        help='MPC求解方式：IPOPT求解到收敛或实时迭代（每步一个QP）')
+    parser.add_argument('--rti_qpsol', type=str, default='qrqp', choices=['qrqp', 'osqp'], help='实时迭代使用的QP求解器')
+    parser.add_argument('--sensitivity_tol', type=float, default=None,
+                        help='参数灵敏度预测的KKT残差阈值，预测点的残差不超过该值时跳过IPOPT（缺省不开启）')
+    parser.add_argument('--sensitivity_max_steps', type=int, default=10,
+                        help='连续接受灵敏度预测的最大步数，之后强制完整求解一次')
+    parser.add_argument('--time_grid', type=parse_grid, default=None,
+                        help='非均匀预测网格，格式为 个数x步长，如 10x1,6x5,4x10（给定时覆盖--N）')
+    parser.add_argument('--move_blocks', type=parse_grid, default=None,
+                        help='控制移动阻塞，格式为 个数x阶段数，如 5x1,3x5（之和等于预测阶段数）')
+    parser.add_argument('--constraint_mode', type=str, default='penalty', choices=['penalty', 'slack'],
+                        help='约束形式：原有罚函数，或温度软约束（松弛变量+L1精确罚）和平滑的压缩机开启阈值')
+    parser.add_argument('--step_budget', type=float, default=None,
+                        help='每步MPC求解的时间预算（秒），超出时取可行迭代点或回退到规则控制器')
+    parser.add_argument('--pipelined', action='store_true',
+                        help='流水线模式：施加当前控制块的同时，在后台从预测的下一块起始状态提前求解')
+    parser.add_argument('--pipeline_tol', type=float, default=0.05,
+                        help='流水线模式下预测温度与实测温度的偏差阈值（℃），超出时从实测状态重新求解')
+    parser.add_argument('--event_trigger', action='store_true',
+                        help='事件触发模式：实测状态、发电功率预测偏离上一次解或剩余时域不足时才重新求解')
+    parser.add_argument('--trigger_temp_tol', type=float, default=0.1, help='事件触发的温度偏差阈值（℃）')
+    parser.add_argument('--trigger_soc_tol', type=float, default=0.005, help='事件触发的SOC偏差阈值')
+    parser.add_argument('--trigger_preview_tol', type=float, default=0.05, help='事件触发的发电功率预测相对偏差阈值')
+    parser.add_argument('--trigger_min_horizon', type=int, default=None,
+                        help='上一次解剩余的最少有效步数，缺省为预测时域的一半')
+    parser.add_argument('--cache', type=str, default=None, choices=['answer', 'warm_start'],
+                        help='MPC解缓存：命中时直接使用缓存的解，或用作热启动的初始值（缺省不开启）')
+    parser.add_argument('--cache_file', type=str, default=None, help='解缓存的持久化文件，存在时加载，仿真结束时写入')
+    parser.add_argument('--cache_size', type=int, default=4096, help='解缓存最多保存的条目数')
+    parser.add_argument('--hierarchical', action='store_true',
+                        help='分层MPC：上层在小时级时域上规划温度和SOC设定轨迹，MPC跟踪上层的温度设定（不用于流水线模式）')
+    parser.add_argument('--upper_stage', type=int, default=600, help='上层规划每个阶段的长度（秒）')
+    parser.add_argument('--upper_N', type=int, default=36, help='上层规划的阶段数')
+    parser.add_argument('--replan_interval', type=int, default=900, help='上层重新规划的间隔（秒）')
     
     # 系统初始状态
     parser.add_argument('--init_temp', type=float, default=25.0, help='电池初始温度（℃）')
@@ -31,18 +90,39 @@ def get_args():
     
     # 系统参数
     parser.add_argument('--target_power', type=float, default=2300000/100, help='目标功率（W）')
+    parser.add_argument('--power_profile', type=str, default=None,
+                        help='目标功率曲线文件（如 results/harbor/{K}.csv，取Target_Power列），缺省使用宁波数据')
     parser.add_argument('--BTM_power_base', type=float, default=200.0, help='BTMS基础功率（W）')
     
     # 温度扰动参数
     parser.add_argument('--temp_noise_std', type=float, default=0.01, help='温度高斯扰动标准差（℃）')
     
     # 日志和结果保存
-    parser.add_argument('--log_interval', type=int, default=1, help='日志记录间隔（秒）')
+    parser.add_argument('--log_interval', type=int, default=60,
+                        help='可读状态日志的采样间隔（秒），0为不输出；每一步的完整状态记录在仿真轨迹 trace.npz 中')
+    parser.add_argument('--trace_chunk', type=int, default=4096, help='仿真轨迹缓冲区的大小（步），写满后整块写入文件')
     parser.add_argument('--save_interval', type=int, default=3600, help='结果保存时间（秒）')
     parser.add_argument('--SOH_interval', type=int, default=30, help='SOH损耗记录间隔（秒）')
     parser.add_argument('--filename', type=str, default='100', help='文件名')
+    parser.add_argument('--checkpoint_interval', type=int, default=0,
+                        help='检查点间隔（秒），按控制块保存完整的仿真状态到日志目录的 checkpoint.pkl，0为不保存')
+    parser.add_argument('--resume', action='store_true',
+                        help='从日志目录（--filename）中的检查点继续仿真，参数须与保存检查点时相同')
     
-    return parser.parse_args()
+    args = parser.parse_args(argv)
+    if (args.checkpoint_interval or args.resume) and (args.hierarchical or args.pipelined):
+        parser.error('检查点暂不支持分层MPC和流水线模式')
+    return args
+
+def parse_grid(spec):
+    """
+    解析形如 10x1,6x5,4x10 的网格描述（个数x长度），返回各段长度的列表
+    """
+    grid = []
+    for item in spec.split(','):
+        count, length = item.split('x')
+        grid += [int(length)] * int(count)
+    return grid
 
 def setup_logging(args):
     """设置日志系统"""
@@ -80,32 +160,65 @@ def initialize_system(args):
         cs_for_simulation: 仿真使用的冷却系统模型
         mpc: MPC控制器实例
     """
-    # 初始化电池模型
+    # 初始化控制模型
     bm_for_control = Battery(args.dt, args.T_amb)
-    bm_for_simulation = Battery(args.dt, args.T_amb)
-    
-    # 初始化冷却系统模型
     cs_for_control = SimpleCoolingSystem(args.dt, T_amb=args.T_amb)
-    cs_for_simulation = SimpleCoolingSystem(args.dt, T_amb=args.T_amb)
-
-    # 更新电池模型参数
-    for i in [bm_for_control, bm_for_simulation]:
-        i.update_parameters(I_cell=1e-8, T_bat=args.init_temp, SOC=args.init_soc)
+    bm_for_control.update_parameters(I_cell=1e-8, T_bat=args.init_temp, SOC=args.init_soc)
+    bm_for_simulation, cs_for_simulation = build_simulation_models(args)
     
     # 初始化MPC控制器
-    mpc = MPCController(bm_for_control, cs_for_control, TARGET, N=args.N, dt=args.dt)
+    cache = None
+    if args.cache is not None:
+        cache = SolutionCache(mode=args.cache, capacity=args.cache_size, path=args.cache_file)
+    mpc = MPCController(bm_for_control, cs_for_control, TARGET, N=args.N, dt=args.dt,
+                        warm_start=args.warm_start, codegen=args.codegen, codegen_dir=args.codegen_dir,
+                        formulation=args.formulation, shooting=args.shooting, parallel_starts=args.parallel_starts,
+                        start_deadline=args.start_deadline, start_policy=args.start_policy,
+                        solver=args.solver, rti_qpsol=args.rti_qpsol,
+                        time_grid=args.time_grid, move_blocks=args.move_blocks,
+                        constraint_mode=args.constraint_mode, telemetry=SolverTelemetry(),
+                        step_budget=args.step_budget, cache=cache,
+                        sensitivity_tol=args.sensitivity_tol, sensitivity_max_steps=args.sensitivity_max_steps)
     
     # 记录初始参数
     log_system_parameters(args)
+    size = mpc.problem_size()
+    logging.info(f"MPC问题规模: 决策变量{size['nx']}个, 约束{size['ng']}个, 参数{size['np']}个")
     return bm_for_simulation, cs_for_simulation, mpc
 
+def build_simulation_models(args):
+    """构建仿真使用的电池模型和冷却系统模型，返回 (bm_for_simulation, cs_for_simulation)"""
+    bm_for_simulation = Battery(args.dt, args.T_amb, math_backend=args.sim_backend)
+    cs_for_simulation = SimpleCoolingSystem(args.dt, T_amb=args.T_amb, math_backend=args.sim_backend)
+    bm_for_simulation.update_parameters(I_cell=1e-8, T_bat=args.init_temp, SOC=args.init_soc)
+    return bm_for_simulation, cs_for_simulation
+
+def load_power_profile(path):
+    """读取目标功率曲线文件（main.py 保存的结果格式，第5列为Target_Power）"""
+    return np.loadtxt(path, delimiter=',', skiprows=1, usecols=4)
+
+def set_power_profile(path):
+    """用功率曲线文件替换仿真和MPC使用的目标功率序列TARGET"""
+    global TARGET
+    TARGET = load_power_profile(path)
+    logging.info(f"目标功率曲线: {path}，共{len(TARGET)}步")
+
+def build_hierarchy(args, mpc):
+    """构建分层MPC的上层规划，使用单独的控制模型（MPC构建后其控制模型的属性已被改写为符号表达式）"""
+    bm = Battery(args.dt, args.T_amb)
+    bm.update_parameters(I_cell=1e-8, T_bat=args.init_temp, SOC=args.init_soc)
+    cs = SimpleCoolingSystem(args.dt, T_amb=args.T_amb)
+    planner = UpperPlanner(bm, cs, TARGET, stage=args.upper_stage, N=args.upper_N, T_opt=mpc.T_opt,
+                           P_comp_limits=(mpc.P_min, mpc.P_max), weights=mpc.weights)
+    return HierarchicalMPC(mpc, planner, replan_interval=args.replan_interval)
+
 def log_system_parameters(args):
     """记录系统关键参数"""
     logging.info("系统初始化参数:")
     logging.info(f"仿真参数: dt={args.dt}秒, N={args.N}, n_control={args.n_control}, total_steps={args.total_steps}秒")
     logging.info(f"初始状态: 温度={args.init_temp}℃, SOC={args.init_soc}, 环境温度={args.T_amb}℃")
 
-def update_state(i, args, cs, bm, current_temp, comp_power, SOC):
+def update_state(i, args, cs, bm, current_temp, comp_power, SOC, trace=None):
     """
     更新系统状态
     
@@ -117,6 +230,7 @@ def update_state(i, args, cs, bm, current_temp, comp_power, SOC):
         current_temp: 当前温度
         comp_power: 压缩机功率
         SOC: 当前SOC
+        trace: 可选，TraceWriter，记录这一步的状态和诊断量
     """
     # 计算冷却量
     Q_cool = cs.battery_cooling(current_temp, comp_power)
@@ -140,12 +254,20 @@ def update_state(i, args, cs, bm, current_temp, comp_power, SOC):
 
     # 计算SOH损耗
     if i % args.SOH_interval == 0:
-        SOH_loss = bm.get_SOH_loss(I_pack, current_temp)
+        # SOH模型的输出形状为 (1, 1, 1)，取出标量
+        SOH_loss = float(np.asarray(bm.get_SOH_loss(I_pack, current_temp)).reshape(-1)[0])
     else:
         SOH_loss = 0
 
     # 记录状态信息
-    if i % args.log_interval == 0:
+    if trace is not None:
+        trace.record(step=i, time=(i+1)*args.dt, temp=current_temp, temp_next=temp_next, temp_noise=temp_noise,
+                     comp_power=comp_power, Q_cool=Q_cool, Q_gen=Q_gen, Q_ambient=Q_ambient, I_pack=I_pack,
+                     P_response=P_response, P_target=TARGET[int(i*args.dt)], SOC=SOC_next,
+                     I_max_limit=bm.I_max_limit, I_min_limit=bm.I_min_limit,
+                     I_cell_max_discharge=bm.max_I_discharge, I_cell_max_charge=bm.max_I_charge,
+                     U_cell=bm.OCV - I_pack/bm.N_parallel*bm.R_cell, T_clnt_out=cs.T_clnt_out, SOH_loss=SOH_loss)
+    if args.log_interval and i % args.log_interval == 0:
         log_state_info(i, args, current_temp, comp_power, Q_cool, Q_gen, Q_ambient,
                       I_pack, P_response, SOC_next, bm, TARGET[int(i*args.dt)], SOH_loss, temp_noise)
     
@@ -153,17 +275,22 @@ def update_state(i, args, cs, bm, current_temp, comp_power, SOC):
 
 def log_state_info(i, args, current_temp, comp_power, Q_cool, Q_gen, Q_ambient,
                   I_pack, P_response, SOC_next, bm, TARGET, SOH_loss, temp_noise):
-    """记录系统状态信息"""
-    logging.info(f"\n第{(i+1)*args.dt}秒系统状态:")
-    logging.info(f"温度: {float(current_temp):.2f}℃, 温度扰动: {float(temp_noise):.3f}℃")
-    logging.info(f"压缩机功率: {float(comp_power):.2f}W")
-    logging.info(f"冷却量: {float(Q_cool):.2f}W, 产热量: {float(Q_gen):.2f}W, 环境热交换: {float(Q_ambient):.2f}W")
-    logging.info(f"电池电流: {float(I_pack):.2f}A, 电池功率: {float(P_response):.2f}W, 电池目标功率: {float(TARGET):.2f}W")
-    logging.info(f"电池Cell电流限制: 放电{float(bm.max_I_discharge):.2f}A, 充电{float(bm.max_I_charge):.2f}A")
-    logging.info(f"电池Pack电流限制: 放电{float(bm.I_max_limit):.2f}A, 充电{float(bm.I_min_limit):.2f}A")
-    logging.info(f"SOC: {SOC_next*100:.2f}%")
-    logging.info(f"电池电压: {float(bm.OCV - I_pack/bm.N_parallel*bm.R_cell):.2f}V")
-    logging.info(f"SOH损耗: {float(SOH_loss)}")
+    """记录系统状态信息（按 log_interval 采样，合并为一条日志）"""
+    logging.info("\n".join([
+        f"\n第{(i+1)*args.dt}秒系统状态:",
+        f"温度: {float(current_temp):.2f}℃, 温度扰动: {float(temp_noise):.3f}℃",
+        f"压缩机功率: {float(comp_power):.2f}W",
+        f"冷却量: {float(Q_cool):.2f}W, 产热量: {float(Q_gen):.2f}W, 环境热交换: {float(Q_ambient):.2f}W",
+        f"电池电流: {float(I_pack):.2f}A, 电池功率: {float(P_response):.2f}W, 电池目标功率: {float(TARGET):.2f}W",
+        f"电池Cell电流限制: 放电{float(bm.max_I_discharge):.2f}A, 充电{float(bm.max_I_charge):.2f}A",
+        f"电池Pack电流限制: 放电{float(bm.I_max_limit):.2f}A, 充电{float(bm.I_min_limit):.2f}A",
+        f"SOC: {float(SOC_next)*100:.2f}%",
+        f"电池电压: {float(bm.OCV - I_pack/bm.N_parallel*bm.R_cell):.2f}V",
+        f"SOH损耗: {float(SOH_loss)}"]))
+
+def checkpoint_args(args):
+    """影响仿真结果的参数，恢复时与检查点中的比较（不含检查点本身的参数）"""
+    return {k: v for k, v in vars(args).items() if k not in ('resume', 'checkpoint_interval')}
 
 def run_mpc_simulation(args, mpc, bm_for_simulation, cs_for_simulation, log_dir):
     """运行MPC仿真，solve失败时使用上一次状态重试"""
@@ -178,6 +305,31 @@ def run_mpc_simulation(args, mpc, bm_for_simulation, cs_for_simulation, log_dir)
     control_sequence = []
     state_trajectory = []
     time_points = []
+    solve_times = []  # 每次MPC求解的耗时（秒）
+    fallback_events = {'iterate': 0, 'fallback': 0}  # 超出时间预算或求解失败时的回退次数
+    trace = TraceWriter(log_dir, chunk_size=args.trace_chunk)
+    hierarchy = build_hierarchy(args, mpc) if args.hierarchical else None
+    trigger = None
+    if args.event_trigger:
+        min_horizon = args.trigger_min_horizon if args.trigger_min_horizon is not None else mpc.horizon // 2
+        trigger = EventTrigger(args.trigger_temp_tol, args.trigger_soc_tol, args.trigger_preview_tol, min_horizon)
+    solution = None
+
+    # 从检查点恢复仿真循环、仿真模型、随机数生成器、MPC热启动数据和轨迹缓冲区
+    if args.resume:
+        state = load_checkpoint(log_dir)
+        if state is None:
+            logging.warning(f"{log_dir} 中没有检查点，从头开始仿真")
+        else:
+            if state['loop']['args'] != checkpoint_args(args):
+                logging.warning("当前参数与保存检查点时不同，恢复后的结果可能与不中断的仿真不一致")
+            loop = restore_state(state, bm_for_simulation, cs_for_simulation, mpc, trace)
+            i, current_temp, current_SOC, comp_power = loop['i'], loop['temp'], loop['SOC'], loop['comp_power']
+            solution, trigger = loop['solution'], loop['trigger']
+            control_sequence, state_trajectory, time_points = \
+                loop['control_sequence'], loop['state_trajectory'], loop['time_points']
+            solve_times, fallback_events = loop['solve_times'], loop['fallback_events']
+    last_checkpoint = i
     
     # 记录上一次成功求解的状态
     last_successful_state = {
@@ -190,11 +342,33 @@ def run_mpc_simulation(args, mpc, bm_for_simulation, cs_for_simulation, log_dir)
     # 滚动优化
     while i < args.total_steps:
         remaining_steps = args.total_steps - i
-        if remaining_steps < mpc.N:
+        if remaining_steps < mpc.horizon:
             break
         
-        solution = mpc.multi_solve(i, float(current_temp), float(current_SOC), float(comp_power))
+        # 分层模式下，到达重新规划的时刻时更新MPC的参考温度
+        if hierarchy is not None:
+            plan = hierarchy.update(i, float(current_temp), float(current_SOC), float(comp_power),
+                                    float(cs_for_simulation.T_clnt_out))
+            if plan is not None:
+                logging.info(f"第{i*args.dt}秒上层规划: 温度设定 {plan['temp'][1]:.2f}~{plan['temp'][-1]:.2f}℃, "
+                             f"SOC设定 {plan['SOC'][1]:.3f}~{plan['SOC'][-1]:.3f}")
 
+        # 事件触发模式下，只有偏差或剩余时域超过阈值时才重新求解，否则继续施加上一次解的后续控制量
+        offset = 0
+        preview = TARGET[i*args.dt : (i + mpc.horizon)*args.dt : args.dt]
+        reason = 'periodic' if trigger is None else \
+            trigger.check(i, float(current_temp), float(current_SOC), preview, args.n_control)
+        if reason is None:
+            offset = trigger.offset(i)
+            logging.info(f"第{i*args.dt}秒跳过MPC求解，使用上一次解的第{offset}步")
+        else:
+            start_time = time.time()
+            solution = mpc.multi_solve(i, float(current_temp), float(current_SOC), float(comp_power))
+            solve_times.append(time.time() - start_time)
+            logging.info(f"第{i*args.dt}秒MPC求解耗时: {solve_times[-1]*1000:.2f}ms, 触发原因: {reason}")
+            log_solution_source(i, args, solution, fallback_events)
+            if trigger is not None:
+                trigger.update(i, solution, preview)
         
         # 应用控制并更新状态
         for j in range(args.n_control):
@@ -203,10 +377,10 @@ def run_mpc_simulation(args, mpc, bm_for_simulation, cs_for_simulation, log_dir)
             if solution is None:
                 logging.warning(f"使用上一次成功求解的计算结果")
             else:
-                comp_power = solution['control_sequence'][j][0]
+                comp_power = solution['control_sequence'][offset + j][0]
             current_temp, current_SOC, SOH_total_loss, I_pack = update_state(
                 i+j, args, cs_for_simulation, bm_for_simulation,
-                current_temp, comp_power, current_SOC
+                current_temp, comp_power, current_SOC, trace=trace
             )
             
             time_points.append(i+j+1)
@@ -214,9 +388,173 @@ def run_mpc_simulation(args, mpc, bm_for_simulation, cs_for_simulation, log_dir)
             state_trajectory.append([float(current_temp), float(current_SOC), float(SOH_total_loss), float(I_pack)])
         
         i += args.n_control
+
+        if args.checkpoint_interval and (i - last_checkpoint) * args.dt >= args.checkpoint_interval:
+            loop = {
+                'i': i, 'dt': args.dt, 'temp': current_temp, 'SOC': current_SOC, 'comp_power': comp_power,
+                'solution': solution, 'trigger': trigger, 'control_sequence': control_sequence,
+                'state_trajectory': state_trajectory, 'time_points': time_points, 'solve_times': solve_times,
+                'fallback_events': fallback_events, 'args': checkpoint_args(args)
+            }
+            path = save_checkpoint(log_dir, capture_state(loop, bm_for_simulation, cs_for_simulation, mpc, trace))
+            last_checkpoint = i
+            logging.info(f"第{i*args.dt}秒保存检查点: {path}")
+
+    # 先删除检查点再合并轨迹：合并会删除检查点引用的块文件
+    remove_checkpoint(log_dir)
+    trace.close()
+    log_solve_summary(args, solve_times, fallback_events)
+    if hierarchy is not None:
+        summary = hierarchy.summary()
+        logging.info(f"上层规划: {summary['plans']}次, 失败{summary['failures']}次, "
+                     f"平均耗时{summary['plan_time_mean_ms']:.2f}ms, 最大耗时{summary['plan_time_max_ms']:.2f}ms")
+    if trigger is not None:
+        counts = trigger.summary()
+        logging.info(f"事件触发: 求解{counts['solved']}次, 跳过{counts['skipped']}次 (跳过率{counts['skip_rate']:.1%}), "
+                     f"触发原因: 初始{counts['initial']}, 温度{counts['temp']}, SOC{counts['SOC']}, "
+                     f"功率预测{counts['preview']}, 剩余时域{counts['horizon']}")
     
     return np.array(control_sequence), np.array(state_trajectory), np.array(time_points)
 
+def log_solution_source(i, args, solution, fallback_events):
+    """超出时间预算或求解失败时记录回退事件"""
+    if solution is not None and solution['source'] in fallback_events:
+        fallback_events[solution['source']] += 1
+        if solution['source'] == 'iterate':
+            logging.warning(f"第{i*args.dt}秒MPC未在时间预算内收敛，使用最优的可行迭代点")
+        else:
+            logging.warning(f"第{i*args.dt}秒MPC无可行解，回退到规则控制器")
+
+def log_solve_summary(args, solve_times, fallback_events):
+    """记录MPC求解耗时的统计和回退次数"""
+    if solve_times:
+        solve_times = np.array(solve_times) * 1000
+        logging.info(f"MPC求解耗时: 平均{np.mean(solve_times):.2f}ms, 中位数{np.median(solve_times):.2f}ms, "
+                     f"P95 {np.percentile(solve_times, 95):.2f}ms, 最大{np.max(solve_times):.2f}ms")
+    if args.step_budget is not None:
+        logging.info(f"时间预算回退: 可行迭代点{fallback_events['iterate']}次, 规则控制器{fallback_events['fallback']}次")
+
+def predict_state(i, args, cs, bm, current_temp, SOC, comp_powers):
+    """
+    用预测模型从当前状态出发，依次施加一个控制块内的压缩机功率（不加温度扰动），预测控制块结束时的状态
+    参数:
+        i: 控制块的起始时间步
+        cs: 预测用冷却系统模型
+        bm: 预测用电池模型
+        comp_powers: 控制块内每一步的压缩机功率
+    返回:
+        (温度, SOC)
+    """
+    for j, comp_power in enumerate(comp_powers):
+        Q_cool = cs.battery_cooling(current_temp, comp_power)
+        P_gap = TARGET[int((i+j)*args.dt)] + comp_power + args.BTM_power_base
+        I_pack = np.clip(bm.Current_Pack2Cell(P_gap), bm.I_min_limit, bm.I_max_limit)
+        current_temp, _, SOC, _, _ = bm.battery_model(Q_cool=Q_cool, I_pack=I_pack, T_bat=current_temp, SOC=SOC)
+    return float(current_temp), float(SOC)
+
+def solve_ahead(args, mpc, cs, bm, i, current_temp, SOC, comp_powers):
+    """
+    后台求解：预测下一个控制块起始时的状态，并从该状态提前求解MPC
+    返回:
+        (MPC结果, 预测温度, 预测SOC, 耗时)
+    """
+    start_time = time.time()
+    temp, soc = predict_state(i, args, cs, bm, current_temp, SOC, comp_powers)
+    solution = mpc.multi_solve(i + len(comp_powers), temp, soc, float(comp_powers[-1]))
+    return solution, temp, soc, time.time() - start_time
+
+def run_pipelined_mpc_simulation(args, mpc, bm_for_simulation, cs_for_simulation, log_dir):
+    """
+    流水线MPC仿真：施加当前控制块的同时，后台线程用独立的预测模型推算下一块起始状态并提前求解；
+    控制块结束时若实测温度与预测偏差超过 pipeline_tol，则从实测状态重新求解（此时可利用刚得到的解热启动）
+    """
+    # 初始化状态
+    i = 0
+    current_temp = args.init_temp
+    comp_power = args.init_comp_power
+    current_SOC = args.init_soc
+    logging.info("开始流水线MPC控制仿真")
+
+    # 预测模型，每个控制块开始时同步为仿真模型的状态
+    bm_for_prediction = Battery(args.dt, args.T_amb, math_backend=args.sim_backend)
+    cs_for_prediction = SimpleCoolingSystem(args.dt, T_amb=args.T_amb, math_backend=args.sim_backend)
+
+    # 存储结果
+    control_sequence = []
+    state_trajectory = []
+    time_points = []
+    solve_times = []  # 每个控制块结束时等待求解结果的耗时（秒）
+    ahead_times = []  # 后台提前求解的耗时（秒）
+    fallback_events = {'iterate': 0, 'fallback': 0}
+    corrections = 0  # 从实测状态重新求解的次数
+    trace = TraceWriter(log_dir, chunk_size=args.trace_chunk)
+
+    # 第一个控制块只能同步求解
+    start_time = time.time()
+    solution = mpc.multi_solve(i, float(current_temp), float(current_SOC), float(comp_power))
+    solve_times.append(time.time() - start_time)
+    log_solution_source(i, args, solution, fallback_events)
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        while i < args.total_steps:
+            remaining_steps = args.total_steps - i
+            if remaining_steps < mpc.horizon:
+                break
+
+            # 本控制块的压缩机功率，求解失败时保持当前功率
+            comp_powers = [float(comp_power) if solution is None else float(solution['control_sequence'][j][0])
+                           for j in range(args.n_control)]
+
+            # 后台提前求解下一个控制块
+            next_i = i + args.n_control
+            future = None
+            if args.total_steps - next_i >= mpc.horizon:
+                bm_for_prediction.set_state(bm_for_simulation.get_state())
+                cs_for_prediction.set_state(cs_for_simulation.get_state())
+                future = executor.submit(solve_ahead, args, mpc, cs_for_prediction, bm_for_prediction,
+                                         i, float(current_temp), float(current_SOC), comp_powers)
+
+            # 应用控制并更新状态
+            for j in range(args.n_control):
+                if i + j >= args.total_steps:
+                    break
+                comp_power = comp_powers[j]
+                current_temp, current_SOC, SOH_total_loss, I_pack = update_state(
+                    i+j, args, cs_for_simulation, bm_for_simulation,
+                    current_temp, comp_power, current_SOC, trace=trace
+                )
+
+                time_points.append(i+j+1)
+                control_sequence.append([float(comp_power)])
+                state_trajectory.append([float(current_temp), float(current_SOC), float(SOH_total_loss), float(I_pack)])
+
+            i = next_i
+            if future is None:
+                continue
+
+            # 控制块结束：取提前求解的结果，偏差过大时从实测状态重新求解
+            start_time = time.time()
+            solution, predicted_temp, _, ahead_time = future.result()
+            ahead_times.append(ahead_time)
+            if abs(predicted_temp - float(current_temp)) > args.pipeline_tol:
+                corrections += 1
+                logging.info(f"第{i*args.dt}秒预测温度{predicted_temp:.3f}℃与实测{float(current_temp):.3f}℃偏差过大，"
+                             f"从实测状态重新求解")
+                solution = mpc.multi_solve(i, float(current_temp), float(current_SOC), float(comp_power))
+            solve_times.append(time.time() - start_time)
+            logging.info(f"第{i*args.dt}秒MPC等待耗时: {solve_times[-1]*1000:.2f}ms, 提前求解耗时: {ahead_time*1000:.2f}ms")
+            log_solution_source(i, args, solution, fallback_events)
+    finally:
+        executor.shutdown(wait=True)
+        trace.close()
+
+    log_solve_summary(args, solve_times, fallback_events)
+    if ahead_times:
+        logging.info(f"后台提前求解耗时: 平均{np.mean(ahead_times)*1000:.2f}ms, 重新求解{corrections}次")
+
+    return np.array(control_sequence), np.array(state_trajectory), np.array(time_points)
+
 def save_results(args, time_points, state_trajectory, control_sequence, log_dir):
     """保存仿真结果，到logs文件夹下"""
     results_dir = log_dir
@@ -227,14 +565,15 @@ def save_results(args, time_points, state_trajectory, control_sequence, log_dir)
     time_data = time_points[mask]
     temp_data = state_trajectory[mask, 0]
     soh_data = state_trajectory[mask, 2]
+    soc_data = state_trajectory[mask, 1]
     comp_power_data = control_sequence[mask]
     power_data = TARGET[:len(time_data)]
     # 保存数据
     temp_file = os.path.join(results_dir, "data.csv")
     np.savetxt(temp_file, 
-              np.column_stack((time_data, comp_power_data, temp_data, soh_data, power_data)),
+              np.column_stack((time_data, comp_power_data, temp_data, soh_data, power_data, soc_data)),
               delimiter=',',
-              header='Time(s),Control_Sequence,Temperature(℃),SOH_Loss,Target_Power',
+              header='Time(s),Control_Sequence,Temperature(℃),SOH_Loss,Target_Power,SOC',
               comments='')
     logging.info(f"数据已保存到: {temp_file}")
 
@@ -246,12 +585,15 @@ def main():
     # 2. 设置日志系统
     log_dir = setup_logging(args)
     logging.info("开始MPC控制仿真")
+    if args.power_profile is not None:
+        set_power_profile(args.power_profile)
     
     # 3. 初始化系统
     bm_for_simulation, cs_for_simulation, mpc = initialize_system(args)
     
     # 4. 运行MPC仿真
-    control_sequence, state_trajectory, time_points = run_mpc_simulation(
+    simulate = run_pipelined_mpc_simulation if args.pipelined else run_mpc_simulation
+    control_sequence, state_trajectory, time_points = simulate(
         args, mpc, bm_for_simulation, cs_for_simulation, log_dir
     )
     
@@ -264,8 +606,17 @@ def main():
     # 6. 保存结果
     save_results(args, time_points, state_trajectory, control_sequence, log_dir)
     
-    # 7. 绘制结果图表
+    # 7. 保存求解遥测
+    mpc.telemetry.save(log_dir)
+    if mpc.cache is not None:
+        stats = mpc.cache.stats()
+        logging.info(f"MPC解缓存: 命中{stats['hits']}次, 未命中{stats['misses']}次, 命中率{stats['hit_rate']:.2%}, "
+                     f"淘汰{stats['evictions']}条, 共{stats['size']}条")
+        mpc.cache.save()
+    
+    # 8. 绘制结果图表
     plot_results(time_points, control_sequence, state_trajectory, log_dir)
+    mpc.close()
     
     logging.info("MPC控制仿真完成")
 
@@ -0,0 +1,192 @@
+import os
+import time
+import argparse
+import numpy as np
+import matplotlib.pyplot as plt
+from Battery.BatteryPack import BatteryPack as Battery
+from CoolingSystem.CS_for_ES import SimpleCoolingSystem
+from Controller.RB_controller import RBController
+from EnergyStorageSystem.Ningbo import POWER as TARGET
+
+class MonteCarloSimulator:
+    """
+    批量的蒙特卡洛仿真：R个温度扰动的实现同时推进，每个实现的温度、SOC、冷却液出口温度和SOH损耗
+    为长度R的数组。电池和冷却系统模型使用numpy后端，模型的状态属性（OCV、电流限制、冷却液温度等）
+    随之成为数组，每一步的方程只计算一次。每一步的计算与 main.py 的 update_state 相同。
+    """
+
+    def __init__(self, realizations, P_RE=TARGET, dt=1, T_amb=35.0, init_temp=25.0, init_soc=0.6,
+                 init_comp_power=0.0, temp_noise_std=0.01, BTM_power_base=200.0, SOH_interval=None, seed=None):
+        """
+        初始化蒙特卡洛仿真
+        :param realizations: 实现数R
+        :param P_RE: 目标功率序列
+        :param dt: 时间步长 (s)
+        :param T_amb: 环境温度 (℃)
+        :param init_temp: 电池初始温度 (℃)
+        :param init_soc: 电池初始SOC
+        :param init_comp_power: 压缩机初始功率 (W)
+        :param temp_noise_std: 每一步温度高斯扰动的标准差 (℃)
+        :param BTM_power_base: BTMS基础功率 (W)
+        :param SOH_interval: SOH损耗的计算间隔（步），None表示不计算
+        :param seed: 温度扰动的随机种子
+        """
+        self.R = realizations
+        self.P_RE = P_RE
+        self.dt = dt
+        self.temp_noise_std = temp_noise_std
+        self.BTM_power_base = BTM_power_base
+        self.SOH_interval = SOH_interval
+        self.rng = np.random.default_rng(seed)
+
+        self.bm = Battery(dt, T_amb, math_backend='numpy')
+        self.cs = SimpleCoolingSystem(dt, T_amb=T_amb, math_backend='numpy')
+        self.bm.update_parameters(I_cell=1e-8, T_bat=init_temp, SOC=init_soc)
+        self.temp = np.full(realizations, float(init_temp))
+        self.SOC = np.full(realizations, float(init_soc))
+        self.comp_power = np.full(realizations, float(init_comp_power))
+        self.SOH_loss = np.zeros(realizations)  # 累计的SOH损耗
+
+    @property
+    def T_clnt(self):
+        """各实现的冷却液出口温度"""
+        return np.broadcast_to(self.cs.T_clnt_out, (self.R,)).astype(float)
+
+    def step(self, i, comp_power):
+        """
+        所有实现推进一步
+        :param i: 当前时间步
+        :param comp_power: 压缩机功率，标量（所有实现相同）或形状为 (R,) 的数组
+        """
+        comp_power = np.broadcast_to(np.asarray(comp_power, dtype=float), (self.R,))
+        Q_cool = self.cs.battery_cooling(self.temp, comp_power)
+
+        # 计算功率缺口和所需电流
+        P_gap = self.P_RE[int(i*self.dt)] + comp_power + self.BTM_power_base
+        I_pack = np.clip(self.bm.Current_Pack2Cell(P_gap), self.bm.I_min_limit, self.bm.I_max_limit)
+
+        if self.SOH_interval and i % self.SOH_interval == 0:
+            self.SOH_loss += self.bm.get_SOH_loss(I_pack, self.temp)
+
+        temp_next, _, SOC_next, _, _ = self.bm.battery_model(Q_cool=Q_cool, I_pack=I_pack, T_bat=self.temp,
+                                                             SOC=self.SOC)
+        self.temp = temp_next + self.rng.normal(0, self.temp_noise_std, self.R)
+        self.SOC = SOC_next
+        self.comp_power = comp_power
+
+    def run(self, total_steps, schedule=None, controller=None):
+        """
+        闭环或开环仿真
+        :param total_steps: 仿真步数
+        :param schedule: 固定的压缩机功率序列，长度至少为 total_steps，或形状为 (total_steps, R)
+        :param controller: 规则控制器（RBController），每一步按各实现自身的温度决定压缩机功率；
+                           与 schedule 二选一
+        :return: dict，'temp'、'SOC'、'T_clnt'、'SOH_loss' 的形状为 (total_steps+1, R)，
+                 'comp_power' 的形状为 (total_steps, R)
+        """
+        if (schedule is None) == (controller is None):
+            raise ValueError("schedule 和 controller 须且只能给定一个")
+        history = {name: [getattr(self, name).copy()] for name in ('temp', 'SOC', 'T_clnt', 'SOH_loss')}
+        history['comp_power'] = []
+        for i in range(total_steps):
+            if controller is not None:
+                comp_power = controller.batch_rule(self.temp, self.comp_power)
+            else:
+                comp_power = schedule[i]
+            self.step(i, comp_power)
+            for name, values in history.items():
+                values.append(getattr(self, name).copy())
+        return {name: np.array(values) for name, values in history.items()}
+
+def percentile_bands(results, q=(5, 50, 95)):
+    """
+    各时刻在所有实现上的分位数
+    :param results: MonteCarloSimulator.run 的返回值
+    :param q: 分位数（百分比）
+    :return: dict，每个量的形状为 (len(q), 时间步数)
+    """
+    return {name: np.percentile(values, q, axis=1) for name, values in results.items()}
+
+def load_schedule(path):
+    """从 main.py 保存的 data.csv 读取压缩机功率序列（第2列）"""
+    return np.loadtxt(path, delimiter=',', skiprows=1, usecols=1)
+
+def save_bands(bands, q, dt, output_dir):
+    """保存分位数带的数据和温度、SOC的分位数带图"""
+    os.makedirs(output_dir, exist_ok=True)
+    T = bands['temp'].shape[1]
+    time_points = np.arange(T) * dt
+    columns, header = [time_points], ['Time(s)']
+    for name in ('temp', 'SOC', 'T_clnt', 'SOH_loss'):
+        columns.extend(bands[name])
+        header.extend(f'{name}_p{p:g}' for p in q)
+    data_file = os.path.join(output_dir, 'bands.csv')
+    np.savetxt(data_file, np.column_stack(columns), delimiter=',', header=','.join(header), comments='')
+
+    fig, axes = plt.subplots(2, 1, figsize=(15, 10))
+    for ax, name, label in [(axes[0], 'temp', '温度 (℃)'), (axes[1], 'SOC', 'SOC')]:
+        band = bands[name]
+        ax.fill_between(time_points, band[0], band[-1], alpha=0.3, label=f'p{q[0]:g}-p{q[-1]:g}')
+        ax.plot(time_points, band[len(q) // 2], 'r-', label=f'p{q[len(q) // 2]:g}')
+        ax.set_xlabel('时间 (s)')
+        ax.set_ylabel(label)
+        ax.grid(True)
+        ax.legend()
+    plt.tight_layout()
+    plt.savefig(os.path.join(output_dir, 'bands.png'))
+    plt.close(fig)
+    return data_file
+
+def get_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='温度扰动下的批量蒙特卡洛仿真')
+    parser.add_argument('--realizations', type=int, default=1000, help='实现数')
+    parser.add_argument('--total_steps', type=int, default=3690, help='仿真步数（秒）')
+    parser.add_argument('--controller', type=str, default='rb', choices=['rb', 'schedule'],
+                        help='压缩机功率来源：规则控制器，或固定的功率序列')
+    parser.add_argument('--schedule', type=str, default=None,
+                        help='固定功率序列的文件（main.py 保存的 data.csv），缺省时压缩机保持初始功率')
+    parser.add_argument('--percentiles', type=str, default='5,50,95', help='输出的分位数，逗号分隔')
+    parser.add_argument('--output', type=str, default='results/monte_carlo', help='输出目录')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--dt', type=int, default=1, help='时间步长（秒）')
+    parser.add_argument('--init_temp', type=float, default=25.0, help='电池初始温度（℃）')
+    parser.add_argument('--init_soc', type=float, default=0.6, help='电池初始SOC')
+    parser.add_argument('--T_amb', type=float, default=35.0, help='环境温度（℃）')
+    parser.add_argument('--init_comp_power', type=float, default=0, help='压缩机初始功率（W）')
+    parser.add_argument('--BTM_power_base', type=float, default=200.0, help='BTMS基础功率（W）')
+    parser.add_argument('--temp_noise_std', type=float, default=0.01, help='温度高斯扰动标准差（℃）')
+    parser.add_argument('--SOH_interval', type=int, default=None, help='SOH损耗计算间隔（秒），缺省不计算')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = get_args()
+    q = [float(p) for p in args.percentiles.split(',')]
+    simulator = MonteCarloSimulator(args.realizations, dt=args.dt, T_amb=args.T_amb, init_temp=args.init_temp,
+                                    init_soc=args.init_soc, init_comp_power=args.init_comp_power,
+                                    temp_noise_std=args.temp_noise_std, BTM_power_base=args.BTM_power_base,
+                                    SOH_interval=args.SOH_interval, seed=args.seed)
+    schedule, controller = None, None
+    if args.controller == 'rb':
+        controller = RBController(simulator.bm, simulator.cs, TARGET, dt=args.dt)
+    elif args.schedule is not None:
+        schedule = load_schedule(args.schedule)
+        # 序列较短时保持最后一个值
+        schedule = np.pad(schedule, (0, max(args.total_steps - len(schedule), 0)), mode='edge')
+    else:
+        schedule = np.full(args.total_steps, args.init_comp_power)
+
+    start_time = time.time()
+    results = simulator.run(args.total_steps, schedule=schedule, controller=controller)
+    elapsed = time.time() - start_time
+    bands = percentile_bands(results, q)
+    data_file = save_bands(bands, q, args.dt, args.output)
+
+    print(f"{args.realizations}个实现 x {args.total_steps}步: {elapsed:.2f}s "
+          f"({args.realizations * args.total_steps / elapsed:.0f} 实现步/s)")
+    temp = results['temp']
+    print(f"终端温度 p{q[0]:g}/p{q[len(q) // 2]:g}/p{q[-1]:g}: "
+          + '/'.join(f'{v:.3f}' for v in bands['temp'][[0, len(q) // 2, -1], -1]) + '℃')
+    print(f"温度超出23-27℃的时间比例: {np.mean((temp < 23) | (temp > 27)):.2%}, "
+          f"至少一次超出的实现比例: {np.mean(np.any((temp < 23) | (temp > 27), axis=0)):.2%}")
+    print(f"分位数带已保存到: {data_file}")
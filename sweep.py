@@ -0,0 +1,271 @@
+import os
+import csv
+import json
+import time
+import shlex
+import hashlib
+import logging
+import argparse
+import itertools
+import contextlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import main
+from Controller.RB_controller import RBController
+from utils.trace import TraceWriter
+
+# 参与扫描的参数：(命令行参数名, 类型)
+GRID_PARAMS = [('controller', str), ('T_amb', float), ('init_soc', float), ('N', int), ('n_control', int),
+               ('modules', int), ('seed', int)]
+# 只影响闭环仿真、不影响MPC问题构建的参数，这些参数不同的运行可以共用同一个MPC控制器
+RUN_ONLY_PARAMS = ('n_control', 'total_steps', 'eval_steps', 'seed')
+
+# 每个工作进程的MPC控制器：(构建参数的键, 控制器)
+_worker_mpc = None
+# main.py 缺省的目标功率序列，未指定功率曲线的运行使用它
+DEFAULT_TARGET = main.TARGET
+
+def file_hash(path):
+    """文件内容的哈希，用于功率曲线文件修改后重新运行"""
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def config_hash(config):
+    """运行配置的内容哈希，作为运行目录名和跳过已完成运行的依据"""
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:12]
+
+def config_argv(config):
+    """运行配置对应的 main.py 命令行参数"""
+    argv = []
+    for name in ('T_amb', 'init_soc', 'N', 'n_control', 'total_steps', 'power_profile'):
+        if config[name] is not None:
+            argv += [f'--{name}', str(config[name])]
+    return argv + shlex.split(config['main_args'])
+
+def mpc_key(config):
+    """决定MPC问题构建的配置部分"""
+    return json.dumps({k: v for k, v in config.items() if k not in RUN_ONLY_PARAMS}, sort_keys=True)
+
+def build_grid(args):
+    """
+    参数网格的笛卡尔积
+    :return: 运行配置的列表，每个配置为dict
+    """
+    values = [[cast(v) for v in getattr(args, name).split(',')] if getattr(args, name) else [None]
+              for name, cast in GRID_PARAMS]
+    # MPC运行在 total_steps - N 步后结束（需要N步的功率预测），所有运行的指标只统计共同的前 eval_steps 步
+    horizons = values[[name for name, _ in GRID_PARAMS].index('N')]
+    controllers = values[[name for name, _ in GRID_PARAMS].index('controller')]
+    eval_steps = args.total_steps - (max(horizons) if 'mpc' in controllers else 0)
+    configs = []
+    for combination in itertools.product(*values):
+        config = dict(zip([name for name, _ in GRID_PARAMS], combination))
+        if config['modules'] is None:
+            config['power_profile'] = config['profile_hash'] = None
+        else:
+            config['power_profile'] = args.profile_pattern.format(K=config['modules'])
+            config['profile_hash'] = file_hash(config['power_profile'])
+        if config['controller'] == 'rb':
+            # 规则控制器不使用MPC参数
+            config['N'] = config['n_control'] = None
+        config['total_steps'] = args.total_steps
+        config['eval_steps'] = eval_steps
+        config['main_args'] = args.main_args
+        if config not in configs:
+            configs.append(config)
+    return configs
+
+def setup_run_logging(run_dir):
+    """每次运行的日志写入各自的运行目录"""
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    handler = logging.FileHandler(os.path.join(run_dir, 'mpc_control.log'))
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+
+def run_rb_simulation(args, log_dir):
+    """
+    规则控制器的闭环仿真（与 RB_control.py 相同的控制规则，仿真方式与 main.py 的 update_state 相同）
+    :return: 与 main.run_mpc_simulation 相同格式的 (control_sequence, state_trajectory, time_points)
+    """
+    bm, cs = main.build_simulation_models(args)
+    controller = RBController(bm, cs, main.TARGET, dt=args.dt)
+    current_temp, current_SOC, comp_power = args.init_temp, args.init_soc, args.init_comp_power
+    control_sequence, state_trajectory, time_points = [], [], []
+    trace = TraceWriter(log_dir, chunk_size=args.trace_chunk)
+    for i in range(args.total_steps):
+        comp_power = float(controller.batch_rule(np.array([current_temp]), comp_power)[0])
+        controller.current_comp_power = comp_power
+        current_temp, current_SOC, SOH_loss, I_pack = main.update_state(i, args, cs, bm, current_temp, comp_power,
+                                                                        current_SOC, trace=trace)
+        time_points.append(i + 1)
+        control_sequence.append([comp_power])
+        state_trajectory.append([float(current_temp), float(current_SOC), float(SOH_loss), float(I_pack)])
+    trace.close()
+    return np.array(control_sequence), np.array(state_trajectory), np.array(time_points)
+
+def run_metrics(args, control_sequence, state_trajectory, eval_steps, telemetry=None):
+    """
+    一次运行的汇总指标
+    :param eval_steps: 统计的步数，不同控制器、预测时域的运行在相同长度上比较
+    :param telemetry: MPC的求解遥测，规则控制器为None
+    """
+    control_sequence, state_trajectory = control_sequence[:eval_steps], state_trajectory[:eval_steps]
+    temp = state_trajectory[:, 0]
+    metrics = {
+        'steps': len(temp),
+        'temp_mean': np.mean(temp),
+        'temp_max': np.max(temp),
+        'temp_min': np.min(temp),
+        'temp_std': np.std(temp),
+        'time_above_26': np.mean(temp > 26) * 100,  # 百分比，与 utils/statistics.py 相同
+        'time_below_24': np.mean(temp < 24) * 100,
+        'comp_energy_kWh': np.sum(control_sequence[:, 0]) * args.dt / 3.6e6,
+        'SOH_loss': np.sum(state_trajectory[:, 2]),
+        'final_SOC': state_trajectory[-1, 1]
+    }
+    if telemetry is not None and telemetry.records:
+        summary = telemetry.summary()
+        metrics.update({k: summary[k] for k in ('latency_p50_ms', 'latency_p95_ms', 'step_failure_rate',
+                                                'iter_count_mean')})
+    return {k: float(v) for k, v in metrics.items()}
+
+def _worker_controller(args, config):
+    """工作进程的MPC控制器：构建参数与上一次运行相同时复用（清除求解状态），否则重新构建"""
+    global _worker_mpc
+    key = mpc_key(config)
+    if _worker_mpc is not None and _worker_mpc[0] == key:
+        mpc = _worker_mpc[1]
+        mpc.reset()
+        return mpc, False
+    if _worker_mpc is not None:
+        _worker_mpc[1].close()
+    _, _, mpc = main.initialize_system(args)
+    _worker_mpc = (key, mpc)
+    return mpc, True
+
+def run_config(config, run_dir):
+    """
+    在当前进程中完成一次运行：仿真、保存结果和指标。失败时不写 metrics.json，下次扫描会重新运行
+    :return: dict，'config'、'metrics'、'status'、'wall_time'
+    """
+    os.makedirs(run_dir, exist_ok=True)
+    start_time = time.time()
+    args = main.get_args(config_argv(config))
+    record = {'config': config, 'metrics': {}, 'status': 'ok'}
+    setup_run_logging(run_dir)
+    # 温度扰动使用全局随机数生成器，每次运行按配置重新设定种子，新建和复用控制器的运行结果相同
+    np.random.seed(config['seed'])
+    with open(os.path.join(run_dir, 'stdout.log'), 'w') as f, contextlib.redirect_stdout(f):
+        try:
+            if args.power_profile is not None:
+                main.set_power_profile(args.power_profile)
+            else:
+                main.TARGET = DEFAULT_TARGET
+            if config['controller'] == 'rb':
+                control_sequence, state_trajectory, time_points = run_rb_simulation(args, run_dir)
+                telemetry = None
+            else:
+                mpc, built = _worker_controller(args, config)
+                logging.info("构建MPC控制器" if built else "复用工作进程的MPC控制器")
+                bm_for_simulation, cs_for_simulation = main.build_simulation_models(args)
+                simulate = main.run_pipelined_mpc_simulation if args.pipelined else main.run_mpc_simulation
+                control_sequence, state_trajectory, time_points = simulate(
+                    args, mpc, bm_for_simulation, cs_for_simulation, run_dir)
+                telemetry = mpc.telemetry
+                telemetry.save(run_dir)
+            main.save_results(args, time_points, state_trajectory, control_sequence, run_dir)
+            record['metrics'] = run_metrics(args, control_sequence, state_trajectory, config['eval_steps'], telemetry)
+        except Exception as e:
+            logging.exception("运行失败")
+            record['status'] = f'failed: {type(e).__name__}: {e}'
+    record['wall_time'] = time.time() - start_time
+    if record['status'] == 'ok':
+        with open(os.path.join(run_dir, 'metrics.json'), 'w') as f:
+            json.dump(record, f, indent=2)
+    return record
+
+def run_group(tasks):
+    """依次完成一组共用MPC控制器的运行，tasks 为 [(config, run_dir), ...]"""
+    return [run_config(config, run_dir) for config, run_dir in tasks]
+
+def collect_table(configs, output_dir):
+    """把所有已完成运行的配置和指标汇总为一张表 summary.csv"""
+    rows = []
+    for config in configs:
+        metrics_file = os.path.join(output_dir, config_hash(config), 'metrics.json')
+        if not os.path.exists(metrics_file):
+            continue
+        with open(metrics_file) as f:
+            record = json.load(f)
+        rows.append(dict({'run': config_hash(config)}, **{name: config[name] for name, _ in GRID_PARAMS},
+                         wall_time=record['wall_time'], **record['metrics']))
+    if not rows:
+        return None
+    columns = list(dict.fromkeys(k for row in rows for k in row))
+    table_file = os.path.join(output_dir, 'summary.csv')
+    with open(table_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    return table_file
+
+def get_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='闭环仿真的并行参数扫描')
+    parser.add_argument('--controller', type=str, default='mpc', help='控制器类型，逗号分隔：mpc, rb')
+    parser.add_argument('--T_amb', type=str, default='35', help='环境温度（℃），逗号分隔')
+    parser.add_argument('--init_soc', type=str, default='0.6', help='电池初始SOC，逗号分隔')
+    parser.add_argument('--N', type=str, default='100', help='MPC预测时域，逗号分隔')
+    parser.add_argument('--n_control', type=str, default='5', help='每次应用的控制步数，逗号分隔')
+    parser.add_argument('--modules', type=str, default=None,
+                        help='模块数，逗号分隔，每个模块数使用 --profile_pattern 对应的功率曲线；缺省使用宁波数据')
+    parser.add_argument('--profile_pattern', type=str, default='results/harbor/{K}.csv', help='模块数K对应的功率曲线文件')
+    parser.add_argument('--seed', type=str, default='0', help='温度扰动的随机种子，逗号分隔')
+    parser.add_argument('--total_steps', type=int, default=3600,
+                        help='每次运行的仿真步数（秒），指标统计前 total_steps 减最大预测时域的步数')
+    parser.add_argument('--main_args', type=str, default='',
+                        help='传给 main.py 的其他参数，须用等号连接，如 --main_args="--formulation lean --warm_start"')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='工作进程数，0表示在当前进程中依次运行')
+    parser.add_argument('--output', type=str, default='results/sweep', help='输出目录，每次运行的结果在以配置哈希命名的子目录中')
+    parser.add_argument('--force', action='store_true', help='重新运行已完成的配置')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = get_args()
+    configs = build_grid(args)
+    os.makedirs(args.output, exist_ok=True)
+
+    # 跳过已完成的运行，其余按MPC构建参数分组，同一组在一个工作进程中共用MPC控制器
+    groups, skipped = {}, 0
+    for config in configs:
+        run_dir = os.path.join(args.output, config_hash(config))
+        if not args.force and os.path.exists(os.path.join(run_dir, 'metrics.json')):
+            skipped += 1
+            continue
+        os.makedirs(run_dir, exist_ok=True)
+        with open(os.path.join(run_dir, 'config.json'), 'w') as f:
+            json.dump(config, f, indent=2)
+        key = f"rb-{config_hash(config)}" if config['controller'] == 'rb' else mpc_key(config)
+        groups.setdefault(key, []).append((config, run_dir))
+    print(f"共{len(configs)}个配置，跳过已完成的{skipped}个，运行{len(configs) - skipped}个（{len(groups)}组）")
+
+    start_time = time.time()
+    if args.workers:
+        with ProcessPoolExecutor(args.workers) as executor:
+            futures = [executor.submit(run_group, tasks) for tasks in groups.values()]
+            for future in as_completed(futures):
+                for record in future.result():
+                    print(f"[{time.time() - start_time:.0f}s] {config_hash(record['config'])} {record['status']} "
+                          f"({record['wall_time']:.1f}s)")
+    else:
+        for tasks in groups.values():
+            for record in run_group(tasks):
+                print(f"[{time.time() - start_time:.0f}s] {config_hash(record['config'])} {record['status']} "
+                      f"({record['wall_time']:.1f}s)")
+
+    table_file = collect_table(configs, args.output)
+    print(f"汇总表已保存到: {table_file}")
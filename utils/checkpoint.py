@@ -0,0 +1,68 @@
+import os
+import pickle
+import logging
+import numpy as np
+
+CHECKPOINT_FILE = 'checkpoint.pkl'
+
+def capture_state(loop, bm, cs, mpc, trace):
+    """
+    汇总闭环仿真的完整状态
+    :param loop: 仿真循环的变量（时间步、当前状态、已记录的结果等）
+    :param bm: 仿真电池模型
+    :param cs: 仿真冷却系统模型
+    :param mpc: MPC控制器
+    :param trace: TraceWriter
+    """
+    SOH_predictor = getattr(bm, 'SOH_predictor', None)
+    return {
+        'loop': loop,
+        'battery': bm.get_state(),
+        'SOH_charge_time': getattr(SOH_predictor, 'charge_time', None),  # SOH模型每次推理后累加
+        'cooling': cs.get_state(),
+        'rng': np.random.get_state(),  # 温度扰动使用全局随机数生成器
+        'mpc': mpc.get_state(),
+        'trace': trace.get_state()
+    }
+
+def restore_state(state, bm, cs, mpc, trace):
+    """
+    把 capture_state 保存的状态恢复到新构建的模型、控制器和轨迹记录上
+    :return: 仿真循环的变量
+    """
+    bm.set_state(state['battery'])
+    if state['SOH_charge_time'] is not None:
+        bm.SOH_predictor.charge_time = state['SOH_charge_time']
+    cs.set_state(state['cooling'])
+    np.random.set_state(state['rng'])
+    mpc.set_state(state['mpc'])
+    trace.set_state(state['trace'])
+    return state['loop']
+
+def save_checkpoint(log_dir, state):
+    """
+    写入检查点：先写临时文件再替换，写入过程中进程被终止时保留上一次的检查点
+    :return: 检查点文件路径
+    """
+    path = os.path.join(log_dir, CHECKPOINT_FILE)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+    return path
+
+def load_checkpoint(log_dir):
+    """读取检查点，不存在时返回None"""
+    path = os.path.join(log_dir, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        state = pickle.load(f)
+    logging.info(f"从检查点恢复: {path}，第{state['loop']['i']*state['loop']['dt']}秒")
+    return state
+
+def remove_checkpoint(log_dir):
+    """仿真完成后删除检查点：轨迹的块文件会在合并后删除，完成的运行不能再从检查点恢复"""
+    path = os.path.join(log_dir, CHECKPOINT_FILE)
+    if os.path.exists(path):
+        os.remove(path)
+        logging.info(f"仿真已完成，删除检查点: {path}")
@@ -1,3 +1,6 @@
+import math
+from functools import reduce
+import numpy as np
 import casadi as ca
 
 def exp(x):
@@ -20,6 +23,10 @@ def max(*args):
     """CasADi符号化的最大值函数，支持多参数"""
     return ca.fmax(*args)  # 解包参数传递给 ca.fmax
 
+def sigmoid(x):
+    """CasADi符号化的sigmoid函数，用于平滑的阶跃"""
+    return 1 / (1 + ca.exp(-x))
+
 def if_else(cond, expr_true, expr_false):
     """符号化条件判断函数"""
     return ca.if_else(cond, expr_true, expr_false)
@@ -30,4 +37,70 @@ def logical_eq(x, y):
 
 def logical_le(x, y):
     """符号化小于等于判断"""
-    return x <= y
\ No newline at end of file
+    return x <= y
+
+class CasadiMath:
+    """CasADi后端，用于构建MPC的符号表达式（数值输入时返回DM）"""
+    exp = staticmethod(exp)
+    sqrt = staticmethod(sqrt)
+    log = staticmethod(log)
+    power = staticmethod(power)
+    min = staticmethod(min)
+    max = staticmethod(max)
+    sigmoid = staticmethod(sigmoid)
+    if_else = staticmethod(if_else)
+
+class NumpyMath:
+    """
+    数值后端，用于仿真模型：标量（float）输入走 math 模块，数组输入走 NumPy，
+    避免每个标量运算都构造CasADi的DM对象
+    """
+    @staticmethod
+    def exp(x):
+        return math.exp(x) if isinstance(x, float) else np.exp(x)
+
+    @staticmethod
+    def sqrt(x):
+        return math.sqrt(x) if isinstance(x, float) else np.sqrt(x)
+
+    @staticmethod
+    def log(x):
+        return math.log(x) if isinstance(x, float) else np.log(x)
+
+    @staticmethod
+    def power(x, y):
+        return np.power(x, y)
+
+    @staticmethod
+    def min(*args):
+        """与 ca.fmin 相同，忽略nan"""
+        return reduce(np.fmin, args)
+
+    @staticmethod
+    def max(*args):
+        """与 ca.fmax 相同，忽略nan"""
+        return reduce(np.fmax, args)
+
+    @staticmethod
+    def sigmoid(x):
+        # 用tanh表示，大的负输入时不会溢出
+        if isinstance(x, float):
+            return 0.5 * (1 + math.tanh(0.5 * x))
+        return 0.5 * (1 + np.tanh(0.5 * x))
+
+    @staticmethod
+    def if_else(cond, expr_true, expr_false):
+        if isinstance(cond, (bool, np.bool_)):
+            return expr_true if cond else expr_false
+        return np.where(cond, expr_true, expr_false)
+
+MATH_BACKENDS = {'casadi': CasadiMath, 'numpy': NumpyMath}
+
+def get_math_backend(name):
+    """
+    按名称获取数学后端
+    :param name: 'casadi'（MPC的控制模型，需要符号表达式）或 'numpy'（仿真模型）
+    """
+    if name not in MATH_BACKENDS:
+        raise ValueError(f"未知的数学后端: {name}，可选 {list(MATH_BACKENDS)}")
+    return MATH_BACKENDS[name]
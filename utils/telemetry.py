@@ -0,0 +1,89 @@
+import os
+import logging
+import numpy as np
+
+# 每次求解记录的固定字段，其余为求解器统计中的 t_proc_* / t_wall_* 耗时
+TELEMETRY_FIELDS = ('step', 'attempt', 'source', 'wall_time', 'iter_count', 'return_status', 'success',
+                    'objective', 'violation')
+
+class SolverTelemetry:
+    """
+    MPC求解遥测：记录每一次求解尝试的耗时、迭代次数、返回状态和解的质量，
+    仿真结束后按列保存为npz，并输出延迟分位数和失败率的汇总
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def record(self, step, attempt, source, wall_time, stats, objective=np.nan, violation=np.nan):
+        """
+        记录一次求解尝试
+        :param step: 当前时间步
+        :param attempt: 本时间步内的尝试序号（从0开始）
+        :param source: 初始猜测的来源，如 'shift'、'ramp'、'rti'
+        :param wall_time: 求解耗时 (s)
+        :param stats: 求解器统计（opti.stats() 或 nlpsol.stats()）
+        :param objective: 目标函数值
+        :param violation: 最大约束违反量
+        """
+        row = {
+            'step': step,
+            'attempt': attempt,
+            'source': source,
+            'wall_time': wall_time,
+            'iter_count': stats.get('iter_count', -1),
+            'return_status': stats.get('return_status', ''),
+            'success': bool(stats.get('success', False)),
+            'objective': objective,
+            'violation': violation
+        }
+        row.update({k: v for k, v in stats.items() if k.startswith(('t_proc_', 't_wall_'))})
+        self.records.append(row)
+
+    def columns(self):
+        """按列整理记录，缺失的耗时项以nan补齐"""
+        names = list(TELEMETRY_FIELDS)
+        names += sorted({k for row in self.records for k in row} - set(TELEMETRY_FIELDS))
+        return {name: np.array([row.get(name, np.nan) for row in self.records]) for name in names}
+
+    def summary(self):
+        """
+        汇总统计：每个时间步的总求解耗时（含重试）的分位数，以及单次尝试和时间步的失败率
+        """
+        columns = self.columns()
+        steps, index = np.unique(columns['step'], return_inverse=True)
+        step_time = np.bincount(index, weights=columns['wall_time']) * 1000
+        step_success = np.bincount(index, weights=columns['success']) > 0
+        return {
+            'steps': len(steps),
+            'attempts': len(self.records),
+            'latency_p50_ms': np.percentile(step_time, 50),
+            'latency_p95_ms': np.percentile(step_time, 95),
+            'latency_p99_ms': np.percentile(step_time, 99),
+            'latency_max_ms': np.max(step_time),
+            'attempt_failure_rate': 1 - np.mean(columns['success']),
+            'step_failure_rate': 1 - np.mean(step_success),
+            'iter_count_mean': np.mean(columns['iter_count'])
+        }
+
+    def save(self, log_dir, name='solver_telemetry'):
+        """
+        保存到日志目录：<name>.npz 为逐次尝试的列数据，<name>_summary.txt 为汇总统计
+        """
+        if not self.records:
+            logging.warning("没有求解遥测记录")
+            return None
+        data_file = os.path.join(log_dir, f"{name}.npz")
+        np.savez(data_file, **self.columns())
+
+        summary = self.summary()
+        summary_file = os.path.join(log_dir, f"{name}_summary.txt")
+        with open(summary_file, 'w') as f:
+            f.write("=== MPC求解遥测汇总 ===\n")
+            for key, value in summary.items():
+                f.write(f"{key}: {value:.4g}\n")
+        logging.info(f"MPC求解遥测: 时间步{summary['steps']}个, 尝试{summary['attempts']}次, "
+                     f"延迟P50 {summary['latency_p50_ms']:.2f}ms, P95 {summary['latency_p95_ms']:.2f}ms, "
+                     f"P99 {summary['latency_p99_ms']:.2f}ms, 时间步失败率{summary['step_failure_rate']:.2%}")
+        logging.info(f"求解遥测已保存至: {data_file}")
+        return summary
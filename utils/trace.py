@@ -0,0 +1,99 @@
+import os
+import glob
+import shutil
+import logging
+import numpy as np
+
+# 仿真每一步记录的字段：状态、控制量和诊断量（冷却量、产热、环境热交换、电流、功率、电流限制等）
+TRACE_FIELDS = ('step', 'time', 'temp', 'temp_next', 'temp_noise', 'comp_power', 'Q_cool', 'Q_gen', 'Q_ambient',
+                'I_pack', 'P_response', 'P_target', 'SOC', 'I_max_limit', 'I_min_limit', 'I_cell_max_discharge',
+                'I_cell_max_charge', 'U_cell', 'T_clnt_out', 'SOH_loss')
+
+class TraceWriter:
+    """
+    仿真轨迹的列式记录：每个字段一个预分配的NumPy缓冲区，写满 chunk_size 步后整块写入
+    <log_dir>/<name>_chunks/ 下的一个npz文件，仿真结束时（close）合并为 <log_dir>/<name>.npz。
+    仿真中途退出时已写入的块仍可用 load_trace 读取。
+    """
+
+    def __init__(self, log_dir, fields=TRACE_FIELDS, chunk_size=4096, name='trace'):
+        """
+        :param log_dir: 输出目录
+        :param fields: 记录的字段
+        :param chunk_size: 每块的步数
+        :param name: 输出文件名（不含扩展名）
+        """
+        self.fields = tuple(fields)
+        self.chunk_size = chunk_size
+        self.path = os.path.join(log_dir, f"{name}.npz")
+        self.chunk_dir = os.path.join(log_dir, f"{name}_chunks")
+        os.makedirs(self.chunk_dir, exist_ok=True)
+        self._buffers = {field: np.full(chunk_size, np.nan) for field in self.fields}
+        self._rows = 0  # 当前块已记录的步数
+        self._chunks = 0  # 已写入的块数
+
+    def record(self, **values):
+        """记录一步，未给出的字段为nan；值可以是标量或只含一个元素的数组（如SOH模型的 (1, 1, 1) 输出）"""
+        row = self._rows
+        for field, value in values.items():
+            self._buffers[field][row] = np.asarray(value, dtype=float).reshape(-1)[0]
+        self._rows += 1
+        if self._rows == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """把当前块写入文件并清空缓冲区"""
+        if self._rows == 0:
+            return
+        chunk_file = os.path.join(self.chunk_dir, f"{self._chunks:05d}.npz")
+        np.savez(chunk_file, **{field: buffer[:self._rows] for field, buffer in self._buffers.items()})
+        for buffer in self._buffers.values():
+            buffer.fill(np.nan)
+        self._rows = 0
+        self._chunks += 1
+
+    def get_state(self):
+        """获取未写入文件的缓冲数据和已写入的块数，用于检查点"""
+        return {
+            'rows': self._rows,
+            'chunks': self._chunks,
+            'buffers': {field: buffer[:self._rows].copy() for field, buffer in self._buffers.items()}
+        }
+
+    def set_state(self, state):
+        """
+        恢复 get_state 保存的状态，删除检查点之后写入的块
+        :param state: get_state 返回的字典
+        """
+        for chunk_file in glob.glob(os.path.join(self.chunk_dir, '*.npz')):
+            if int(os.path.splitext(os.path.basename(chunk_file))[0]) >= state['chunks']:
+                os.remove(chunk_file)
+        self._rows = state['rows']
+        self._chunks = state['chunks']
+        for field, buffer in self._buffers.items():
+            buffer.fill(np.nan)
+            buffer[:self._rows] = state['buffers'][field]
+
+    def close(self):
+        """写入剩余的数据，合并所有块为一个npz文件"""
+        self.flush()
+        # 没有记录任何一步时（如仿真步数小于预测时域）写入空的列
+        columns = load_trace(self.chunk_dir) or {field: np.empty(0) for field in self.fields}
+        np.savez(self.path, **columns)
+        shutil.rmtree(self.chunk_dir)
+        logging.info(f"仿真轨迹已保存至: {self.path}（{len(columns[self.fields[0]])}步, {len(self.fields)}个字段）")
+        return self.path
+
+def load_trace(path):
+    """
+    读取仿真轨迹
+    :param path: 合并后的npz文件，或仿真中途退出时的块目录
+    :return: dict，字段名到一维数组
+    """
+    if os.path.isdir(path):
+        chunks = [np.load(chunk_file) for chunk_file in sorted(glob.glob(os.path.join(path, '*.npz')))]
+        if not chunks:
+            return {}
+        return {field: np.concatenate([chunk[field] for chunk in chunks]) for field in chunks[0].files}
+    with np.load(path) as data:
+        return {field: data[field] for field in data.files}